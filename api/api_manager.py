@@ -1,3 +1,4 @@
+import codecs
 import json
 from typing import Any
 
@@ -130,3 +131,19 @@ async def request_get_async(base_url: str, req_url: str, params):
         except aiohttp.ClientError as e:
             log.warning(f'http请求失败，异常信息: {e}')
             return None
+
+
+async def request_get_stream(base_url: str, req_url: str, params, chunk_size=65536):
+    """
+    异步GET请求，响应内容分块返回，不在内存中保存完整响应
+    req_url: 请求接口的路径
+    返回: 异步生成器，逐块返回响应文本，请求失败时抛出 aiohttp.ClientError
+    """
+    url = f"{base_url}{req_url}"
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, params=params) as response:
+            response.raise_for_status()  # 如果状态码不是200-299，这将引发ClientError异常
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield decoder.decode(chunk)
+            yield decoder.decode(b'', final=True)
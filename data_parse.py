@@ -1,18 +1,14 @@
-import asyncio
 import datetime
 import json
-import os
 import pprint
 import time
 import uuid
 
-import pandas as pd
-import snap7.util
-from bigtree import tree_to_dict
 from logger import log
 from asyncua import ua
 
-from utils.helpers import data_type_from_string, round_half_up, code2format_str, node_path2id, convert_node_id
+from frame_template import frame_leaves
+from utils.helpers import round_half_up, code2format_str, node_path2id, convert_node_id
 from utils.time_util import get_current_time, filter_timestamp
 
 
@@ -20,6 +16,7 @@ def bytes_2_ua_data(datas: bytearray, byte_index: int, bit_index: int, var_type:
     """
     convert bytes to opcua data with type
     """
+    import snap7.util  # snap7 is loaded only when s7 device is configured
     match var_type:
         case ua.VariantType.Null:
             return None
@@ -133,11 +130,24 @@ def extract_leaf_keys_with_path(dictionary, current_path=""):
     return result
 
 
+def o2m_leaf(O2M_list, list_node, value, rtime):
+    """
+    add changed variable to O2M list, frame leaves of read path keep only value (static fields are in template)
+    """
+    if type(O2M_list) is frame_leaves:
+        O2M_list.add(list_node, value)
+    else:
+        O2M_list.append({"code": list_node['code'], "value": value, "dataType": list_node['DataTypeString'],
+                         "arrLen": list_node['ArrayDimensions'], "time": rtime})
+
+
 def json_from_list(datas: dict):
     """
-    pack json frame, input dict format: {'module':{}, 'list':[{},{}...]}
+    pack json frame, input dict format: {'module':{}, 'list':[{},{}...]}, list of frame leaves is assembled by template
     """
     try:
+        if type(datas['list']) is frame_leaves:
+            return datas['list'].frame(datas['module'])
         module = datas['module']
         datas.update(module)
         datas.pop('module')
@@ -152,7 +162,55 @@ def json_from_list(datas: dict):
         return {}
 
 
+def json_frames_from_modules(header: dict, modules: list, max_size: int):
+    """
+    pack modules to json frames, input module format: {'blockId','index','category',...,'list':[{},{}...]}
+    modules (and list of module larger than a frame) are split to several frames not larger than max size,
+    each frame has 'part' and 'parts' in data
+    :param header: fields of data in every frame
+    :return: [frame,...]
+    """
+    frame_id = str(uuid.uuid4())
+    head = json.dumps({"id": frame_id, "ask": False, "data": dict(header, part=0, parts=0)})
+    budget = max_size - len(head) - 32  # "modules" key and digits of part, parts
+    entries = []  # encoded modules, a module larger than budget is split by list
+    for m in modules:
+        text = json.dumps(m)
+        if len(text) <= budget or len(m.get('list', [])) <= 1:
+            entries.append(text)
+            continue
+        fields = {k: v for k, v in m.items() if k != 'list'}
+        base = len(json.dumps(dict(fields, list=[])))
+        items, size = [], base
+        for item in m['list']:
+            item_text = json.dumps(item)
+            if items and size + len(item_text) + 2 > budget:
+                entries.append(json.dumps(dict(fields, list=items)))
+                items, size = [], base
+            items.append(item)
+            size += len(item_text) + 2
+        if items:
+            entries.append(json.dumps(dict(fields, list=items)))
+
+    groups, group, size = [], [], 0
+    for text in entries:
+        if group and size + len(text) + 2 > budget:
+            groups.append(group)
+            group, size = [], 0
+        group.append(text)
+        size += len(text) + 2
+    groups.append(group)
+
+    frames = []
+    for part, group in enumerate(groups, 1):
+        data = json.dumps(dict(header, part=part, parts=len(groups)))
+        frames.append(f'{{"id": "{frame_id if part == 1 else uuid.uuid4()}", "ask": false, '
+                      f'"data": {data[:-1]}, "modules": [{", ".join(group)}]}}}}')
+    return frames
+
+
 def json_from_tree(node, current_time):
+    from bigtree import tree_to_dict
     # print(node)
     # tree to directory
     t2d = tree_to_dict(node, attr_dict={"code": "code", "value": "value", "DataTypeString": "dataType",
@@ -228,13 +286,13 @@ async def array_parse_o2m(dev, list_node, value, O2M, O2M_list, rtime, msg: list
             list_child = dev.code_to_node.get(code2format_str(list_node['blockId'], list_node['index'], list_node['category'], list_node['code']) + '_' + str(n))
         except:
             # msg.append(f'Failure to find {list_node["NodePath"]}/{n} in variable list.')
-            await asyncio.create_task(add_node_info(list_node, str(n), dev, base_dir))
+            add_node_info(list_node, str(n), dev)
             continue
 
         # verification node, value and datatype
         if list_child is None:
             # msg.append(f'Failure to find {list_node["NodePath"]}/{n} in variable list.')
-            await asyncio.create_task(add_node_info(list_node, str(n), dev, base_dir))
+            add_node_info(list_node, str(n), dev)
             continue
 
         # 增加数据类型对比, 如果读到的数据类型与map中的数据类型不一致则修改
@@ -266,51 +324,40 @@ async def array_parse_o2m(dev, list_node, value, O2M, O2M_list, rtime, msg: list
                 value[n] = value[n].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
                 value[n] = filter_timestamp(value[n])
                 # list_child["DataTypeString"] = "string"
-            O2M_list.append({"code": list_child["code"], "value": value[n], "dataType": list_child["DataTypeString"],"arrLen": list_child["ArrayDimensions"], "time": rtime})  # child's data type is single variable
+            o2m_leaf(O2M_list, list_child, value[n], rtime)  # child's data type is single variable
         list_child["value"] = value[n]  # update to node
     return value
 
-failed_node_paths = set()
+async def read_new_nodes_info(requests, dev):
+    """
+        批量读取map中不存在的变量信息(数组元素或结构体成员)
+    :param requests: [(父节点, 变量名称),...]
+    :param dev:
+    :return: [变量信息 or None,...]
+    """
+    paths = [f'{list_node["path"]}/{name}' for list_node, name in requests]
+    node_ids = [node_path2id(p) for p in paths]
+    results = await dev.linker.read_nodes_info([dev.linker.client.get_node(n) for n in node_ids], paths)
+
+    # 读取失败的变量转换NodeID后再读一次
+    retry = [i for i, r in enumerate(results) if r is None]
+    if retry:
+        again = await dev.linker.read_nodes_info([dev.linker.client.get_node(convert_node_id(node_ids[i])) for i in retry],
+                                                 [paths[i] for i in retry])
+        for i, r in zip(retry, again):
+            results[i] = r
+    return results
 
-async def add_node_info(list_node, name, dev, base_dir):
+
+def add_node_info(list_node, name, dev):
     """
-        自动追加变量到map和表中去,使用asyncio.create_task 不阻塞主线任务
+        自动追加变量到map和表中去, 由设备的后台发现任务完成, 不阻塞读取解析
     :param list_node:
     :param name:
     :param dev:
     :return:
     """
-    node_path = None
-    try:
-        node_path = f'{list_node["path"]}/{name}'
-        node_id = node_path2id(node_path)
-        node = dev.linker.client.get_node(node_id)
-        try:
-            result = await dev.linker.read_node_info(node, node_path)
-        except:
-            node_id = convert_node_id(node_id)
-            node = dev.linker.client.get_node(node_id)
-            result = await dev.linker.read_node_info(node, node_path)
-        new_key = code2format_str(result['blockId'], result['index'], result['category'], result['code'])
-        dev.code_to_node[new_key] = result  #  添加到map映射中
-
-        # 添加到表中
-        csv_file = base_dir / f'{dev.name}.csv'
-        df = pd.DataFrame([result])
-        # 检查文件是否存在
-        try:
-            existing_df = pd.read_csv(csv_file)
-            df.to_csv(csv_file, mode='a', header=False, index=False)
-        except FileNotFoundError:
-            df.to_csv(csv_file, mode='w', header=True, index=False)
-        print(f"{get_current_time()}自动新增变量 {node_path} 成功")
-        log.info(f"自动新增变量 {node_path} 成功")
-    except Exception as e:
-        # 仅记录一次该 node_path 添加异常
-        print(f"自动添加变量信息失败: {node_path}，请使用工具手动刷新，{e}")
-        if node_path not in failed_node_paths:
-            failed_node_paths.add(node_path)
-            log.warning(f"自动添加变量信息失败: {node_path}，请使用工具手动刷新，{e}")
+    dev.discovery.request(list_node, name)
 
 
 async def check_data_type(list_child, dev, base_dir) -> bool:
@@ -342,32 +389,13 @@ async def check_data_type(list_child, dev, base_dir) -> bool:
         log.info(f"检测到NodeID: {node_id}变量类型不一致，开始更新变量类型")
         list_child["DataType"] = type_result["DataType"]
         list_child["DataTypeString"] = type_result["DataTypeString"]
+        dev.value_types.pop(node_id, None)
         print(f"{get_current_time()} 内存已更新 NodeID: {node_id}")
         log.info(f"内存已更新 NodeID: {node_id}")
 
-        # 持久化到CSV
-        try:
-            file_path = base_dir / f'{dev.name}.csv'
-            df = pd.read_csv(file_path)
-
-            if node_id not in df['NodeID'].values:
-                log.warning(f"CSV中不存在NodeID: {node_id}")
-                return True  # 内存已更新，返回True
-
-            # 更新数据
-            df.loc[df['NodeID'] == node_id, 'DataType'] = type_result["DataType"]
-            df.loc[df['NodeID'] == node_id, 'DataTypeString'] = type_result["DataTypeString"]
-
-            # 原子化写入
-            temp_path = f"{file_path}.tmp"
-            df.to_csv(temp_path, index=False, encoding='utf-8')
-            os.replace(temp_path, file_path)
-
-            print(f"{get_current_time()} CSV成功更新 NodeID: {node_id}")
-            log.info(f"CSV已更新 NodeID: {node_id}")
-        except Exception as e:
-            log.warning(f"CSV更新失败 NodeID: {node_id}, 错误: {str(e)}")
-            return True  # 内存已更新，返回True
+        # 记录到日志文件，定期合并到CSV
+        dev.journal.record_type(node_id, type_result["DataType"], type_result["DataTypeString"])
+        log.info(f"类型变更已记录 NodeID: {node_id}")
 
         return True
 
@@ -396,17 +424,17 @@ async def struct_parse_o2m(dev, list_node, value: dict, O2M, O2M_list, rtime, ms
         except:
             # msg.append(f'Failure to find {list_node["NodePath"]}/{key} in variable list.')
             if key.startswith('_'):
-                await asyncio.create_task(add_node_info(list_node, key[1:], dev, base_dir))
+                add_node_info(list_node, key[1:], dev)
             else:
-                await asyncio.create_task(add_node_info(list_node, key, dev, base_dir))
+                add_node_info(list_node, key, dev)
             continue
         # verification node, value and datatype
         if list_child is None:
             # msg.append(f'Failure to find {list_node["NodePath"]}/{key} in variable list.')
             if key.startswith('_'):
-                await asyncio.create_task(add_node_info(list_node, key[1:], dev, base_dir))
+                add_node_info(list_node, key[1:], dev)
             else:
-                await asyncio.create_task(add_node_info(list_node, key, dev, base_dir))
+                add_node_info(list_node, key, dev)
             continue
 
         # 增加数据类型对比, 如果读到的数据类型与map中的数据类型不一致则修改
@@ -439,9 +467,7 @@ async def struct_parse_o2m(dev, list_node, value: dict, O2M, O2M_list, rtime, ms
                     value[key] = value[key].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
                     value[key] = filter_timestamp(value[key])
                     # list_child["DataTypeString"] = "string"
-                O2M_list.append(
-                    {"code": list_child["code"], "value": value[key], "dataType": list_child["DataTypeString"],
-                     "arrLen": list_child["ArrayDimensions"], "time": rtime})
+                o2m_leaf(O2M_list, list_child, value[key], rtime)
             list_child["value"] = value[key]
             # print(list_child)
         except Exception as e:
@@ -478,8 +504,7 @@ async def datas_parse_o2m(dev, list_node, value, O2M, O2M_list, rtime, msg, base
                 value = value.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
                 value = filter_timestamp(value)
                 # list_node["DataTypeString"] = "string"
-            O2M_list.append({"code": list_node['code'], "value": value, "dataType": list_node['DataTypeString'],
-                             "arrLen": list_node['ArrayDimensions'], "time": rtime})
+            o2m_leaf(O2M_list, list_node, value, rtime)
 
         # update variable value to node and list
         list_node['value'] = value
@@ -539,7 +564,7 @@ async def array_parse_m2o(dev, list_node, value, M2O, M2O_list, rtime, msg: list
         elif M2O_list is not None and (M2O is True or list_child['value'] != value[n]):  # mqtt2opcua
             if dev.link_type == 'opcua':
                 value_type = type(value[n])
-                original_type = data_type_from_string(list_child['DataTypeString'])
+                original_type = dev.value_type(list_child)
                 if (isinstance(value[n], int) and isinstance(original_type, type) and original_type is float) or \
                         (isinstance(value[n], int) and hasattr(original_type,
                                                                  '__name__') and original_type.__name__ == 'float'):
@@ -607,7 +632,7 @@ async def struct_parse_m2o(dev, list_node, value: dict, M2O, M2O_list, rtime, ms
         elif M2O_list is not None and (M2O is True or list_child["value"] != value[key]):  # mqtt2opcua
             if dev.link_type == 'opcua':
                 value_type = type(value[key])
-                original_type = data_type_from_string(list_child['DataTypeString'])
+                original_type = dev.value_type(list_child)
                 if (isinstance(value[key], int) and isinstance(original_type, type) and original_type is float) or \
                         (isinstance(value[key], int) and hasattr(original_type,
                                                             '__name__') and original_type.__name__ == 'float'):
@@ -650,7 +675,7 @@ async def datas_parse_m2o(dev, list_node, value, M2O, M2O_list, rtime, msg, base
         elif M2O_list is not None and (M2O is True or list_node['value'] != value):  # mqtt2opcua
             if dev.link_type == 'opcua':
                 value_type = type(value)
-                original_type = data_type_from_string(list_node['DataTypeString'])
+                original_type = dev.value_type(list_node)
                 if (isinstance(value, int) and isinstance(original_type, type) and original_type is float) or \
                         (isinstance(value, int) and hasattr(original_type,
                                                                  '__name__') and original_type.__name__ == 'float'):
@@ -716,8 +741,7 @@ def s7_array_parse(dev, list_node, datas, offset, M2O, M2O_list, O2M, O2M_list,
             try:
                 value_t = bytes_2_ua_data(datas, list_child["s7_start"] - offset, list_child["s7_bit"], child_type)  # bytes to value
                 if O2M_list is not None and (O2M is True or list_child["value"] != value_t):  # s7 2 client
-                    O2M_list.append({"code": list_child["code"], "value": value_t, "dataType": list_child["DataTypeString"],
-                                     "arrLen": list_child["ArrayDimensions"], "time": rtime})
+                    o2m_leaf(O2M_list, list_child, value_t, rtime)
             except:
                 value_t = None
                 msg.append(f'Failure to get {list_child["NodePath"]} value from s7 data, address/size:'
@@ -760,8 +784,7 @@ def s7_struct_parse(dev, list_node, datas, offset, M2O, M2O_list, O2M, O2M_list,
                         value_t = bytes_2_ua_data(datas, child["s7_start"] - offset, child["s7_bit"],
                                                   child_type)  # data to value
                         if O2M_list is not None and (O2M is True or child["value"] != value_t):  # opcua2mqtt
-                            O2M_list.append({"code": child["code"], "value": value_t, "dataType": child["DataTypeString"],
-                                             "arrLen": child["ArrayDimensions"], "time": rtime})
+                            o2m_leaf(O2M_list, child, value_t, rtime)
                     except:
                         value_t = None
                         msg.append(f'Failure to get {child["NodePath"]} value from s7 data, offset/address/size:'
@@ -794,8 +817,7 @@ def s7_datas_parse(dev, list_node, datas, M2O, M2O_list, O2M, O2M_list, rtime, m
             try:
                 value = bytes_2_ua_data(datas, 0, list_node["s7_bit"], node_type)  # data to value
                 if O2M_list is not None and (O2M is True or list_node["value"] != value):
-                    O2M_list.append({"code": list_node['code'], "value": value, "dataType": list_node['DataTypeString'],
-                                     "arrLen": list_node['ArrayDimensions'], "time": rtime})
+                    o2m_leaf(O2M_list, list_node, value, rtime)
                 elif M2O_list is not None and (M2O is True or list_node['value'] != value):
                     M2O_list.append({'node_id': list_node['NodeID'], 'datatype': list_node['DataType'], 'value': value})
             except:
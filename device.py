@@ -1,16 +1,25 @@
 import asyncio
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 import time
-import pandas as pd
 from asyncua.common.subscription import Subscription
 
-from asyncua import Client
+from asyncua import Client, ua
 
 from logger import log
-from data_parse import json_from_list, s7_datas_parse, datas_parse_o2m
+from startup_timing import startup
+from node_discovery import node_discovery
+from data_parse import json_from_list, s7_datas_parse, datas_parse_o2m, add_node_info
+from frame_template import frame_templates
 from opcua_link import opcua_linker, SubHandler
-from s7_link import s7_linker
-from utils.helpers import code2format_str
+from parse_worker import parse_pool
+from read_flight import read_single_flight
+from read_interest import read_interest
+from timed_clear import timed_clear_timer
+from value_cache import last_value_cache
+from write_aggregator import write_aggregator
+from utils.helpers import code2format_str, data_type_from_string
+from variable_journal import variable_journal, read_variables_csv
 
 
 async def async_cleanup(client, sub):
@@ -26,6 +35,22 @@ def cleanup(client, sub):
     asyncio.run(async_cleanup(client, sub))
 
 
+def put_drop_oldest(q: asyncio.Queue, item):
+    """
+    put item to bounded queue, drop the oldest item if queue is full
+    :return: dropped item, None if nothing is dropped
+    """
+    dropped = None
+    if q.full():
+        try:
+            dropped = q.get_nowait()
+            q.task_done()
+        except asyncio.QueueEmpty:
+            pass
+    q.put_nowait(item)
+    return dropped
+
+
 class device(object):
     """
     opcua device
@@ -40,7 +65,11 @@ class device(object):
         self.base_dir = base_dir
 
         # opcua linker
-        self.linker = opcua_linker(config) if config['link'] == 'opcua' else s7_linker(config)
+        if config['link'] == 'opcua':
+            self.linker = opcua_linker(config, base_dir / 'type cache')
+        else:  # snap7 is loaded only when s7 device is configured
+            from s7_link import s7_linker
+            self.linker = s7_linker(config)
 
         # module description in opcua device
         self.module = []
@@ -51,7 +80,7 @@ class device(object):
         self.VarTree = None  # big tree for nodes
         self.VarList = []  # self define dictionary for nodes
         self.code_to_node = {}
-        self.VarDf = pd.DataFrame()  # dataframe for nodes
+        self.value_types = {}  # NodeID --> python type of value written to variable
         self.VarNumber = 0
 
         # subscription description
@@ -61,10 +90,37 @@ class device(object):
 
         # period read variable block
         self.ReadBlock = []
-        self.TempReadBlock = []  # 创建一个临时读的block
+        self.read_flight = read_single_flight(self)  # single reads, overlapping requests are merged
+        self.interest = read_interest(self)  # variables read for consumers while their leases are alive
         self.ReadBlock_Number = 0
         self.Read_Failure_Count = 0
         self.Read_Times = 0
+        self.frame_templates = frame_templates()  # static json fragments of published variables
+
+        # update time and quality of variable values, read commands with max age are served from cache
+        self.value_cache = last_value_cache()
+
+        # read pipeline, read -> parse -> publish stage linked with bounded queue (drop oldest)
+        self.pipeline_enabled = config.get('pipeline', True)
+        self.pipeline_depth = config.get('pipeline_depth', 2)
+        self.parse_queue = None
+        self.publish_queue = None
+        self.pipeline_tasks = []
+        self.Parse_Drop_Count = 0
+        self.Publish_Drop_Count = 0
+
+        # parse reading datas in worker process, for very large device
+        self.process_parse = config.get('process_parse', False) and self.link_type == 'opcua'
+        self.parse_pool = None
+
+        # runtime corrections of variable list, compacted to csv file periodically
+        self.journal = variable_journal(self)
+
+        # discover variables missing in variable map in background
+        self.discovery = node_discovery(self)
+
+        # merge write commands of device
+        self.write_aggregator = write_aggregator(self, config.get('write_window', 0.02))
 
         # request event
         self.RequestEvent = []
@@ -73,6 +129,10 @@ class device(object):
         # timed clear server
         self.TimedClear = []
         self.TimedClear_Number = 0
+        self.timed_clear = timed_clear_timer(self)
+
+        # called after parsing of reading or subscription datas, check edge of watched variables
+        self.value_observers = [self.timed_clear.observe]
 
         # opcua device status information
         self.subscription_state = False
@@ -123,7 +183,6 @@ class device(object):
         create timed clear block
         """
         self.TimedClear = []
-        current_time = int(time.time() * 1000)
 
         # filter reading enable list
         tmp = list(filter(lambda x: x['timed_clear'] is True, self.VarList))
@@ -149,11 +208,11 @@ class device(object):
             # item['TreeNode'] = tree_node
             item['ListNode'] = list_node
             item['s7'] = s7_item
-            item['FalseTIme'] = current_time
 
             # add to read list
             self.TimedClear.append(item)
         self.TimedClear_Number = len(self.TimedClear)
+        self.timed_clear.load(self.TimedClear)
 
     async def load_variable_list(self):
         """
@@ -162,17 +221,16 @@ class device(object):
         # create variable dataframe with config file
         vars_csv = self.base_dir / f"{self.name}.csv"
         try:
-            self.VarDf = pd.read_csv(vars_csv, encoding='utf-8')
+            columns, var_list = read_variables_csv(vars_csv)
         except:
-            try:
-                self.VarDf = pd.read_csv(vars_csv, encoding='utf-8-sig')
-            except:
-                try:
-                    self.VarDf = pd.read_csv(vars_csv, encoding='gbk')
-                except:
-                    log.error(f'Failure to load {self.name}.csv file.')
-                    return False
-        # print(self.VarDf)
+            log.error(f'Failure to load {self.name}.csv file.')
+            return False
+
+        # replay runtime corrections which are not compacted to csv file
+        try:
+            self.journal.replay(var_list)
+        except Exception as e:
+            log.warning(f'Failure to replay journal of {self.name}: {e}')
 
         # create tree and list data structure
         # dict_tmp = tree_to_dict(big_tree, all_attrs=True)
@@ -183,9 +241,10 @@ class device(object):
         #     return False
 
         try:
-            self.VarList = self.VarDf.apply(lambda row: dict(row), axis=1).tolist()
+            self.VarList = var_list
             self.VarNumber = len(self.VarList)
             self.code_to_node = {f"{item['blockId']}_{item['index']}_{item['category']}_{item['code']}": item for item in self.VarList}
+            self.value_types = {}
             # pprint.pprint(self.VarList)
         except:
             self.VarNumber = 0
@@ -204,6 +263,7 @@ class device(object):
 
         # create read block
         self.create_read_block()
+        self.frame_templates.build(self.VarList)
         # pprint.pprint(self.ReadBlock)
         # print(f'Reading nodes of {self.name} is {self.ReadBlock_Number}.')
 
@@ -212,17 +272,39 @@ class device(object):
         # pprint.pprint(self.TimedClear)
         # print(f'Timed clear nodes of {self.name} is {self.TimedClear_Number}.')
 
+        # create worker process with replica of variable map
+        if self.process_parse:
+            self.shutdown_parse_pool()
+            try:
+                self.parse_pool = parse_pool(self)
+                log.info(f'{self.name} parse reading datas in worker process.')
+            except Exception as e:
+                self.parse_pool = None
+                log.warning(f'Failure to create parse worker process of {self.name}, parse in main process. {e}')
+
         self.loading = True
         return True
 
+    def shutdown_parse_pool(self):
+        """
+        shutdown worker process of parsing
+        """
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+
     async def connect(self):
         # connect to opcua device
         self.connecting = await self.linker.link()
 
     async def disconnect(self):
         # disconnect to opcua device
+        await self.stop_pipeline()
+        await self.timed_clear.stop()
+        await self.read_flight.close()
         await self.linker.unlink()
         self.connecting = False
+        self.value_cache.clear()
 
     async def get_connecting_state(self):
         self.connecting = await self.linker.get_link_state()
@@ -271,101 +353,312 @@ class device(object):
         node_infos:是否实时读变量，如果不为空则执行单次读  20250314
         """
         start_time = int(time.time() * 1000)
-        # prepare reading nodes and parsing buffer for reading opcua
-        nodes = []  # read nodes list [NodeID，...]
-        O2M_list = []  # parse data list [{'module':{},'list':[{},{},...]},...]
-        msg = []  # error message list
         if len(node_infos) == 0:  # 实时读变量
-            try:
-                for b in self.ReadBlock:  # scan read block list
-                    nodes.append(b['NodeID'])
-                    mt = {'module': b['module'], 'list': []}
-                    if mt not in O2M_list:
-                        O2M_list.append(mt)
-                # pprint.pprint(nodes)
-                # pprint.pprint(O2M_list)
-            except Exception as e:
-                log.warning(f'Failure to create reading nodes list: {e}.')
-                return False
-            # read value of nodes from opcua
-            datas = await self.linker.read_multi_variables(nodes, timeout=1.5)
-            read_time = int(time.time() * 1000)
+            read_block = self.ReadBlock
+            data_values = []
+            datas = await self.read_stage(read_block, start_time, data_values)
             if not datas:
-                log.warning(
-                    f'Failure to read opcua {self.name},{self.linker.uri}, using time {read_time - start_time}ms.')
                 return False
-            self.Read_Times += 1
-            # print(datas)
-            # print(self.ReadBlock)
-            # parse reading datas, and save single variable to list of corresponding module
-            for index, _ in enumerate(self.ReadBlock):
-                try:
-                    m = list(filter(lambda x: x['module'] == self.ReadBlock[index]['module'], O2M_list))[0]
-                    # datas_parse(self, self.ReadBlock[index]['TreeNode'], self.ReadBlock[index]['ListNode'],
-                    #             datas[index],
-                    #             False, None, self.O2M_All, m['list'], int(time.time() * 1000), msg)
-                    await datas_parse_o2m(self, self.ReadBlock[index]['ListNode'], datas[index], self.O2M_All, m['list'],
-                                    int(time.time() * 1000), msg, self.base_dir)
-
-                    # print parse error message
-                    # 2024/12/5 临时关闭打印
-                    for s in msg:
-                        # log.warning(s)
-                        print(s)
-                except Exception as e:
-                    log.warning(f'{e}Failure to parse {nodes[index]}{datas[index]}.')
-            parse_time = int(time.time() * 1000)
-
-            # pack module data and publish to mqtt
-            for md in O2M_list:
-                if md['list']:
-                    mqtt_frame = json_from_list(md)
-                    if mqtt_t.connecting is True:
-                        mqtt_t.publish(mqtt_t.pub_drv_data, mqtt_frame)
-
-            end_time = int(time.time() * 1000)
-
-            current_time = str(datetime.now().time())[:-7]  # collection time
-            # print(current_time, f'O2M {self.name} Timing: module x{len(O2M_list)},reading {read_time - start_time},'
-            #                     f'parsing {parse_time - read_time},publish {end_time - parse_time},'
-            #                     f'Total is {end_time - start_time}ms')
-        else:  # 单点读
-            self.create_temp_read_block(node_infos)
-            for node_info in node_infos:
-                nodes.append(node_info['NodeID'])
-                mt = {'module': node_info['module'], 'list': []}
-                if mt not in O2M_list:
-                    O2M_list.append(mt)
-            datas = await self.linker.read_multi_variables(nodes, timeout=1.5)
-            read_time = int(time.time() * 1000)
-            if not datas:
-                log.warning(
-                    f'Failure to read opcua {self.name},{self.linker.uri}, using time {read_time - start_time}ms.')
+
+            if self.pipeline_enabled:  # parse and publish in pipeline, next read is not waiting for them
+                self.start_pipeline(mqtt_t)
+                dropped = put_drop_oldest(self.parse_queue, (read_block, datas, data_values))
+                if dropped is not None:
+                    self.Parse_Drop_Count += 1
+                    log.warning(f'{self.name} parsing falls behind reading, drop oldest reading datas '
+                                f'(total {self.Parse_Drop_Count}).')
+                return True
+
+            O2M_list = await self.parse_stage(read_block, datas, data_values)
+            self.publish_stage(mqtt_t, O2M_list)
+        else:  # 单点读, merged with overlapping single reads of device
+            return await self.read_flight.read(self.create_temp_read_block(node_infos))
+        return True
+
+    async def read_temp_block(self, read_block, O2M_list=None):
+        """
+        single read of temporary read block via opcua or s7, values are parsed to variable map
+        :param read_block: read items of single read, owned by caller
+        :param O2M_list: parsed variables are added to list of corresponding module if not None
+        :return: success
+        """
+        start_time = int(time.time() * 1000)
+        data_values = None
+        if self.link_type == 'opcua':
+            data_values = []
+            datas = await self.linker.read_multi_variables([b['NodeID'] for b in read_block], timeout=1.5,
+                                                           data_values=data_values)
+        else:
+            datas = await self.linker.read_multi_variables([b['s7'] for b in read_block], timeout=1.5)
+        read_time = int(time.time() * 1000)
+        if not datas:
+            log.warning(f'Failure to read {self.link_type} {self.name},{self.linker.uri}, '
+                        f'using time {read_time - start_time}ms.')
+            return False
+        msg = []  # error message list
+        module_list = {}  # module key --> list of module in O2M_list
+        for b, value in zip(read_block, datas):
+            m_list = []
+            if O2M_list is not None:
+                key = (b['module']['blockId'], b['module']['index'], b['module']['category'])
+                m_list = module_list.get(key)
+                if m_list is None:
+                    m_list = module_list[key] = self.frame_templates.leaves(read_time)
+                    O2M_list.append({'module': b['module'], 'list': m_list})
+            try:
+                if self.link_type == 'opcua':
+                    await datas_parse_o2m(self, b['ListNode'], value, self.O2M_All, m_list, read_time, msg,
+                                          self.base_dir)
+                else:
+                    s7_datas_parse(self, b['ListNode'], value, False, None, self.O2M_All, m_list, read_time, msg,
+                                   self.base_dir)
+            except Exception as e:
+                log.warning(f'{e} Failure to parse {b["NodeID"]}{value}.')
                 return False
-            for index, _ in enumerate(self.TempReadBlock):
-                try:
-                    m = list(filter(lambda x: x['module'] == self.TempReadBlock[index]['module'], O2M_list))[0]
-                    await datas_parse_o2m(self, self.TempReadBlock[index]['ListNode'], datas[index], self.O2M_All, m['list'],
-                                    int(time.time() * 1000), msg, self.base_dir)
-                    # datas_parse(self, self.TempReadBlock[index]['TreeNode'], self.TempReadBlock[index]['ListNode'],
-                    #             datas[index],
-                    #             False, None, self.O2M_All, m['list'], int(time.time() * 1000), msg)
-
-                    # print parse error message
-                    # 2024/12/5 临时关闭打印
-                    for s in msg:
-                        # log.warning(s)
-                        print(s)
-                except Exception as e:
-                    log.warning(f'{e} Failure to parse {nodes[index]}{datas[index]}.')
-                    return False
+            self.sync_replica(b['ListNode'])
+        for s in msg:
+            print(s)
+        self.value_cache.record_block(read_block, data_values)
+        self.notify_value_observers()
         return True
 
+    async def read_stage(self, read_block, start_time, data_values=None):
+        """
+        pipeline stage 1: read value of read block nodes from opcua
+        :param data_values: DataValue (timestamps and status) of nodes are appended if not None
+        :return: datas list, empty list if failure
+        """
+        try:
+            nodes = [b['NodeID'] for b in read_block]  # read nodes list [NodeID，...]
+        except Exception as e:
+            log.warning(f'Failure to create reading nodes list: {e}.')
+            return []
+        datas = await self.linker.read_multi_variables(nodes, timeout=1.5, data_values=data_values, cyclic=True)
+        read_time = int(time.time() * 1000)
+        if not datas:
+            log.warning(
+                f'Failure to read opcua {self.name},{self.linker.uri}, using time {read_time - start_time}ms.')
+            return []
+        self.Read_Times += 1
+        self.interest.scan_done()
+        return datas
+
+    async def parse_stage(self, read_block, datas, data_values=None):
+        """
+        pipeline stage 2: parse reading datas, and save single variable to list of corresponding module
+        :param data_values: DataValue of reading, recorded to value cache after parsing
+        :return: O2M list [{'module':{},'list':[{},{},...]},...], or mqtt frames if parsing in worker process
+        """
+        if self.parse_pool is not None and read_block is self.ReadBlock:
+            try:
+                frames = await self.parse_stage_in_process(datas)
+                self.value_cache.record_block(read_block, data_values)
+                self.notify_value_observers()
+                return frames
+            except BrokenProcessPool:
+                log.warning(f'Parse worker process of {self.name} is broken, parse in main process.')
+                self.shutdown_parse_pool()
+
+        O2M_list = []  # parse data list [{'module':{},'list':[{},{},...]},...]
+        module_list = {}  # module key --> list of module in O2M_list
+        msg = []  # error message list
+        rtime = int(time.time() * 1000)  # scan time shared by all variables
+        for index, b in enumerate(read_block):
+            key = (b['module']['blockId'], b['module']['index'], b['module']['category'])
+            m_list = module_list.get(key)
+            if m_list is None:
+                m_list = module_list[key] = self.frame_templates.leaves(rtime)
+                O2M_list.append({'module': b['module'], 'list': m_list})
+            try:
+                await datas_parse_o2m(self, b['ListNode'], datas[index], self.O2M_All, m_list,
+                                      rtime, msg, self.base_dir)
+            except Exception as e:
+                log.warning(f'{e}Failure to parse {b["NodeID"]}{datas[index]}.')
+
+        # print parse error message
+        # 2024/12/5 临时关闭打印
+        for s in msg:
+            # log.warning(s)
+            print(s)
+        self.value_cache.record_block(read_block, data_values)
+        self.notify_value_observers()
+        return O2M_list
+
+    def notify_value_observers(self):
+        """
+        variable values are updated by parsing, call value observers
+        """
+        for observer in self.value_observers:
+            try:
+                observer()
+            except Exception as e:
+                log.warning(f'{self.name} value observer error: {e}')
+
+    async def parse_subscription(self, list_node, value, O2M, O2M_list, rtime, msg):
+        """
+        parse value of subscription variable, then call value observers
+        """
+        await datas_parse_o2m(self, list_node, value, O2M, O2M_list, rtime, msg, self.base_dir)
+        self.sync_replica(list_node)
+        self.value_cache.record(list_node, None, rtime)
+        self.notify_value_observers()
+
+    async def parse_stage_in_process(self, datas):
+        """
+        parse reading datas in worker process, the worker return encoded mqtt frames
+        """
+        frames, missing = await self.parse_pool.parse(datas, self.O2M_All, int(time.time() * 1000))
+
+        # variables are not in the map, discover in background and add to replica of worker
+        for parent_key, name in missing:
+            parent = self.code_to_node.get(parent_key)
+            if parent is None:
+                continue
+            add_node_info(parent, name, self)
+        return frames
+
+    async def refresh_module_info(self, module):
+        """
+        re-read data type and array dimensions of all variables of module with bulk reads,
+        update variable map and record type changes to journal
+        :return: number of changed variables
+        """
+        if self.link_type != 'opcua' or self.connecting is False:
+            return 0
+        variables = [n for n in self.code_to_node.values()
+                     if n['blockId'] == module['blockId'] and n['index'] == module['index']
+                     and n['category'] == module['category'] and n['NodeClass'] == ua.NodeClass.Variable.value]
+        if not variables:
+            return 0
+
+        nodes = [self.linker.client.get_node(n['NodeID']) for n in variables]
+        infos = await self.linker.read_nodes_info(nodes, [n['path'] for n in variables])
+        changed = 0
+        for n, info in zip(variables, infos):
+            if info is None:
+                continue
+            if n['DataType'] != info['DataType'] or n['DataTypeString'] != info['DataTypeString']:
+                n['DataType'] = info['DataType']
+                n['DataTypeString'] = info['DataTypeString']
+                self.value_types.pop(n['NodeID'], None)
+                self.journal.record_type(n['NodeID'], info['DataType'], info['DataTypeString'])
+                changed += 1
+            n['ArrayDimensions'] = info['ArrayDimensions']
+        log.info(f'Refresh module {module} of {self.name}: {len(variables)} variables, {changed} type changed.')
+        return changed
+
+    def node_discovered(self, key, list_node):
+        """
+        variable is added to map by discovery, add to replica of worker process
+        """
+        if self.parse_pool is not None:
+            self.parse_pool.add_node(key, list_node)
+
+    def value_type(self, list_node):
+        """
+        python type of value written to variable, resolved once per variable, removed when data type is changed
+        """
+        value_type = self.value_types.get(list_node['NodeID'], False)
+        if value_type is False:
+            value_type = self.value_types[list_node['NodeID']] = data_type_from_string(list_node['DataTypeString'])
+        return value_type
+
+    def sync_replica(self, list_node):
+        """
+        value of variable is changed in main process (subscription, single read, write, timed clear),
+        send to replica of worker process, otherwise changes are not detected by next parsing
+        """
+        if self.parse_pool is not None:
+            self.parse_pool.set_value(list_node)
+
+    def publish_stage(self, mqtt_t, O2M_list):
+        """
+        pipeline stage 3: pack module data and publish to mqtt
+        """
+        for md in O2M_list:
+            if isinstance(md, bytes):  # frame encoded by worker process
+                mqtt_frame = md
+            elif md['list']:
+                mqtt_frame = json_from_list(md)
+            else:
+                continue
+            if mqtt_frame and mqtt_t.connecting is True:
+                mqtt_t.publish(mqtt_t.pub_drv_data, mqtt_frame)
+                startup.first_publish(self.name)
+
+    def start_pipeline(self, mqtt_t):
+        """
+        start parse and publish stage of read pipeline, the stages are linked with bounded queues
+        """
+        if self.pipeline_tasks:
+            return
+        self.parse_queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        self.publish_queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        self.pipeline_tasks = [asyncio.create_task(self.parse_worker()),
+                               asyncio.create_task(self.publish_worker(mqtt_t))]
+
+    async def stop_pipeline(self):
+        """
+        stop read pipeline, datas in queue are discarded
+        """
+        for t in self.pipeline_tasks:
+            t.cancel()
+        if self.pipeline_tasks:
+            await asyncio.gather(*self.pipeline_tasks, return_exceptions=True)
+        self.pipeline_tasks = []
+        self.parse_queue = None
+        self.publish_queue = None
+
+    async def parse_worker(self):
+        """
+        parse stage worker of read pipeline
+        """
+        while True:
+            read_block, datas, data_values = await self.parse_queue.get()
+            try:
+                O2M_list = await self.parse_stage(read_block, datas, data_values)
+                dropped = put_drop_oldest(self.publish_queue, O2M_list)
+                if dropped is not None:
+                    self.Publish_Drop_Count += 1
+                    log.warning(f'{self.name} publishing falls behind parsing, drop oldest frames '
+                                f'(total {self.Publish_Drop_Count}).')
+            except Exception as e:
+                log.warning(f'{self.name} pipeline parsing error: {e}')
+            finally:
+                self.parse_queue.task_done()
+
+    async def publish_worker(self, mqtt_t):
+        """
+        publish stage worker of read pipeline
+        """
+        while True:
+            O2M_list = await self.publish_queue.get()
+            try:
+                self.publish_stage(mqtt_t, O2M_list)
+            except Exception as e:
+                log.warning(f'{self.name} pipeline publishing error: {e}')
+            finally:
+                self.publish_queue.task_done()
+
+    def read_items(self, list_nodes):
+        """
+        temporary read block of variables in variable map, without searching variable list
+        :return: read block of single read, not shared with other reads
+        """
+        read_block = []
+        for n in list_nodes:
+            read_block.append({'code': n['code'], 'NodeID': n['NodeID'],
+                               'module': {'blockId': n['blockId'], 'index': n['index'], 'category': n['category']},
+                               'ListNode': n,
+                               's7': {k: n[k] for k in ('s7_db', 's7_start', 's7_size') if k in n}})
+        return read_block
+
     def create_temp_read_block(self, node_infos):
         """
         20250314创建一个临时读的block
+        :return: read block of single read, not shared with other reads
         """
-        self.TempReadBlock.clear()
+        read_block = []
         module_key = ['blockId', 'index', 'category']
         key = ['code', 'NodeID', 'read_period', 'read_time', 'return_time']
         s7 = ['s7_db', 's7_start', 's7_size']
@@ -392,7 +685,8 @@ class device(object):
                 item['s7'] = s7_item
 
                 # add to read block[]
-                self.TempReadBlock.append(item)
+                read_block.append(item)
+        return read_block
 
     async def read_variable_block_vs7(self, mqtt_t):
         """
@@ -403,14 +697,10 @@ class device(object):
         try:
             s7_nodes = []
             nodes = []  # read nodes list [NodeID，...]
-            O2M_list = []  # parse data list [{'module':{},'list':[{},{},...]},...]
             msg = []  # error message list
             for b in self.ReadBlock:  # scan read block list
                 s7_nodes.append(b['s7'])
                 nodes.append(b['NodeID'])
-                mt = {'module': b['module'], 'list': []}
-                if mt not in O2M_list:
-                    O2M_list.append(mt)
             # pprint.pprint(nodes)
             # pprint.pprint(O2M_list)
         except Exception as e:
@@ -426,20 +716,29 @@ class device(object):
             log.warning(f'Failure to read s7 {self.name},{self.linker.uri}, using time {read_time - start_time}ms.')
             return False
         self.Read_Times += 1
+        self.interest.scan_done()
         # pprint.pprint(datas)
 
         # parse reading datas, and save single variable to list of corresponding module
-        for index, _ in enumerate(self.ReadBlock):
+        O2M_list = []  # parse data list [{'module':{},'list':[{},{},...]},...]
+        module_list = {}  # module key --> list of module in O2M_list
+        for index, b in enumerate(self.ReadBlock):
+            key = (b['module']['blockId'], b['module']['index'], b['module']['category'])
+            m_list = module_list.get(key)
+            if m_list is None:
+                m_list = module_list[key] = self.frame_templates.leaves(read_time)
+                O2M_list.append({'module': b['module'], 'list': m_list})
             try:
-                m = list(filter(lambda x: x['module'] == self.ReadBlock[index]['module'], O2M_list))[0]
-                s7_datas_parse(self, self.ReadBlock[index]['ListNode'], datas[index],
-                               False, None, self.O2M_All, m['list'], int(time.time() * 1000), msg, self.base_dir)
+                s7_datas_parse(self, b['ListNode'], datas[index],
+                               False, None, self.O2M_All, m_list, read_time, msg, self.base_dir)
                 # print parse error message
                 for s in msg:
                     log.info(s)
             except:
                 # print(str(datetime.now().time())[:-7], f'Failure to parse {nodes[index]}{datas[index]}.')
                 log.warning(f'Failure to parse {nodes[index]}{datas[index]}.')
+        self.value_cache.record_block(self.ReadBlock)
+        self.notify_value_observers()
         parse_time = int(time.time() * 1000)
 
         # pack module data and publish to mqtt
@@ -448,6 +747,7 @@ class device(object):
                 mqtt_frame = json_from_list(md)
                 if mqtt_frame:
                     mqtt_t.publish(mqtt_t.pub_drv_data, mqtt_frame)
+                    startup.first_publish(self.name)
                 # print(md)
         end_time = int(time.time() * 1000)
 
@@ -459,9 +759,10 @@ class device(object):
         #          read_time - start_time, parse_time - read_time, end_time - parse_time, end_time - start_time)
         return True
 
-    async def device_manager(self, link):
+    async def device_manager(self, link, supervisor):
         """
         opcua device manager
+        :param supervisor: reconnect supervisor, reconnect in background
         """
         # reconnect or disconnect device
         if self.connecting is True:  # connecting, disconnect
@@ -470,46 +771,29 @@ class device(object):
                 # print(f'Disconnect {dev.name}, {dev.connecting}.')
                 log.warning(f'Disconnect {self.name}, {self.connecting}.')
         elif link and self.loading:  # disconnecting, reconnect
-            self.Read_Times = 0
-            if self.link_type == 'opcua':
-                await self.linker.new_client()
-                await self.connect()
-                await self.subscribe()
-            else:
-                await self.connect()
-            print(f'Connect {self.name}, {self.connecting}.')
-            log.info(f'Connect {self.name}, {self.connecting}.')
+            supervisor.request(self)
 
-    async def timed_clear_safety_variable(self):
+    async def reconnect(self):
         """
-        # clear timed clear block
+        create new client, connect and subscribe
         """
-        current_time = int(time.time() * 1000)
-        M2O_list = []
-        for b in self.TimedClear:
-            if self.Read_Times < 3 or b['ListNode']["value"] is False:
-                b['FalseTIme'] = current_time
-            elif current_time - b['FalseTIme'] >= b['timed_clear_time']:
-                if self.link_type == 'opcua':
-                    M2O_list.append({'node_id': b['NodeID'], 'datatype': b['ListNode']['DataType'], 'value': False})
-                    log.info(f'Timed Clear {b["NodeID"]}, {current_time - b["FalseTIme"]} > {b["timed_clear_time"]}')
-                elif self.link_type == 's7':
-                    M2O_list.append({'s7_db': b["s7"]["s7_db"], 's7_start': b["s7"]["s7_start"],
-                                     's7_bit': b["s7"]["s7_bit"], 's7_size': b["s7"]["s7_size"], 'value': False})
-                    log.info(f'Timed Clear {b["NodeID"]} via s7, '
-                                f'{current_time - b["FalseTIme"]} > {b["timed_clear_time"]}')
-                b['ListNode']["value"] = False
-                b['FalseTIme'] = current_time
-
-        if M2O_list:
-            if self.link_type == 'opcua':
-                await self.linker.write_multi_variables(M2O_list, timeout=0.2)
-            elif self.link_type == 's7':
-                await self.linker.write_multi_variables(M2O_list)
+        self.Read_Times = 0
+        if self.link_type == 'opcua':
+            await self.linker.new_client()
+            await self.connect()
+            await self.subscribe()
+        else:
+            await self.connect()
+        print(f'Connect {self.name}, {self.connecting}.')
+        log.info(f'Connect {self.name}, {self.connecting}.')
 
     async def close(self):
         # await self.linker.subscription.delete()
         await self.disconnect()
+        await self.interest.stop()
+        await self.discovery.stop()
+        self.journal.compact()
+        self.shutdown_parse_pool()
         self.VarSubscription = []
         log.info(f"opcua device {self.name} (uri: {self.uri},main_node: {self.main_node}) is removed")
         return True
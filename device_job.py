@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+
+from logger import log
+
+
+class device_jobs(object):
+    """
+    background jobs of devices (connect, disconnect, reconnect), one job per device,
+    new job of device cancels the running one
+    """
+
+    def __init__(self):
+        self.jobs = {}  # device name --> (job id, action, task)
+        self.ids = itertools.count(1)
+
+    def busy(self, dev_name):
+        """
+        device has running job
+        """
+        job = self.jobs.get(dev_name)
+        return job is not None and not job[2].done()
+
+    def start(self, dev_name, action, job, done):
+        """
+        start job of device, return immediately
+        :param job: coroutine function of job without argument, return state
+        :param done: callback(job id, state, error) when job is finished, not called when job is cancelled
+        :return: job id
+        """
+        old = self.jobs.get(dev_name)
+        if old is not None and not old[2].done():
+            old[2].cancel()
+            log.info(f'Cancel job {old[0]} ({old[1]}) of {dev_name}.')
+        job_id = next(self.ids)
+        task = asyncio.create_task(self.run(dev_name, job_id, action, job, done, old[2] if old else None))
+        self.jobs[dev_name] = (job_id, action, task)
+        return job_id
+
+    async def run(self, dev_name, job_id, action, job, done, previous):
+        """
+        wait previous job of device cancelled, then run job
+        """
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            state = await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f'Failure to run job {job_id} ({action}) of {dev_name}: {e}')
+            done(job_id, False, str(e))
+        else:
+            done(job_id, state, None)
+        finally:
+            if self.jobs.get(dev_name, (None,))[0] == job_id:
+                del self.jobs[dev_name]
+
+    async def cancel(self, dev_name):
+        """
+        cancel running job of device
+        :return: job is cancelled
+        """
+        job = self.jobs.pop(dev_name, None)
+        if job is None or job[2].done():
+            return False
+        job[2].cancel()
+        await asyncio.gather(job[2], return_exceptions=True)
+        log.info(f'Cancel job {job[0]} ({job[1]}) of {dev_name}.')
+        return True
+
+    async def close(self):
+        """
+        cancel all jobs
+        """
+        for dev_name in list(self.jobs):
+            await self.cancel(dev_name)
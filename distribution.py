@@ -1,45 +1,22 @@
 import asyncio
+import functools
 import json
 import os
 import subprocess
 import sys
 import time
 from datetime import datetime
-import pandas as pd
 from mqtt_link import mqtt_linker
+from reconnect_supervisor import reconnect_supervisor
+from recipe_watch import recipe_watcher
+from device_job import device_jobs
 from device import device
 from logger import log
-from data_parse import nested_dict_2list, json_from_list, datas_parse_m2o, data_to_list, datas_parse_o2m
-from recipe import request_recipe_handle_gather_link, request_recipe_handle_gather_plc
+from data_parse import nested_dict_2list, json_from_list, json_frames_from_modules, datas_parse_m2o, data_to_list
+from startup_timing import startup
+from utils.csv_util import write_csv_rows
 from utils.helpers import code2format_str, save_config_file
-from utils.time_util import get_current_time
-
-
-def get_request_nodes(dev, node, request_update, request_update_id, request_update_result):
-    """
-    get request information with variable name in node tree
-    :param node: node
-    :return: request information dictionary
-    """
-    req_dict = {'request': dev.code_to_node.get(code2format_str(node['blockId'], node['index'], node['category'],
-                                                                node['code']+"_"+request_update)),
-                'id': dev.code_to_node.get(code2format_str(node['blockId'], node['index'], node['category'],
-                                                           node['code']+"_"+request_update_id)),
-                'result': dev.code_to_node.get(code2format_str(node['blockId'], node['index'], node['category'],
-                                                               node['code']+"_"+request_update_result))
-                }
-    return req_dict
-
-
-async def clear_request_result(dev, req):
-    """
-    clear request result to server
-    :param dev: device object
-    :param req: request information dictionary
-    :return: result of writing request result to server
-    """
-    M2O_list = [{'node_id': req['result']["NodeID"], 'datatype': req['result']["DataType"], 'value': 0}]
-    await dev.linker.write_multi_variables(M2O_list, 0.1)
+from utils.time_util import get_current_time, get_milliseconds
 
 
 class distribution_server(object):
@@ -55,9 +32,16 @@ class distribution_server(object):
 
         # opcua device
         self.ua_device = []
+        self.reconnect = None  # reconnect supervisor of devices, created in event loop
+        self.jobs = device_jobs()  # connect/disconnect/reconnect commands of devices
+        self.command_tasks = set()  # mqtt commands replied in background
 
         # mqtt interface
         self.mqtt = None
+        self.read_max_age = 0  # default max age (ms) of read_plc command served from value cache, 0: always read plc
+        self.mqtt_max_frame = 2 * 1024 * 1024  # frame size limit of broker, larger reply is split
+        self.interest_min_rate = 100  # fastest read rate (ms) of consumer interest
+        self.interest_max_ttl = 600  # longest lease (s) of consumer interest
 
         # distribution config
         self.config = {}
@@ -69,6 +53,10 @@ class distribution_server(object):
         self.recipe_request_map = {}
         self.recipe_valid_keys = []
         self.writable_keys = []
+        self.recipe_delta_write = True  # recipe download writes only values different from plc
+        self.recipe_handle = None  # recipe module (http client) is loaded only when recipe is configured
+        self.recipe_watchers = []  # recipe request watchers, triggered by value change of request flag
+        self.recipe_cache = None  # prefetched and parsed recipes
         self.RESTART_FLAG = False  #  当前主程序是否重启Flag
         self.browse_proc = None  # 记录遍历变量进程
 
@@ -90,13 +78,16 @@ class distribution_server(object):
             with open(drv_config, 'r', encoding='utf-8') as file:
                 self.config = json.load(file)
                 self.is_local = self.config["Control"]["isLocal"]
+                self.read_max_age = self.config["Control"].get("readMaxAge", 0)
+                self.mqtt_max_frame = self.config["Control"].get("mqttMaxFrame", 2 * 1024 * 1024)
+                self.interest_min_rate = self.config["Control"].get("interestMinRate", 100)
+                self.interest_max_ttl = self.config["Control"].get("interestMaxTtl", 600)
             # pprint.pprint(self.config)
 
             # save to drv_config.csv file
             list_data = []
             nested_dict_2list(self.config, list_data, 0)
-            df = pd.DataFrame(list_data)
-            df.to_csv(self.base_dir / 'drv_config.csv', encoding='utf_8_sig', index=False)
+            write_csv_rows(self.base_dir / 'drv_config.csv', list_data, encoding='utf_8_sig')
             print('Driver Config file loaded - done.')
             log.info('Driver Config file loaded - done.')
         except FileNotFoundError:
@@ -126,6 +117,15 @@ class distribution_server(object):
                     self.recipe_request_map[key] = mc_module
                 self.recipe_valid_keys = recipe_monitor_info['recipe_valid_keys']
                 self.writable_keys = recipe_monitor_info['writable_keys']
+                self.recipe_delta_write = recipe_monitor_info.get('delta_write', True)
+            if self.recipe_request_data and self.recipe_handle is None:
+                from recipe import request_recipe_handle_gather_link
+                from recipe_cache import recipe_cache
+                self.recipe_handle = request_recipe_handle_gather_link
+                self.recipe_cache = recipe_cache(recipe_monitor_info.get('cache_size', 16),
+                                                 recipe_monitor_info.get('cache_ttl', 300))
+            if self.is_local:
+                self.create_recipe_watchers()
             # pprint.pprint(self.recipe_config_data)
             print('Request Config file loaded - done.')
             log.info('Request Config file loaded - done.')
@@ -139,6 +139,44 @@ class distribution_server(object):
             log.warning(f'Failure to read {recipe_config}')
             return
 
+    def create_recipe_watchers(self):
+        """
+        watch request flag of modules (in request config file), registered as value observer of device
+        """
+        lock = asyncio.Lock()
+        for rr in self.recipe_request_data:
+            dev = self.find_dev_with_module(rr['module'])
+            if dev is None:
+                log.warning(f'Failure to match recipe request module {rr["module"]} to device.')
+                continue
+            watcher = recipe_watcher(rr, dev, self.recipe_request, lock)
+            watcher.resolve()
+            dev.value_observers.append(watcher.observe)
+            self.recipe_watchers.append(watcher)
+
+    async def recipe_request(self, watcher):
+        """
+        request recipe from server and write to device
+        """
+        # await request_recipe_handle(self, self.config['Server']['Basic']['recipe_req_url'], req, dev,
+        #                                  module, write_recipe_id)
+        # await request_recipe_handle_gather(self, self.config['Server']['Basic']['recipe_req_url'],
+        #                                         req, dev, module, write_recipe_id)  # 并发下发Recipe-单模组
+        # await request_recipe_handle_gather_plc(self, self.config['Server']['Basic']['recipe_req_url'],
+        #                                             req, dev, module, write_recipe_id)  # 并发下发Recipe - 单plc
+        await self.recipe_handle(self, self.config['Server']['Basic']['recipe_req_url'], watcher.req, watcher.dev,
+                                 watcher.module, watcher.write_recipe_id, self.ua_device, watcher.flow_index,
+                                 self.recipe_valid_keys, self.writable_keys, self.mqtt)  # 并发下发Recipe - 单link
+
+    def next_recipe_flow(self, flow_index):
+        """
+        next flow index of multi-flow recipe (in request config file), None if it is the last one
+        """
+        if flow_index is None:
+            return None
+        flows = sorted({rr['recipe_flow_index'] for rr in self.recipe_request_data if rr['recipe_flow_index'] > flow_index})
+        return flows[0] if flows else None
+
     def find_dev_with_module(self, module):
         """
         find device(PLC) with module, module{0_1_MC}-->device{MC}
@@ -219,6 +257,7 @@ class distribution_server(object):
             #             str(datetime.now().time())[:-7], result['ErrMSG'])
             await datas_parse_m2o(dev, list_node, value, self.M2O_All, result['M2O_list'],
                             str(datetime.now().time())[:-7], result['ErrMSG'], self.base_dir)
+            dev.sync_replica(list_node)
             code_value[n['code']] = n['value']
 
         result['Nodes'] = len(result['M2O_list'])
@@ -235,6 +274,7 @@ class distribution_server(object):
         :param dev: opcua device object
         :param module: module information (blockId, index, category)
         :param single: single read or struct read
+        :param is_from_plc: read from plc, unless values in cache are not older than maxAge (ms) of command
         :return: None
         """
         result = {'module': module, 'list': []}
@@ -267,21 +307,28 @@ class distribution_server(object):
                 self.mqtt.publish(topic + '/reply', json.dumps({'success': False,
                                                                 'message': f'Failure to find {n} in the list.'}))
                 return
-        if is_from_plc and len(read_vars_info) > 0:
-            try:
-                await dev.read_variable_block(self.mqtt, read_vars_info)
-            except Exception as e:
-                print(f"从PLC读数据错误{e}")
+        # values scanned within max age are served from cache, otherwise read from plc
+        max_age = data.get('maxAge', self.read_max_age if is_from_plc else None)
+        from_cache = max_age is None or all(dev.value_cache.is_fresh(node, max_age) for node in nodes)
+        message = 'OK'
+        if not from_cache and len(read_vars_info) > 0:
+            if dev.connecting is not True:
+                state = 'device is disconnected'
+            else:
+                try:
+                    state = await dev.read_variable_block(self.mqtt, read_vars_info)
+                except Exception as e:
+                    state = e
+            if state is not True:  # values of failed reading are cached values
+                log.warning(f'Failure to read {len(read_vars_info)} variables of {dev.name} for read: {state}.')
+                message = (f'Failure to read {len(read_vars_info)} variables from {dev.name}, '
+                           f'{"read failure" if state is False else state}.')
+                from_cache = True
 
         # get datas
         for node in nodes:
             try:
-                if single is True:  # single read
-                    # tree_to_list(node, result['list'], int(time.time() * 1000))
-                    data_to_list(node, result['list'], int(time.time() * 1000), dev)
-                else:  # struct read
-                    result['list'].append({"code": node["code"], "value": node["value"], "dataType": node["DataTypeString"],
-                                           "arrLen": node["ArrayDimensions"], "time": int(time.time() * 1000)})
+                self.node_to_list(dev, node, result['list'], single, max_age is not None)
             except:
                 log.warning(f'Failure to find {n} in the list, when mqtt read.')
                 self.mqtt.publish(topic + '/reply', json.dumps({'success': False,
@@ -290,22 +337,197 @@ class distribution_server(object):
 
         # mqtt publish
         # if self.mqtt.connecting is True and result['list']:
-        result.update({'success': True, 'message': 'OK'})
+        result.update({'success': message == 'OK', 'message': message})
+        if max_age is not None:
+            result['fromCache'] = from_cache
         mqtt_frame = json_from_list(result)
         self.mqtt.publish(topic + '/reply', mqtt_frame, 2)
-        log.info(f'MQTT Read {len(code_list)} nodes {code_list}, return {len(result["list"])} variables.')
+        log.info(f'MQTT Read {len(code_list)} nodes {code_list}, return {len(result["list"])} variables'
+                 f'{", from cache" if from_cache and max_age is not None else ""}.')
+
+    @staticmethod
+    def node_to_list(dev, node, t2l, single=True, quality=False):
+        """
+        add value of variable to list of read reply
+        :param single: leaves of structure or array are added, otherwise the variable
+        :param quality: add timestamps and quality of value cache
+        """
+        start = len(t2l)
+        if single is True:  # single read
+            # tree_to_list(node, t2l, int(time.time() * 1000))
+            data_to_list(node, t2l, int(time.time() * 1000), dev)
+        else:  # struct read
+            t2l.append({"code": node["code"], "value": node["value"], "dataType": node["DataTypeString"],
+                        "arrLen": node["ArrayDimensions"], "time": int(time.time() * 1000)})
+        if quality:
+            fields = dev.value_cache.quality(node)
+            for item in t2l[start:]:
+                item.update(fields)
+
+    async def mqtt_cmd_read_multi(self, frame_id, data, topic):
+        """
+        read command of several modules with one combined reply, split if larger than frame limit of broker
+        data: {'cmd':'read_multi','modules':[{'blockId','index','category','list':[{'code'},...],'struct':False},...],
+               'fromPlc':False,'maxAge':ms}
+        fresh values are requested with fromPlc or maxAge, stale variables are read with one read per device,
+        module fails if read of its device fails, fromCache of module and reply tells whether cached values are returned
+        :param frame_id: id of command frame, returned as requestId
+        :return: None
+        """
+        try:
+            requests = list(data['modules'])
+        except:
+            log.warning(f'Failure to get modules from {data} of mqtt frame.')
+            self.mqtt.publish(topic + '/reply', json.dumps({'success': False, 'requestId': frame_id,
+                                                            'message': f'Failure to get modules from {data}.'}))
+            return
+        from_plc = data.get('fromPlc', False) is True
+        max_age = data.get('maxAge', self.read_max_age if from_plc else None)
+
+        # resolve modules and variables in one pass
+        module_dev = {(m['blockId'], m['index'], m['category']): dev for dev in self.ua_device for m in dev.module}
+        reads = []  # [(reply module, device, variables, single),...]
+        stale = {}  # device --> {path: variable}, read from plc
+        for req in requests:
+            try:
+                module = {'blockId': req['blockId'], 'index': req['index'], 'category': req['category']}
+                entry = dict(module, list=[])
+                dev = module_dev.get((req['blockId'], req['index'], req['category']))
+                if dev is None:
+                    entry.update({'success': False, 'message': f'Failure to match {module} to device.'})
+                    reads.append((entry, None, [], True))
+                    continue
+                nodes = []
+                missing = []
+                for n in req.get('list', []):
+                    list_node = dev.code_to_node.get(code2format_str(module['blockId'], module['index'],
+                                                                     module['category'], n['code']))
+                    if list_node is None:
+                        missing.append(n['code'])
+                    else:
+                        nodes.append(list_node)
+                entry.update({'success': not missing,
+                              'message': f'Failure to find {missing} in the variable list.' if missing else 'OK'})
+                if max_age is not None:
+                    for node in nodes:
+                        if not dev.value_cache.is_fresh(node, max_age):
+                            stale.setdefault(dev, {})[node['path']] = node
+                reads.append((entry, dev, nodes, req.get('struct', False) is not True))
+            except Exception as e:
+                reads.append(({'success': False, 'message': f'Failure to get module and codes from {req}: {e}.',
+                               'list': []}, None, [], True))
+
+        # at most one read per device, devices are read concurrently
+        devices = [d for d in stale if d.connecting is True]
+        states = await asyncio.gather(*[d.read_flight.read(d.read_items(list(stale[d].values()))) for d in devices],
+                                      return_exceptions=True)
+        failures = {d: 'device is disconnected' for d in stale if d.connecting is not True}  # device --> reason
+        for d, state in zip(devices, states):
+            if state is not True:
+                failures[d] = 'read failure' if state is False else f'{state}'
+                log.warning(f'Failure to read {len(stale[d])} variables of {d.name} for read_multi: {state}.')
+
+        # combined reply, values of failed device are cached values
+        from_cache = True
+        for entry, dev, nodes, single in reads:
+            if max_age is not None and dev is not None:
+                read_nodes = [n for n in nodes if n['path'] in stale.get(dev, {})]
+                if read_nodes and dev in failures:
+                    message = f'Failure to read {len(read_nodes)} variables from {dev.name}, {failures[dev]}.'
+                    entry.update({'success': False,
+                                  'message': message if entry['success'] else f'{entry["message"]} {message}'})
+                entry['fromCache'] = not read_nodes or dev in failures
+                from_cache = from_cache and entry['fromCache']
+            for node in nodes:
+                try:
+                    self.node_to_list(dev, node, entry['list'], single, max_age is not None)
+                except Exception as e:
+                    entry.update({'success': False, 'message': f'Failure to get value of {node["code"]}: {e}.'})
+        header = {'cmd': 'read_multi', 'requestId': frame_id, 'success': True, 'message': 'OK'}
+        if max_age is not None:
+            header['fromCache'] = from_cache
+        frames = json_frames_from_modules(header, [r[0] for r in reads], self.mqtt_max_frame)
+        for mqtt_frame in frames:
+            self.mqtt.publish(topic + '/reply', mqtt_frame, 2)
+        log.info(f'MQTT Read {len(requests)} modules, read {sum(len(v) for v in stale.values())} variables from '
+                 f'{len(devices)} devices, return {len(frames)} frames.')
+
+    def mqtt_cmd_interest(self, frame_id, data, topic):
+        """
+        register, renew or cancel consumer interest, variables are read at requested rate while lease is alive
+        data: {'cmd':'interest','leaseId':'','rate':ms,'ttl':s,
+               'modules':[{'blockId','index','category','list':[{'code'},...]},...]}, empty list for whole module
+              {'cmd':'interest_cancel','leaseId':''}
+        :return: None
+        """
+        try:
+            lease_id = str(data['leaseId'])
+        except:
+            log.warning(f'Failure to get leaseId from {data} of mqtt frame.')
+            self.mqtt.publish(topic + '/reply', json.dumps({'success': False, 'id': frame_id,
+                                                            'message': f'Failure to get leaseId from {data}.'}))
+            return
+        if data['cmd'] == 'interest_cancel':
+            cancelled = [dev.name for dev in self.ua_device if dev.interest.cancel(lease_id)]
+            log.info(f'Cancel read interest {lease_id} of {cancelled}.')
+            self.mqtt.publish(topic + '/reply', json.dumps({'success': True, 'id': frame_id, 'leaseId': lease_id,
+                                                            'message': 'OK'}))
+            return
 
-    async def mqtt_cmd_write(self, frame_id, data, topic):
+        rate = max(data.get('rate', 1000), self.interest_min_rate) / 1000
+        ttl = min(data.get('ttl', 30), self.interest_max_ttl)
+        module_dev = {(m['blockId'], m['index'], m['category']): dev for dev in self.ua_device for m in dev.module}
+        dev_nodes = {}  # device --> [variable,...]
+        missing = []
+        try:
+            for req in data['modules']:
+                key = (req['blockId'], req['index'], req['category'])
+                dev = module_dev.get(key)
+                if dev is None:
+                    missing.append(f'{key}')
+                    continue
+                nodes = dev_nodes.setdefault(dev, [])
+                if not req.get('list'):  # whole module, variables of variable list
+                    for n in dev.VarList:
+                        if (n['blockId'], n['index'], n['category']) == key:
+                            list_node = dev.code_to_node.get(code2format_str(*key, n['code']))
+                            if list_node is not None and list_node.get('NodeID'):
+                                nodes.append(list_node)
+                    continue
+                for n in req['list']:
+                    list_node = dev.code_to_node.get(code2format_str(*key, n['code']))
+                    if list_node is None:
+                        missing.append(f'{key}{n["code"]}')
+                    else:
+                        nodes.append(list_node)
+        except Exception as e:
+            log.warning(f'Failure to get modules from {data} of mqtt frame: {e}')
+            self.mqtt.publish(topic + '/reply', json.dumps({'success': False, 'id': frame_id,
+                                                            'message': f'Failure to get modules from {data}.'}))
+            return
+
+        # lease of device is replaced, devices not in request are cancelled
+        for dev in self.ua_device:
+            if dev_nodes.get(dev):
+                dev.interest.register(lease_id, dev_nodes[dev], rate, ttl, self.mqtt)
+            else:
+                dev.interest.cancel(lease_id)
+        count = sum(len(v) for v in dev_nodes.values())
+        log.info(f'Read interest {lease_id}: {count} variables of {[d.name for d in dev_nodes]}, '
+                 f'rate {rate * 1000:.0f}ms, ttl {ttl}s.')
+        self.mqtt.publish(topic + '/reply', json.dumps({
+            'success': not missing, 'id': frame_id, 'leaseId': lease_id, 'variables': count, 'rate': round(rate * 1000),
+            'ttl': ttl, 'message': f'Failure to find {missing}.' if missing else 'OK'}))
+
+    async def mqtt_cmd_write(self, frame_id, data, topic, wait=True):
         """
         write command handle for mqtt subscription command
         :param data: data
         :param topic: mqtt topic
-        :param dev: opcua device object
-        :param module: module information (blockId, index, category)
+        :param wait: wait writing finish, or reply in background (write is merged with other commands of device)
         :return: None
         """
         start_time = int(time.time() * 1000)
-        success = False
         message = ''
 
         # parse json datas
@@ -324,31 +546,55 @@ class distribution_server(object):
             if result['Device'].connecting is False:
                 message = f'Failure to write opcua {result["Device"].name}, not linked.'
                 log.warning(message)
+            elif result['Device'].link_type not in ['opcua', 's7']:
+                message = f'Invalid link type: {result["Device"].link_type}.'
             else:
-                if result['Device'].link_type == 'opcua':  # write via opcua
-                    success = await result['Device'].linker.write_multi_variables(result['M2O_list'], 0.5)
-                    if success is False:  # write opcua failure, read and check
-                        success = await result['Device'].linker.check_write_result(result['M2O_list'])
-                elif result['Device'].link_type == 's7':  # write via s7
-                    success = await result['Device'].linker.write_multi_variables(result['M2O_list'], 0.5)
+                # write via opcua or s7, merged with other write commands of device
+                future = result['Device'].write_aggregator.submit(result['M2O_list'])
+                reply = self.mqtt_cmd_write_reply(frame_id, topic, result['Device'], future, start_time, parse_time)
+                if wait:
+                    await reply
                 else:
-                    message = f'Invalid link type: {result["Device"].link_type}.'
-                write_time = int(time.time() * 1000)
-
-                if success is True:
-                    message = 'OK'
-                    device_name = result['Device'].name
-                    print(str(datetime.now().time())[:-7],
-                          f'M2O {device_name} Timing: parsing {parse_time - start_time},'
-                          f'writing {write_time - parse_time},'
-                          f'Total is {write_time - start_time}, {message}')
-                    log.info(f'M2O {device_name} Timing: parsing {parse_time - start_time},'
-                             f'writing {write_time - parse_time}, Total is {write_time - start_time}, {message}')
-                elif message == '':
-                    message = f'Failure to write {result["Device"].name} via {result["Device"].link_type}.'
+                    self.run_command_task(reply, 'write')
+                return
+
+        self.mqtt.publish(topic + '/reply', json.dumps({'success': False, 'id': frame_id, 'message': message}))
+
+    async def mqtt_cmd_write_reply(self, frame_id, topic, dev, future, start_time, parse_time):
+        """
+        wait merged write result and reply to write command
+        """
+        success = await future
+        write_time = int(time.time() * 1000)
+
+        if success is True:
+            message = 'OK'
+            print(str(datetime.now().time())[:-7],
+                  f'M2O {dev.name} Timing: parsing {parse_time - start_time},'
+                  f'writing {write_time - parse_time},'
+                  f'Total is {write_time - start_time}, {message}')
+            log.info(f'M2O {dev.name} Timing: parsing {parse_time - start_time},'
+                     f'writing {write_time - parse_time}, Total is {write_time - start_time}, {message}')
+        else:
+            message = f'Failure to write {dev.name} via {dev.link_type}.'
 
         self.mqtt.publish(topic + '/reply', json.dumps({'success': success, 'id': frame_id, 'message': message}))
 
+    def run_command_task(self, coro, cmd):
+        """
+        reply mqtt command in background, task is kept until finished, exception of command is logged
+        """
+        task = asyncio.create_task(coro)
+        self.command_tasks.add(task)
+
+        def done(t):
+            self.command_tasks.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                log.warning(f'Failure to run mqtt {cmd} command: {t.exception()}')
+
+        task.add_done_callback(done)
+        return task
+
     async def mqtt_cmd_parse(self, frame_id, data, topic):
         """
         mqtt subscription command handle
@@ -356,6 +602,18 @@ class distribution_server(object):
         :param topic: mqtt topic
         :return: None
         """
+        # command of several modules
+        if isinstance(data, dict) and data.get('cmd') == 'read_multi':
+            print(f'{get_current_time()}:接收到Mqtt read_multi指令: {len(data.get("modules", []))}个模组')
+            log.info(f'接收到Mqtt read_multi指令:{data}')
+            # reply in background, overlapping plc reads of device are merged
+            self.run_command_task(self.mqtt_cmd_read_multi(frame_id, data, topic), 'read_multi')
+            return
+        if isinstance(data, dict) and data.get('cmd') in ('interest', 'interest_cancel'):
+            log.info(f'接收到Mqtt {data["cmd"]}指令:{data}')
+            self.mqtt_cmd_interest(frame_id, data, topic)
+            return
+
         # find opcua device and module information
         try:
             module = {'blockId': data['blockId'], 'index': data['index'], 'category': data['category']}
@@ -389,15 +647,17 @@ class distribution_server(object):
             case 'read_plc':  # 单次从plc读数据，不需要实时刷
                 print(f'{get_current_time()}:接收到Mqtt read_plc指令:{data}')
                 log.info(f'接收到Mqtt read_plc指令:{data}')
-                await self.mqtt_cmd_read(data, topic, dev, module, is_from_plc=True)
+                # reply in background, overlapping plc reads of device are merged
+                self.run_command_task(self.mqtt_cmd_read(data, topic, dev, module, is_from_plc=True), cmd)
             case 'read_plc_struct':
                 print(f'{get_current_time()}:接收到Mqtt read_plc_struct指令:{data}')
                 log.info(f'接收到Mqtt read_plc_struct指令:{data}')
-                await self.mqtt_cmd_read(data, topic, dev, module, single=False, is_from_plc=True)
+                self.run_command_task(self.mqtt_cmd_read(data, topic, dev, module, single=False, is_from_plc=True),
+                                      cmd)
             case 'write':
                 print(f'{get_current_time()}:接收到Mqtt write指令:{data}')
                 log.info(f'接收到Mqtt write指令:{data}')
-                await self.mqtt_cmd_write(frame_id, data, topic)
+                await self.mqtt_cmd_write(frame_id, data, topic, wait=False)
             case 'write_recipe':
                 print(f'{get_current_time()}:接收到Mqtt write_recipe指令:{data}')
                 log.info(f'接收到Mqtt write_recipe指令:{data}')
@@ -519,34 +779,18 @@ class distribution_server(object):
                 command_content = data.get("commandContent")
                 dev_name = command_content.get("devName")
                 if module == current_driver:
-                    state = await self.dev_reconnect(dev_name)
-                    if state:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': True, 'message': f'{current_driver["blockId"]}_{current_driver["index"]}_{current_driver["category"]}: {dev_name}模组重连成功'}))
-                    else:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': False, 'message': f'{current_driver["blockId"]}_{current_driver["index"]}_{current_driver["category"]}: {dev_name}模组重连失败，请重试'}))
+                    prefix = f'{current_driver["blockId"]}_{current_driver["index"]}_{current_driver["category"]}: '
+                    self.start_device_job(command_type, dev_name, topic,
+                                          (f'{prefix}{dev_name}模组重连成功', f'{prefix}{dev_name}模组重连失败，请重试'))
                 elif not data.get("blockId", "") and not data.get("index", "") and not data.get("category", ""):
-                    state = await self.dev_reconnect(dev_name)
-                    if state:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': True,
-                                                      'message': f'{dev_name}模组重连成功'}))
-                    else:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': False,
-                                                      'message': f'{dev_name}模组重连失败，请重试'}))
+                    self.start_device_job(command_type, dev_name, topic,
+                                          (f'{dev_name}模组重连成功', f'{dev_name}模组重连失败，请重试'))
             elif command_type == "DEV_DISCONNECT":  # 设备断连指令
                 command_content = data.get("commandContent")
                 dev_name = command_content.get("devName")
                 if module == current_driver:
-                    state = await self.disconnect_dev(dev_name)
-                    if state:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': True, 'message': f'{dev_name}模组断开连接成功'}))
-                    else:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': False, 'message': f'{dev_name}模组断开连接失败，请重试'}))
+                    self.start_device_job(command_type, dev_name, topic,
+                                          (f'{dev_name}模组断开连接成功', f'{dev_name}模组断开连接失败，请重试'))
                 # else:
                 #     self.mqtt.publish(topic + '/reply',
                 #                       json.dumps({'success': False,
@@ -555,17 +799,29 @@ class distribution_server(object):
                 command_content = data.get("commandContent")
                 dev_name = command_content.get("devName")
                 if module == current_driver:
-                    state = await self.connect_dev(dev_name)
-                    if state:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': True, 'message': f'{dev_name}模组连接成功'}))
-                    else:
-                        self.mqtt.publish(topic + '/reply',
-                                          json.dumps({'success': False, 'message': f'{dev_name}模组连接失败，请重试'}))
+                    self.start_device_job(command_type, dev_name, topic,
+                                          (f'{dev_name}模组连接成功', f'{dev_name}模组连接失败，请重试'))
                 # else:
                 #     self.mqtt.publish(topic + '/reply',
                 #                       json.dumps({'success': False,
                 #                                   'message': f'未匹配到模组：{module["blockId"]}_{module["index"]}_{module["category"]}'}))
+            elif command_type == "DEV_JOB_CANCEL":  # 取消设备连接/断连/重连任务
+                command_content = data.get("commandContent")
+                dev_name = command_content.get("devName")
+                if module == current_driver:
+                    state = await self.jobs.cancel(dev_name)
+                    if state:
+                        self.mqtt.publish(topic + '/reply',
+                                          json.dumps({'success': True, 'message': f'{dev_name}模组任务已取消'}))
+                    else:
+                        self.mqtt.publish(topic + '/reply',
+                                          json.dumps({'success': False, 'message': f'{dev_name}模组没有运行中的任务'}))
+            elif command_type == "REFRESH_MODULE_INFO":  # 重新读取模组变量的数据类型和数组长度
+                command_content = data.get("commandContent")
+                if module == current_driver:
+                    target = {'blockId': command_content.get('blockId'), 'index': command_content.get('index'),
+                              'category': command_content.get('category')}
+                    self.run_command_task(self.refresh_module_info(target, topic), command_type)
             elif command_type == "MODIFY_CONFIG":  # 修改配置内容
                 command_content = data.get("commandContent")
                 if module == current_driver:
@@ -857,7 +1113,7 @@ class distribution_server(object):
         try:
             # datas_parse(dev, sub['TreeNode'], sub['ListNode'], value,
             #             False, None, self.O2M_All, O2M_list[0]['list'], int(time.time() * 1000), msg)
-            asyncio.create_task(datas_parse_o2m(dev, sub['ListNode'], value,self.O2M_All, O2M_list[0]['list'], int(time.time() * 1000), msg, self.base_dir))
+            asyncio.create_task(dev.parse_subscription(sub['ListNode'], value, self.O2M_All, O2M_list[0]['list'], int(time.time() * 1000), msg))
             # print parse error message
             for s in msg:
                 print(s)
@@ -872,60 +1128,6 @@ class distribution_server(object):
                 if mqtt_frame:
                     self.mqtt.publish(self.mqtt.pub_drv_data, mqtt_frame)
 
-    async def request_task(self):
-        """
-        request recipe task
-        """
-        # define modules (in request config file) request recipe
-        for rr in self.recipe_request_data:
-            module = rr['module']
-            write_recipe_id = rr['write_recipe_id']
-            dev = self.find_dev_with_module(module)
-            # print(module, dev.name, dev.connecting)
-            if dev is not None:
-                if dev.connecting is True:
-                    try:
-                        node = dev.code_to_node.get(code2format_str(module['blockId'], module['index'],
-                                                                    module['category'], rr['request_node_path']))
-                        if node:
-                            if rr['recipe_flow_index'] == 0:
-                                flow_index = None
-                            else:
-                                flow_index = rr['recipe_flow_index']
-
-                            req = get_request_nodes(dev, node, rr['recipe_request_update'],
-                                                    rr['recipe_request_id'], rr['recipe_request_result'])
-                            if req["id"] is None or req["request"] is None or req["result"] is None:
-                                return
-                            if req['request']["value"] is True and req['result']["value"] == 0:  #
-                                # trigger to request recipe
-                                # await request_recipe_handle(self, self.config['Server']['Basic']['recipe_req_url'], req, dev,
-                                #                                  module, write_recipe_id)
-                                # await request_recipe_handle_gather(self, self.config['Server']['Basic']['recipe_req_url'],
-                                #                                         req, dev, module, write_recipe_id)  # 并发下发Recipe-单模组
-                                # await request_recipe_handle_gather_plc(self, self.config['Server']['Basic']['recipe_req_url'],
-                                #                                             req, dev, module, write_recipe_id)  # 并发下发Recipe - 单plc
-                                await request_recipe_handle_gather_link(self, self.config['Server']['Basic']['recipe_req_url'],
-                                                                            req, dev, module, write_recipe_id, self.ua_device, flow_index, self.recipe_valid_keys, self.writable_keys, self.mqtt)  # 并发下发Recipe - 单link
-                            elif req['request']["value"] is False and (req['result']["value"] != 0):
-                                await clear_request_result(dev, req)
-                    except Exception as e:
-                        log.warning(f'向模组{module}写配方异常{e},请检查各模组的Recipe Valid和Writable状态')
-
-    async def timed_clear_task(self):
-        """
-        timed to clear safety control variable
-        """
-        # start opcua device task
-        tasks = []
-        for dev in self.ua_device:  # scan device
-            if dev.TimedClear and dev.loading is True and dev.connecting is True:  # and dev.TimedClear:
-                tasks.append(asyncio.create_task(dev.timed_clear_safety_variable()))
-
-        # wait all task finish
-        if tasks:
-            await asyncio.gather(*tasks)
-
     async def opcua_device_read_task(self):
         """
         read device task
@@ -994,8 +1196,8 @@ class distribution_server(object):
             tasks = []
             for dev in self.ua_device:  # scan device
                 dev_cfg = self.config['Opcua'][dev.name]
-                if dev.loading is True:
-                    tasks.append(asyncio.create_task(dev.device_manager(dev_cfg['Control']['Link'])))
+                if dev.loading is True and not self.jobs.busy(dev.name):  # device is managed by command job
+                    tasks.append(asyncio.create_task(dev.device_manager(dev_cfg['Control']['Link'], self.reconnect)))
                 # loading status to config
                 dev_cfg['Status']['Load'] = dev.loading
                 dev_cfg['Status']['Linking'] = dev.connecting
@@ -1105,7 +1307,9 @@ class distribution_server(object):
 
             # Load variable list if configured
             if dev_cfg['Control']['Load'] is True:
+                start_time = time.time()
                 await dev.load_variable_list()
+                startup.record('variable map load', dev.name, time.time() - start_time)
                 print(f'Load {dev.name} variable list, {dev.loading}.')
                 print(f'--Module is {dev.module_number}, Variable is {dev.VarNumber},'
                       f'Reading Block is {dev.ReadBlock_Number}.')
@@ -1120,8 +1324,10 @@ class distribution_server(object):
             # Connect to OPC UA device if configured
             if dev_cfg['Control']['Link'] is True:
                 if dev.loading is True:
+                    start_time = time.time()
                     await dev.connect()
                     await dev.subscribe()
+                    startup.record('connect', dev.name, time.time() - start_time)
                     print(f'Connect {dev.name}, {dev.connecting}.')
                     print(f'--Subscription {dev.subscription_state},'
                           f'Subscription variable is {dev.Subscription_Nodes_Number}.')
@@ -1157,10 +1363,28 @@ class distribution_server(object):
         """
         close opcua device
         """
+        await self.jobs.close()
+        for watcher in self.recipe_watchers:
+            await watcher.stop()
+        if self.recipe_cache is not None:
+            await self.recipe_cache.close()
         for dev in self.ua_device:
+            if self.reconnect is not None:
+                await self.reconnect.cancel(dev)
             if dev.connecting is True:
                 await dev.disconnect()
                 print(f'device {dev.name}, linking:{dev.connecting}')
+            await dev.interest.stop()
+            await dev.discovery.stop()
+            dev.journal.compact()
+            dev.shutdown_parse_pool()
+
+    def journal_compact_task(self):
+        """
+        compact runtime corrections of variable list to csv file of devices
+        """
+        for dev in self.ua_device:
+            dev.journal.compact()
 
     def initialize_mqtt(self):
         """
@@ -1190,6 +1414,47 @@ class distribution_server(object):
         except Exception as e:
             print(f'close mqtt error:{e}')
 
+    def start_device_job(self, command_type, dev_name, topic, messages):
+        """
+        run device command in background, command is acknowledged immediately,
+        result is replied and broadcast when job is finished
+        :param messages: (success message, failure message)
+        """
+        actions = {'DEV_RECONNECT': self.dev_reconnect, 'DEV_DISCONNECT': self.disconnect_dev,
+                   'DEV_CONNECT': self.connect_dev}
+
+        def done(job_id, state, error):
+            result = {'success': bool(state), 'jobId': job_id, 'message': messages[0] if state else messages[1]}
+            if error:
+                result['error'] = error
+            self.mqtt.publish(topic + '/reply', json.dumps(result))
+            self.mqtt.publish(self.mqtt.pub_drv_broadcast, json.dumps({
+                "timestamp": get_milliseconds(),
+                "type": "DeviceJobDone",
+                "data": {'devName': dev_name, 'commandType': command_type, **result}
+            }))
+
+        job_id = self.jobs.start(dev_name, command_type, functools.partial(actions[command_type], dev_name), done)
+        self.mqtt.publish(topic + '/reply', json.dumps({'success': True, 'accepted': True, 'jobId': job_id,
+                                                        'message': f'{dev_name}: {command_type} 已受理'}))
+
+    async def refresh_module_info(self, module, topic):
+        """
+        re-read data type and array dimensions of variables of module, reply number of changed variables
+        """
+        dev = self.find_dev_with_module(module)
+        if dev is None:
+            self.mqtt.publish(topic + '/reply', json.dumps({'success': False,
+                                                            'message': f'Failure to match {module} to device.'}))
+            return
+        if dev.link_type != 'opcua' or dev.connecting is not True:
+            self.mqtt.publish(topic + '/reply', json.dumps({'success': False,
+                                                            'message': f'{dev.name} is not connected opcua device.'}))
+            return
+        changed = await dev.refresh_module_info(module)
+        self.mqtt.publish(topic + '/reply', json.dumps({'success': True, 'changed': changed,
+                                                        'message': f'{dev.name}: {changed}个变量类型已更新'}))
+
     # 单设备断开连接
     async def disconnect_dev(self, dev_name):
         """
@@ -1198,6 +1463,7 @@ class distribution_server(object):
         disconnect_state = None
         for dev in self.ua_device:
             if dev_name == dev.name and dev.connecting:
+                await self.reconnect.cancel(dev)
                 await dev.disconnect()
                 message = f'INFO:{dev.name} connection status: {dev.connecting}.'
                 log.info(message)
@@ -1211,11 +1477,12 @@ class distribution_server(object):
         connect_state = None
         for dev in self.ua_device:
             if dev_name == dev.name and dev.connecting is False:
+                await self.reconnect.cancel(dev)
                 await dev.load_variable_list()
-                await dev.connect()
-                # await dev.subscribe()
+                await dev.reconnect()  # new client, connect and subscribe
                 message = f'INFO:{dev.name} connection status: {dev.connecting}.'
                 log.info(message)
+                self.reconnect.reset(dev)
                 connect_state = True
         return connect_state
 
@@ -1226,20 +1493,19 @@ class distribution_server(object):
         reconnect_state = None
         for dev in self.ua_device:
             if dev_name == dev.name and dev.connecting:
+                await self.reconnect.cancel(dev)
                 await dev.disconnect()
                 message = f'INFO:{dev.name}:{dev.linker.uri} Disconnected. Try to reconnect.....'
                 print(message)
                 log.info(message)
                 await dev.load_variable_list()
-                await asyncio.sleep(8)  # 休眠8s 检测设备是否自动重连成功
+                await dev.reconnect()  # new client, connect and subscribe
+                message = f'INFO:{dev.name}:{dev.linker.uri} reconnection state: {dev.connecting}.'
+                print(message)
+                log.info(message)
                 reconnect_state = dev.connecting
-                if not dev.connecting:
-                    await dev.connect()
-                    message = f'INFO:{dev.name}:{dev.linker.uri} reconnection state: {dev.connecting}.'
-                    print(message)
-                    log.info(message)
-                    reconnect_state = dev.connecting
-                await dev.subscribe()
+                if dev.connecting:
+                    self.reconnect.reset(dev)
         return reconnect_state
 
     async def initialize(self, base_dir):
@@ -1254,6 +1520,8 @@ class distribution_server(object):
 
         # load driver config
         self.load_config_file()
+        startup.mark('config load')
+        self.reconnect = reconnect_supervisor(self.config.get('Control', {}).get('maxHandshakes', 2))
         # initialize opcua device
         await self.initialize_opcua_device()
         # initialize mqtt
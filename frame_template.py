@@ -0,0 +1,93 @@
+import json
+import uuid
+from json.encoder import encode_basestring_ascii
+
+
+def encode_value(value):
+    """
+    encode value of variable as json.dumps, common types without encoder
+    """
+    value_type = type(value)
+    if value_type is bool:
+        return 'true' if value else 'false'
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is str:
+        return encode_basestring_ascii(value)
+    if value_type is float and value == value and value not in (float('inf'), float('-inf')):
+        return float.__repr__(value)
+    return json.dumps(value)
+
+
+class frame_templates(object):
+    """
+    prebuilt json fragments of module frames of device, static fields (code, dataType, arrLen) of variable and
+    module keys are encoded once, frame is assembled by joining encoded values and scan time into fragments
+    """
+
+    def __init__(self):
+        # id of variable --> (variable, (code, dataType, arrLen), prefix before value, suffix before time)
+        self.leaf_parts = {}
+        self.module_tails = {}  # module key --> end of frame with module keys
+
+    def leaf(self, list_node):
+        """
+        fragments of variable, built again when data type or array length of variable is changed
+        """
+        entry = self.leaf_parts.get(id(list_node))
+        static = (list_node['code'], list_node['DataTypeString'], list_node['ArrayDimensions'])
+        if entry is None or entry[0] is not list_node or entry[1] != static:
+            entry = self.leaf_parts[id(list_node)] = (
+                list_node, static,
+                '{"code": ' + json.dumps(static[0]) + ', "value": ',
+                ', "dataType": ' + json.dumps(static[1]) + ', "arrLen": ' + json.dumps(static[2]) + ', "time": ')
+        return entry
+
+    def module_tail(self, module):
+        """
+        end of frame with module keys, same order as json_from_list
+        """
+        key = (module['blockId'], module['index'], module['category'])
+        tail = self.module_tails.get(key)
+        if tail is None:
+            tail = self.module_tails[key] = '], ' + json.dumps(module)[1:-1] + '}}'
+        return tail
+
+    def leaves(self, rtime):
+        """
+        new list of changed variables of module in one scan
+        """
+        return frame_leaves(self, rtime)
+
+    def build(self, variables):
+        """
+        build fragments of variables in variable map, variables added later are built when first published
+        """
+        self.leaf_parts = {}
+        self.module_tails = {}
+        for n in variables:
+            self.leaf(n)
+
+
+class frame_leaves(list):
+    """
+    changed variables of module in one scan, items are (fragments of variable, value),
+    all variables share the scan time
+    """
+
+    def __init__(self, templates, rtime):
+        super().__init__()
+        self.templates = templates
+        self.rtime = rtime
+
+    def add(self, list_node, value):
+        self.append((self.templates.leaf(list_node), value))
+
+    def frame(self, module):
+        """
+        json frame of module, same as json_from_list
+        """
+        end = str(self.rtime) + '}'
+        return ('{"id": "' + str(uuid.uuid4()) + '", "ask": false, "data": {"list": ['
+                + ', '.join([e[2] + encode_value(v) + e[3] + end for e, v in self])
+                + self.templates.module_tail(module))
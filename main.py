@@ -4,11 +4,13 @@ import sys
 import time
 from pathlib import Path
 
-import pandas as pd
+from startup_timing import startup
 from distribution import distribution_server
 from logger import log
 from utils.time_util import get_current_time
 
+startup.mark('import')
+
 
 async def opcua_reading_coroutine(dis: distribution_server):
     while True:
@@ -41,32 +43,14 @@ async def modules_connection_state_coroutine(dis: distribution_server):
         time_using = 0.01 if time_using > 2.0 else 2.01 - time_using
         await asyncio.sleep(time_using)
 
-async def request_coroutine(dis: distribution_server):
+# 定时把变量表的运行时修正合并到CSV
+async def journal_compact_coroutine(dis: distribution_server):
     while True:
-        time_start = time.time()
-        await dis.request_task()
-        time_using = time.time() - time_start
-        # if time_using > 0.1:
-        #     log.info(f'Task request timing: {time_using:.4f}s')
-        time_using = 0.01 if time_using > 0.5 else 0.51 - time_using
-        await asyncio.sleep(time_using)
-
-
-async def timed_clear_coroutine(dis: distribution_server):
-    while True:
-        time_start = time.time()
-        await dis.timed_clear_task()
-        time_using = time.time() - time_start
-        # if time_using > 0.1:
-        #     log.info(f'Task timed clear timing: {time_using:.4f}s')
-        time_using = 0.01 if time_using > 0.2 else 0.21 - time_using
-        await asyncio.sleep(time_using)
+        await asyncio.sleep(300)
+        dis.journal_compact_task()
 
 
 async def main():
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.max_rows', None)
-
     # 读取 config
     if getattr(sys, 'frozen', False):
         # 打包后exe所在目录
@@ -84,10 +68,8 @@ async def main():
         # multi coroutine
         reading_task = asyncio.create_task(opcua_reading_coroutine(distribution))
         manager_task = asyncio.create_task(opcua_manager_coroutine(distribution))
-        if distribution.is_local:
-            request_task = asyncio.create_task(request_coroutine(distribution))
-        timed_clear_task = asyncio.create_task(timed_clear_coroutine(distribution))
         asyncio.create_task(modules_connection_state_coroutine(distribution))
+        asyncio.create_task(journal_compact_coroutine(distribution))
 
         while True:
             await distribution.mqtt_handler()
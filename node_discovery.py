@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+from data_parse import read_new_nodes_info
+from logger import log
+from utils.helpers import code2format_str
+from utils.time_util import get_current_time
+
+
+class node_discovery(object):
+    """
+    background discovery of variables missing in variable map of device (array element or structure member),
+    requests are deduplicated, failed variables are retried with backoff, new variables are appended to journal in batch
+    """
+
+    def __init__(self, dev, retry_delay=10, retry_delay_max=3600, batch_max=500):
+        self.dev = dev
+        self.batch_max = batch_max  # max variables of one bulk discovery
+        self.retry_delay = retry_delay  # first retry delay of failed variable (s)
+        self.retry_delay_max = retry_delay_max  # max retry delay of failed variable (s)
+        self.queue = asyncio.Queue()
+        self.pending = set()  # node path in queue or discovering
+        self.failures = {}  # node path --> (next retry time, failure count)
+        self.rows = []  # new variables to append to csv
+        self.task = None
+
+    def request(self, list_node, name):
+        """
+        request to discover variable name of list_node, return immediately
+        """
+        node_path = f'{list_node["path"]}/{name}'
+        if node_path in self.pending:
+            return
+        failure = self.failures.get(node_path)
+        if failure is not None and failure[0] > time.time():
+            return
+        self.pending.add(node_path)
+        self.queue.put_nowait((list_node, name, node_path))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.worker())
+
+    async def worker(self):
+        """
+        discover queued variables in batch, save new variables when queue is empty
+        """
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < self.batch_max:
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.discover(batch)
+            finally:
+                for list_node, name, node_path in batch:
+                    self.pending.discard(node_path)
+                    self.queue.task_done()
+            if self.queue.empty():
+                self.save_rows()
+
+    async def discover(self, batch):
+        """
+        read information of variables with bulk reads, add to variable map of device
+        """
+        if self.dev.connecting is False:
+            return
+
+        try:
+            results = await read_new_nodes_info([(list_node, name) for list_node, name, node_path in batch], self.dev)
+        except Exception as e:
+            for list_node, name, node_path in batch:
+                self.failed(node_path, e)
+            return
+
+        for (list_node, name, node_path), result in zip(batch, results):
+            if result is None:
+                self.failed(node_path, 'node is not found')
+                continue
+            key = code2format_str(result['blockId'], result['index'], result['category'], result['code'])
+            self.dev.code_to_node[key] = result  # 添加到map映射中
+            self.dev.node_discovered(key, result)
+            self.failures.pop(node_path, None)
+            self.rows.append(result)
+            print(f"{get_current_time()}自动新增变量 {node_path} 成功")
+            log.info(f"自动新增变量 {node_path} 成功")
+
+    def failed(self, node_path, e):
+        """
+        add failed variable to negative cache, retry delay is doubled on every failure
+        """
+        count = self.failures.get(node_path, (0, 0))[1] + 1
+        delay = min(self.retry_delay * 2 ** (count - 1), self.retry_delay_max)
+        self.failures[node_path] = (time.time() + delay, count)
+        print(f"自动添加变量信息失败: {node_path}，请使用工具手动刷新，{e}")
+        log.warning(f"自动添加变量信息失败({count}): {node_path}，{delay}s后重试，请使用工具手动刷新，{e}")
+
+    def save_rows(self):
+        """
+        append new variables to journal of device, compacted to csv file later
+        """
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        self.dev.journal.record_rows(rows)
+
+    async def stop(self):
+        """
+        stop discovery worker, discovered variables are saved
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.save_rows()
+        self.pending.clear()
+        self.queue = asyncio.Queue()
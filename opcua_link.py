@@ -6,10 +6,14 @@ import pprint
 import re
 from datetime import datetime
 import time
+from urllib.parse import urlsplit
+
 from asyncua import Client, Node, ua
+from asyncua.common.ua_utils import data_type_to_variant_type
 from asyncua.ua.ua_binary import struct_from_binary
 
 from logger import log
+from type_cache import type_cache
 from utils.helpers import count_decimal_places, generate_paths, is_target_format
 from utils.time_util import get_current_time
 
@@ -279,6 +283,100 @@ def convert_ua_data(vType, value):
             return str(value)
 
 
+class batch_profile(object):
+    """
+    batch size and timeout controller of opcua read or write service, tuned by server operation limit,
+    measured latency and BadTooManyOperations/timeout results, each linker (device) owns its profiles
+    latency of request is modeled as round trip time + count * node cost
+    """
+    ALPHA = 0.3  # ewma factor of latency
+    SMALL_REQUEST = 4  # requests up to this count measure round trip time
+
+    def __init__(self, name, min_size, max_size, target_time=0.5):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_time = target_time  # expected time of one request (s)
+        self.server_limit = 0  # MaxNodesPerRead/MaxNodesPerWrite of server, 0 is no limit
+        self.size = 0  # tuned batch size, 0 is not measured
+        self.round_trip = None  # ewma fixed time of one request (s)
+        self.node_latency = None  # ewma additional time of one node (s)
+        self.timeout_factor = 1.0  # increased by timeout, decreased by success
+
+    def limit(self, size):
+        """
+        limit batch size by server operation limit
+        """
+        if self.server_limit:
+            size = min(size, self.server_limit)
+        return max(int(size), 1)
+
+    def batch_size(self, total, fallback):
+        """
+        batch size for total nodes, fallback is used before measured
+        """
+        size = self.size if self.size else fallback
+        return self.limit(min(size, total)) if total else 1
+
+    def expected_time(self, count):
+        """
+        expected time of request for count nodes, None if not measured
+        """
+        if self.node_latency is None and self.round_trip is None:
+            return None
+        return (self.round_trip or 0) + (self.node_latency or 0) * count
+
+    def timeout(self, count, fallback, min_timeout, max_timeout):
+        """
+        timeout of request for count nodes, fallback is used before measured
+        """
+        expected = self.expected_time(count)
+        if expected is None:
+            return fallback
+        return min(max(expected * 4 * self.timeout_factor, min_timeout), max_timeout)
+
+    @classmethod
+    def ewma(cls, old, new):
+        return new if old is None else cls.ALPHA * new + (1 - cls.ALPHA) * old
+
+    def success(self, count, elapsed):
+        """
+        request success, update latency model and tune batch size to target time,
+        batch size is not shrunk below known server limit by latency
+        """
+        if count <= 0:
+            return
+        self.timeout_factor = max(1.0, self.timeout_factor * 0.9)
+        if count <= self.SMALL_REQUEST:  # small request measures round trip only, batch size is not changed
+            self.round_trip = self.ewma(self.round_trip, elapsed)
+            return
+        self.node_latency = self.ewma(self.node_latency, max(elapsed - (self.round_trip or 0), 0) / count)
+
+        target = (self.target_time - (self.round_trip or 0)) / max(self.node_latency, 1e-6)
+        size = min(target, max(self.size, count) * 2)  # grow at most double per request
+        if self.server_limit and self.size:
+            size = max(size, min(self.size, self.server_limit))  # shrink only by errors of server
+        self.size = self.limit(min(max(size, self.min_size), self.max_size))
+
+    def too_many(self, count):
+        """
+        BadTooManyOperations, server limit is less than count,
+        concurrent requests larger than reduced limit do not reduce it again
+        """
+        if self.server_limit and count > self.server_limit:
+            return
+        self.server_limit = max(count // 2, 1)
+        self.size = self.limit(self.size or self.server_limit)
+        log.warning(f'{self.name} BadTooManyOperations with {count} nodes, limit batch size to {self.server_limit}.')
+
+    def timeout_failure(self, count):
+        """
+        request timeout, shrink batch size and extend timeout
+        """
+        self.size = self.limit(max((self.size or count) // 2, 1))
+        self.timeout_factor = min(self.timeout_factor * 2, 8.0)
+
+
 class SubHandler(object):
     """
     Subscription Handler. To receive events from server for a subscription
@@ -311,9 +409,10 @@ class opcua_linker(object):
     opc ua linker, link opc ua server, browse nodes, subscription and write function
     """
 
-    def __init__(self, config):
+    def __init__(self, config, cache_dir=None):
         """
         opcua client init
+        :param cache_dir: directory of data type definitions cache
         """
         self.uri = config['uri']
         self.main_node = config['main_node']
@@ -341,11 +440,28 @@ class opcua_linker(object):
         self.adaptive_batch_size = True  # 是否启用自适应批次大小
         self.min_batch_size = 50  # 最小批次大小
         self.max_batch_size = 400  # 最大批次大小
+        self.write_pipeline_window = config.get('write_pipeline_window', 4)  # 同时在途的写入批次数量
+        self.data_type_cache = {}  # DataType NodeId --> VariantType，自定义类型只解析一次
+        self.node_id_cache = {}  # node id string --> NodeId
+        self.write_templates = {}  # (node id string, datatype) --> (NodeId, VariantType)，定时清除/握手等重复写入不再重复解析
+        self.type_cache = type_cache(self.uri, cache_dir)  # 结构体定义缓存，服务器数据类型版本不变时重连不再下载
+
+        # 每个设备独立的批次配置，由服务器操作限制和实测延迟调整
+        self.read_profile = batch_profile(f'Read {self.uri}', self.min_batch_size, 10000)  # 单点读、校验等临时读取
+        self.scan_profile = batch_profile(f'Scan {self.uri}', self.min_batch_size, 10000)  # 周期读取
+        self.write_profile = batch_profile(f'Write {self.uri}', self.min_batch_size, self.max_batch_size)
 
         # 容差配置
         self.float_absolute_tolerance = FLOAT_ABSOLUTE_TOLERANCE
         self.float_relative_tolerance = FLOAT_RELATIVE_TOLERANCE
 
+    def probe_address(self):
+        """
+        host and port of server, for tcp reachability probe
+        """
+        address = urlsplit(self.uri)
+        return address.hostname, address.port or 4840
+
     async def new_client(self):
         self.client = Client(self.uri, timeout=self.timeout, watchdog_intervall=self.watchdog_interval)
 
@@ -355,13 +471,17 @@ class opcua_linker(object):
         """
         try:
             await self.client.connect()
-            res = await self.client.load_data_type_definitions(overwrite_existing=True)
-            # print(res)
+            await self.read_operation_limits()
+            try:
+                await self.type_cache.load(self.client)
+            except Exception as e:
+                log.warning(f'Failure to load data type definitions of {self.uri} with cache: {e}')
+                await self.client.load_data_type_definitions(overwrite_existing=True)
             self.rw_failure_count = 0
             self.last_linking_time = int(time.time() * 1000)
             # print(f'link to {self.uri}:{self.linking}')
             # log.info(f'link to {self.uri}:{self.linking}')
-            await asyncio.sleep(1)
+            await self.wait_server_running()
             self.linking = True
             return True
         except:
@@ -369,6 +489,42 @@ class opcua_linker(object):
             log.warning(f'Failure to link to {self.uri}.')
             return False
 
+    async def wait_server_running(self, timeout=5.0):
+        """
+        wait server state is running after connecting
+        """
+        deadline = time.time() + timeout
+        state_node = self.client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerStatus_State))
+        while True:
+            try:
+                if await state_node.read_value() == ua.ServerState.Running:
+                    return True
+            except Exception as e:
+                log.warning(f'Failure to read server state of {self.uri}: {e}')
+            if time.time() > deadline:
+                log.warning(f'Server {self.uri} is not running after {timeout}s.')
+                return False
+            await asyncio.sleep(0.1)
+
+    async def read_operation_limits(self):
+        """
+        read MaxNodesPerRead/MaxNodesPerWrite operation limits of server
+        """
+        nodes = [ua.NodeId(ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead),
+                 ua.NodeId(ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerWrite)]
+        try:
+            values = await asyncio.wait_for(self.client.uaclient.read_attributes(nodes, ua.AttributeIds.Value),
+                                            self.timeout)
+        except Exception as e:
+            log.warning(f'Failure to read operation limits of {self.uri}: {e}')
+            return
+        for profiles, v in zip([[self.read_profile, self.scan_profile], [self.write_profile]], values):
+            if v.StatusCode.is_good() and v.Value is not None and v.Value.Value:
+                for profile in profiles:
+                    profile.server_limit = int(v.Value.Value)
+        log.info(f'Operation limits of {self.uri}: MaxNodesPerRead {self.read_profile.server_limit}, '
+                 f'MaxNodesPerWrite {self.write_profile.server_limit}.')
+
     async def unlink(self):
         """
         unlink to opcua server
@@ -409,90 +565,87 @@ class opcua_linker(object):
             except:
                 log.warning(f'Failure to subscribe {n}')
 
-    async def write_multi_variables(self, variables, timeout=0.1, batch_size=500):
+    async def write_multi_variables(self, variables, timeout=0.1, batch_size=500, failed=None):
         """
-        将变量分批次写入 OPC UA 服务器。
+        将变量分批次写入 OPC UA 服务器，多个批次同时在途（流水线），最后统一验证。
         :param variables: 要写入的变量列表，每个元素是一个字典，包含 'node_id', 'value', 和 'datatype'。
         :param batch_size: 每批写入的变量数量。
         :param timeout: 每批写入操作的超时时间。
+        :param failed: 输出参数，写入或验证失败的变量追加到该列表
         """
         print(f"{get_current_time()} 写入变量总数量：{len(variables)}")
         log.info(f"写入变量总数量：{len(variables)}")
 
-        # 自适应批次大小
+        # 自适应批次大小，受服务器MaxNodesPerWrite限制
         if self.adaptive_batch_size:
             batch_size = self._calculate_adaptive_batch_size(len(variables))
+        batch_size = self.write_profile.limit(batch_size)
 
-        # 动态计算超时时间
-        calculated_timeout = self._calculate_timeout(len(variables))
+        # 动态计算超时时间，有实测延迟时按批次估算
+        calculated_timeout = self.write_profile.timeout(batch_size, self._calculate_timeout(len(variables)),
+                                                        self.base_timeout, self.max_timeout)
         timeout = max(timeout, calculated_timeout)  # 使用较大的超时值
 
-        if len(variables) <= batch_size:
-            try:
-                state = await self.write_variables(variables, timeout, 1, 1)
-
-                # 写入验证
-                if state and self.write_verification_enabled:
-                    verification_result, failed_variables = await self._verify_write_result_with_retry(variables)
-                    if not verification_result and failed_variables:
-                        log.warning(
-                            f"写入验证失败，{len(failed_variables)}个变量需要重写: {[v['node_id'] for v in failed_variables]}")
-
-                        # 对验证失败的变量进行重写
-                        rewrite_success = await self._rewrite_failed_variables(failed_variables, timeout)
-                        if rewrite_success:
-                            log.info(f"重写成功: {len(failed_variables)}个变量")
-                            return True
-                        else:
-                            log.error(f"重写失败: {len(failed_variables)}个变量")
-                            return False
-                    elif verification_result:
-                        log.info(f"写入验证成功: {len(variables)}个变量")
-                        return True
-                    else:
-                        log.error(f"写入验证失败且无法获取失败变量列表")
-                        return False
+        batches = [variables[i:i + batch_size] for i in range(0, len(variables), batch_size)]
+        total_batches = len(batches)
+        window = asyncio.Semaphore(max(self.write_pipeline_window, 1))  # 同时在途的WriteRequest数量
 
-                return state
-            except Exception as e:
-                log.error(f"写入单批次异常: {e}")
-                return False
-        else:
-            try:
-                total_batches = (len(variables) + batch_size - 1) // batch_size  # 计算总批次数
-                success_all = True
-                all_failed_variables = []  # 收集所有批次的失败变量
-
-                for i in range(total_batches):
-                    batch = variables[i * batch_size:(i + 1) * batch_size]
-                    batch_success = await self.write_variables(batch, timeout, i + 1, total_batches)
-
-                    # 验证写入结果
-                    if batch_success and self.write_verification_enabled:
-                        verification_result, failed_variables = await self._verify_write_result_with_retry(batch)
-                        if not verification_result and failed_variables:
-                            log.warning(f"批次{i + 1}写入验证失败，{len(failed_variables)}个变量需要重写")
-                            all_failed_variables.extend(failed_variables)
-                            batch_success = False
-
-                    if not batch_success:
-                        success_all = False
-
-                # 如果有验证失败的变量，尝试重写
-                if all_failed_variables:
-                    log.warning(f"总共{len(all_failed_variables)}个变量验证失败，尝试重写")
-                    rewrite_success = await self._rewrite_failed_variables(all_failed_variables, timeout)
-                    if rewrite_success:
-                        log.info(f"重写成功: {len(all_failed_variables)}个变量")
-                        return True
-                    else:
-                        log.error(f"重写失败: {len(all_failed_variables)}个变量")
-                        return False
+        async def write_batch(i, batch):
+            async with window:
+                return await self.write_variables(batch, timeout, i + 1, total_batches, settle=False)
 
-                return success_all
-            except Exception as e:
-                log.error(f"写入多批次异常: {e}")
-                return False
+        try:
+            states = await asyncio.gather(*[write_batch(i, batch) for i, batch in enumerate(batches)])
+        except Exception as e:
+            log.error(f"写入批次异常: {e}")
+            if failed is not None:
+                failed.extend(variables)
+            return False
+
+        written = []  # 写入成功的变量
+        for batch, state in zip(batches, states):
+            if state:
+                written.extend(batch)
+            elif failed is not None:
+                failed.extend(batch)
+        success_all = all(states)
+
+        if not written:
+            return success_all
+
+        if not self.write_verification_enabled:
+            # 全部批次写入后统一短暂延迟，确保PLC处理
+            await asyncio.sleep(0.05)
+            return success_all
+
+        # 写入验证，所有批次合并为一次读取
+        try:
+            verification_result, failed_variables = await self._verify_write_result_with_retry(written)
+        except Exception as e:
+            log.error(f"写入验证异常: {e}")
+            if failed is not None:
+                failed.extend(written)
+            return False
+
+        if verification_result:
+            log.info(f"写入验证成功: {len(written)}个变量")
+            return success_all
+        elif not failed_variables:
+            log.error(f"写入验证失败且无法获取失败变量列表")
+            if failed is not None:
+                failed.extend(written)
+            return False
+
+        # 只重写验证失败的变量
+        log.warning(f"写入验证失败，{len(failed_variables)}个变量需要重写: {[v['node_id'] for v in failed_variables]}")
+        rewrite_success = await self._rewrite_failed_variables(failed_variables, timeout)
+        if rewrite_success:
+            log.info(f"重写成功: {len(failed_variables)}个变量")
+            return success_all
+        log.error(f"重写失败: {len(failed_variables)}个变量")
+        if failed is not None:
+            failed.extend(failed_variables)
+        return False
 
     async def _rewrite_failed_variables(self, failed_variables, timeout, retry_count=0):
         """
@@ -508,7 +661,7 @@ class opcua_linker(object):
         log.info(f"第{retry_count + 1}次重写{len(failed_variables)}个验证失败的变量")
 
         # 重写失败的变量
-        rewrite_success = await self.write_variables(failed_variables, timeout, 1, 1, 0)
+        rewrite_success = await self.write_variables(failed_variables, timeout, 1, 1, 0, settle=False)
 
         if rewrite_success:
             # 验证重写结果
@@ -533,7 +686,26 @@ class opcua_linker(object):
             log.warning(f"重写操作失败")
             return False
 
-    async def write_variables(self, variables, timeout, batch_num, total_batches, retry_count=0):
+    def node_id(self, node_id):
+        """
+        NodeId of node id string, parsed once and cached
+        """
+        node = self.node_id_cache.get(node_id)
+        if node is None:
+            node = self.node_id_cache[node_id] = ua.NodeId.from_string(node_id)
+        return node
+
+    def write_template(self, node_id, datatype):
+        """
+        pre-parsed NodeId and VariantType of written variable, cached per linker
+        :return: (NodeId, VariantType)
+        """
+        template = self.write_templates.get((node_id, datatype))
+        if template is None:
+            template = self.write_templates[(node_id, datatype)] = (self.node_id(node_id), ua.VariantType(datatype))
+        return template
+
+    async def write_variables(self, variables, timeout, batch_num, total_batches, retry_count=0, settle=True):
         """
         将多个变量写入 OPC UA 服务器。
         :param variables: 要写入的变量列表，每个元素是一个字典，包含 'node_id', 'value', 和 'datatype'。
@@ -541,25 +713,29 @@ class opcua_linker(object):
         :param batch_num: 当前批次号，用于日志记录。
         :param total_batches: 总批次数，用于日志记录。
         :param retry_count: 当前重试次数（内部使用）
+        :param settle: 写入成功后是否短暂延迟，流水线写入时由调用者统一延迟
         """
-        self.write_variable_count = len(variables)
+        write_variable_count = len(variables)  # 批次并发写入，不能共用self.write_variable_count
+        self.write_variable_count = write_variable_count
         write_state_fail_docs = []  # 记录写入失败的状态描述
 
         try:
             request = ua.WriteRequest()
             for v in variables:
+                node_id, variant_type = self.write_template(v['node_id'], v['datatype'])
                 attr = ua.WriteValue()
-                attr.NodeId = ua.NodeId.from_string(v['node_id'])
+                attr.NodeId = node_id
                 attr.AttributeId = ua.AttributeIds.Value
-                attr.Value = ua.DataValue(ua.Variant(v['value'], ua.VariantType(v['datatype'])))
+                attr.Value = ua.DataValue(ua.Variant(v['value'], variant_type))
                 request.Parameters.NodesToWrite.append(attr)
 
             start_time = int(time.time() * 1000)
-            data = await self.client.uaclient.protocol.send_request(request)
+            data = await self.client.uaclient.protocol.send_request(request, timeout)
             response = struct_from_binary(ua.WriteResponse, data)
             response.ResponseHeader.ServiceResult.check()
             write_states = response.Results
             write_time = int(time.time() * 1000) - start_time
+            self.write_profile.success(write_variable_count, write_time / 1000)
             self.last_linking_time = int(time.time() * 1000)
 
             # 检查写入结果
@@ -573,10 +749,10 @@ class opcua_linker(object):
                     write_state_fail_docs.append(fail_msg)
 
             # 统一日志输出
-            if self.write_variable_count < 5:
+            if write_variable_count < 5:
                 message_prefix = f"{get_current_time()} 第{batch_num}/{total_batches}批次，变量：{variables}"
             else:
-                message_prefix = f"{get_current_time()} 第{batch_num}/{total_batches}批次，总数量：{self.write_variable_count}"
+                message_prefix = f"{get_current_time()} 第{batch_num}/{total_batches}批次，总数量：{write_variable_count}"
 
             if not write_state_fail_docs:
                 success_message = f"{message_prefix} 通过OPCUA写入成功，耗时 {write_time}ms, {self.uri}"
@@ -584,7 +760,7 @@ class opcua_linker(object):
                 log.info(success_message)
 
                 # 关键写入后添加短暂延迟，确保PLC处理
-                if self.write_variable_count > 0:
+                if settle and write_variable_count > 0:
                     await asyncio.sleep(0.05)  # 50ms延迟
 
                 return True
@@ -596,6 +772,17 @@ class opcua_linker(object):
         except asyncio.TimeoutError:
             error_type = "超时"
             error_detail = f"写入{timeout}s超时"
+            self.write_profile.timeout_failure(write_variable_count)
+        except ua.UaStatusCodeError as e:
+            if e.code == ua.StatusCodes.BadTooManyOperations and write_variable_count > 1:
+                # 超过服务器操作限制，拆分批次后写入
+                self.write_profile.too_many(write_variable_count)
+                half = write_variable_count // 2
+                first = await self.write_variables(variables[:half], timeout, batch_num, total_batches, 0, settle)
+                second = await self.write_variables(variables[half:], timeout, batch_num, total_batches, 0, settle)
+                return first and second
+            error_type = "OPC UA错误"
+            error_detail = f"UA错误: {e}"
         except ua.UaError as e:
             error_type = "OPC UA错误"
             error_detail = f"UA错误: {e}"
@@ -607,10 +794,10 @@ class opcua_linker(object):
             error_detail = f"异常: {e}"
 
         # 错误日志
-        if self.write_variable_count < 5:
+        if write_variable_count < 5:
             message_prefix = f"第{batch_num}/{total_batches}批次，变量：{variables}"
         else:
-            message_prefix = f"第{batch_num}/{total_batches}批次，总数量：{self.write_variable_count}"
+            message_prefix = f"第{batch_num}/{total_batches}批次，总数量：{write_variable_count}"
 
         log.warning(f"{message_prefix}，{error_type}: {error_detail}, {self.uri}")
 
@@ -623,9 +810,9 @@ class opcua_linker(object):
             log.info(retry_message)
 
             await asyncio.sleep(retry_delay)
-            return await self.write_variables(variables, timeout, batch_num, total_batches, retry_count)
+            return await self.write_variables(variables, timeout, batch_num, total_batches, retry_count, settle)
         else:
-            if self.write_variable_count < 5:
+            if write_variable_count < 5:
                 log.warning(f"最终失败：无法通过 OPC UA 写入 {variables}, {self.uri}, 请把批次数量减少再次尝试")
             else:
                 log.warning(
@@ -686,13 +873,16 @@ class opcua_linker(object):
 
         return False, failed_variables
 
-    async def read_multi_variables(self, node_ids, timeout=0.2, max_retries=None):
+    async def read_multi_variables(self, node_ids, timeout=0.2, max_retries=None, data_values=None, cyclic=False):
         """
         读取多个变量，支持重试机制
         :param node_ids: 要读取的节点ID列表
         :param timeout: 读取超时时间
         :param max_retries: 最大重试次数，为None时使用默认值
+        :param data_values: 读取成功时追加DataValue(时间戳和状态码)，为None时不返回
+        :param cyclic: 周期读取，使用独立的批次配置，不受单点读等小请求影响
         """
+        profile = self.scan_profile if cyclic else self.read_profile
         if max_retries is None:
             max_retries = self.read_retry_max
 
@@ -703,16 +893,17 @@ class opcua_linker(object):
             try:
                 nodes = []
                 for n in node_ids:
-                    nodes.append(ua.NodeId.from_string(n))
+                    nodes.append(self.node_id(n))
 
-                # 动态调整超时时间
-                adjusted_timeout = timeout + (len(node_ids) * 0.2)
-                value = await asyncio.wait_for(
-                    self.client.uaclient.read_attributes(nodes, ua.AttributeIds.Value),
-                    adjusted_timeout
-                )
+                # 按服务器MaxNodesPerRead和实测延迟分批读取
+                size = profile.batch_size(len(nodes), len(nodes))
+                value = []
+                for i in range(0, len(nodes), size):
+                    value.extend(await self._read_values(nodes[i:i + size], timeout, profile))
 
                 result = [v.Value.Value if v.Value is not None else None for v in value]
+                if data_values is not None:
+                    data_values.extend(value)
 
                 self.last_linking_time = int(time.time() * 1000)
                 if self.rw_failure_count > 2:
@@ -729,6 +920,11 @@ class opcua_linker(object):
             except asyncio.TimeoutError:
                 last_exception = f"读取超时，超时时间: {timeout}s"
                 log.warning(f"第{attempt + 1}次读取超时: {node_ids}")
+            except ua.UaStatusCodeError as e:
+                if e.code == ua.StatusCodes.BadTooManyOperations:
+                    profile.too_many(profile.batch_size(len(node_ids), len(node_ids)))
+                last_exception = f"OPC UA错误: {e}"
+                log.warning(f"第{attempt + 1}次读取UA错误: {e}")
             except ua.UaError as e:
                 last_exception = f"OPC UA错误: {e}"
                 log.warning(f"第{attempt + 1}次读取UA错误: {e}")
@@ -750,17 +946,37 @@ class opcua_linker(object):
 
         return result  # 返回空列表或部分结果
 
+    async def _read_values(self, nodes, timeout, profile):
+        """
+        read value of nodes with one ReadRequest, update batch profile
+        """
+        # 动态调整超时时间
+        adjusted_timeout = profile.timeout(len(nodes), timeout + (len(nodes) * 0.2),
+                                             timeout, self.max_timeout)
+        start_time = time.time()
+        try:
+            params = ua.ReadParameters()
+            params.TimestampsToReturn = ua.TimestampsToReturn.Both  # source and server timestamp for value cache
+            params.NodesToRead = [ua.ReadValueId(NodeId=n, AttributeId=ua.AttributeIds.Value) for n in nodes]
+            value = await asyncio.wait_for(self.client.uaclient.read(params), adjusted_timeout)
+        except asyncio.TimeoutError:
+            profile.timeout_failure(len(nodes))
+            raise
+        profile.success(len(nodes), time.time() - start_time)
+        return value
+
     def _calculate_adaptive_batch_size(self, total_variables):
         """
-        计算自适应批次大小
+        计算自适应批次大小，有实测延迟时由写入配置决定
         """
         if total_variables <= self.min_batch_size:
-            return total_variables  # 小批量直接全写
+            fallback = total_variables  # 小批量直接全写
         elif total_variables <= 100:
-            return self.min_batch_size
+            fallback = self.min_batch_size
         else:
             # 大批次时适当减小批次大小
-            return min(self.max_batch_size, max(self.min_batch_size, total_variables // 3))
+            fallback = min(self.max_batch_size, max(self.min_batch_size, total_variables // 3))
+        return self.write_profile.batch_size(total_variables, fallback)
 
     def _calculate_timeout(self, variable_count):
         """
@@ -804,127 +1020,199 @@ class opcua_linker(object):
             log.warning(f'Failure to write check wrote {node_id} to {self.uri}.')
             return False
 
+    async def filter_changed_variables(self, variables):
+        """
+        差量写入：一次批量读取当前值，过滤掉与服务器当前值相同的变量 (使用容差比较)
+        :param variables: 要写入的变量列表 [{'node_id','datatype','value'},...]
+        :return: (需要写入的变量列表, 跳过的变量列表)，读取失败时返回全部变量 (全量写入)
+        """
+        if not variables:
+            return variables, []
+        datas = await self.read_multi_variables([v['node_id'] for v in variables],
+                                                timeout=0.2 + len(variables) * 0.001)
+        if not datas or len(datas) != len(variables):
+            log.warning(f'Failure to read current values of {len(variables)} variables from {self.uri}, write all.')
+            return variables, []
+
+        changed = []
+        skipped = []
+        for v, actual in zip(variables, datas):
+            if are_values_equal(v['value'], actual, ua.VariantType(v['datatype']),
+                                self.float_absolute_tolerance, self.float_relative_tolerance):
+                skipped.append(v)
+            else:
+                changed.append(v)
+        return changed, skipped
+
+    async def read_attributes_bulk(self, items):
+        """
+        批量读取多个节点的多个属性，按读取配置分批
+        :param items: [(NodeId, AttributeId),...]
+        :return: [DataValue,...]
+        """
+        result = []
+        size = self.read_profile.batch_size(len(items), len(items))
+        for i in range(0, len(items), size):
+            params = ua.ReadParameters()
+            for node_id, attr in items[i:i + size]:
+                rv = ua.ReadValueId()
+                rv.NodeId = node_id
+                rv.AttributeId = attr
+                params.NodesToRead.append(rv)
+            start_time = time.time()
+            result.extend(await asyncio.wait_for(self.client.uaclient.read(params),
+                                                 self.read_profile.timeout(len(params.NodesToRead), self.timeout,
+                                                                           self.timeout, self.max_timeout)))
+            self.read_profile.success(len(params.NodesToRead), time.time() - start_time)
+        self.last_linking_time = int(time.time() * 1000)
+        return result
+
+    async def resolve_variant_type(self, data_type: ua.NodeId):
+        """
+        DataType NodeId转换为VariantType，内置类型直接转换，自定义类型查询父类型后缓存
+        """
+        key = data_type.to_string()
+        var_type = self.data_type_cache.get(key)
+        if var_type is not None:
+            return var_type
+        if data_type.NamespaceIndex == 0 and isinstance(data_type.Identifier, int) and data_type.Identifier < 30:
+            if data_type.Identifier == 29:  # enumeration
+                var_type = ua.VariantType.Int32
+            elif data_type.Identifier in [24, 26, 27, 28]:  # BaseDataType, Number, Integer, UInteger
+                var_type = ua.VariantType.Variant
+            else:
+                var_type = ua.VariantType(data_type.Identifier)
+        else:
+            var_type = await data_type_to_variant_type(self.client.get_node(data_type))
+        self.data_type_cache[key] = var_type
+        return var_type
+
+    async def read_nodes_type(self, nodes):
+        """
+            批量读节点类型
+        :param nodes: [Node,...]
+        :return: [{'DataType','DataTypeString'} or None,...]
+        """
+        values = await self.read_attributes_bulk([(n.nodeid, ua.AttributeIds.DataType) for n in nodes])
+        result = []
+        for node, v in zip(nodes, values):
+            try:
+                v.StatusCode.check()
+                var_type = (await self.resolve_variant_type(v.Value.Value)).value
+                result.append({'DataType': int(var_type),
+                               'DataTypeString': ua_data_type_to_string(ua.VariantType(var_type))})
+            except Exception:
+                print(f'无法确定节点变量类型:{node}')
+                result.append(None)
+        return result
+
     async def read_node_type(self, node: Node):
         """
             读节点类型
         :param node:
         :return:
         """
-        type_result = None
         try:
-            var_type = (await node.read_data_type_as_variant_type()).value
-            var_type_str = ua_data_type_to_string(ua.VariantType(var_type))
-            type_result = {'DataType': int(var_type), 'DataTypeString': var_type_str}
-        except:
+            return (await self.read_nodes_type([node]))[0]
+        except Exception:
             print(f'无法确定节点变量类型:{node}')
+            return None
 
-        return type_result
-
-    async def read_node_info(self, node: Node, path: str):
+    async def read_nodes_info(self, nodes, paths):
         """
-            读取节点信息
+            批量读取节点信息, 属性和值分两次批量读取
+        :param nodes: [Node,...]
+        :param paths: 节点路径
+        :return: [变量信息 or None,...]，None表示节点不存在或无法读取
         """
-        # current node information
-        value = 0
-        decimal_point = 0
-        node_name = (await node.read_browse_name()).Name
-        node_name = str.replace(node_name, '[' or ']', '')
-        if is_target_format(node_name):
-            node_class = ua.NodeClass.Object
-        else:
-            node_class = ua.NodeClass.Variable
-        # node_class = await node.read_node_class()
-        if node_class in [ua.NodeClass.Object]:
-            path = name_2path(path, node_name)
-        info = path_2info(path)
-        current_block_id = info["blockId"]
-        current_index = info["index"]
-        current_category = info["category"]
-        current_code = info["name"]
-        code_format = f"{current_block_id}_{current_index}_{current_category}_{current_code}"
-        # print(path, info)
-        # print(f"{path}:{info}")
-        var_type = ua.VariantType.Null.value
-        var_type_str = 'Null'
-        var_type_size = 0
-        opcua_sub = False
-        read_enable = False
-        read_period = 20
-        if node_class != ua.NodeClass.Variable:
-            array_dimensions = 0
-            description = None
-            reference = None
-        else:
-            # read data type
-            try:
-                var_type = (await node.read_data_type_as_variant_type()).value
-                var_type_str = ua_data_type_to_string(ua.VariantType(var_type))
-                var_type_size = ua_data_type_size(ua.VariantType(var_type))
-            except ua.UaError:
-                print(f'无法确定节点变量类型:{path}')
-                # self.emit_msgs(f"无法确定节点变量类型:{path}")
-
-            # read array dimensions
-            try:
-                array_dimensions = int((await node.read_array_dimensions())[0])
-            except ua.UaError:
-                array_dimensions = int(0)
-
-            # read description
-            try:
-                description = (await node.read_description()).Text
-                if description == 'nan':
-                    description = None
-            except ua.UaError:
-                description = None
-
-            # read reference
-            try:
-                reference = (await node.get_references())
-            except ua.UaError:
-                reference = None
-            # read value
-            if var_type_str == 'structure' or array_dimensions > 0:
-                value = 0
+        attrs = [ua.AttributeIds.BrowseName, ua.AttributeIds.DataType, ua.AttributeIds.ArrayDimensions]
+        values = await self.read_attributes_bulk([(n.nodeid, a) for n in nodes for a in attrs])
+
+        infos = []
+        for i, (node, path) in enumerate(zip(nodes, paths)):
+            browse_name, data_type, array_dimensions = values[i * len(attrs):(i + 1) * len(attrs)]
+            if not browse_name.StatusCode.is_good() or browse_name.Value is None:
+                infos.append(None)
+                continue
+
+            # current node information
+            node_name = str.replace(browse_name.Value.Value.Name, '[' or ']', '')
+            if is_target_format(node_name):
+                node_class = ua.NodeClass.Object
             else:
+                node_class = ua.NodeClass.Variable
+            if node_class in [ua.NodeClass.Object]:
+                path = name_2path(path, node_name)
+            info = {'node': node, 'path': path, 'name': node_name, 'NodeClass': node_class,
+                    'DataType': ua.VariantType.Null.value, 'DataTypeString': 'Null', 'ArrayDimensions': 0,
+                    's7_size': 0, 'value': 0}
+            if node_class == ua.NodeClass.Variable:
+                # data type
                 try:
-                    value = (await node.read_value())
-                    if value == '':
-                        value = ' '
-                except ua.UaError:
-                    value = 0
-
-            # checking
-            if var_type_str == 'unknown':
-                print(f'{node_name} is unknown type!')
-
-            if var_type_str == "float" or var_type_str == "double":
-                decimal_point = count_decimal_places(value)
-                if decimal_point == 0:
-                    decimal_point = 3
+                    data_type.StatusCode.check()
+                    var_type = await self.resolve_variant_type(data_type.Value.Value)
+                    info['DataType'] = var_type.value
+                    info['DataTypeString'] = ua_data_type_to_string(var_type)
+                    info['s7_size'] = ua_data_type_size(var_type)
+                except Exception:
+                    print(f'无法确定节点变量类型:{path}')
+                # array dimensions
+                if array_dimensions.StatusCode.is_good() and array_dimensions.Value is not None \
+                        and array_dimensions.Value.Value:
+                    info['ArrayDimensions'] = int(array_dimensions.Value.Value[0])
+            infos.append(info)
+
+        # read value of single variables
+        scalars = [info for info in infos if info is not None and info['NodeClass'] == ua.NodeClass.Variable
+                   and info['DataTypeString'] != 'structure' and info['ArrayDimensions'] == 0]
+        if scalars:
+            values = await self.read_attributes_bulk([(info['node'].nodeid, ua.AttributeIds.Value) for info in scalars])
+            for info, v in zip(scalars, values):
+                if v.StatusCode.is_good() and v.Value is not None:
+                    info['value'] = ' ' if v.Value.Value == '' else v.Value.Value
+
+        return [None if info is None else self.node_info_row(info) for info in infos]
+
+    def node_info_row(self, info):
+        """
+        变量表的一行
+        """
+        var_type_str = info['DataTypeString']
+        value = info['value']
+        decimal_point = 0
+        # checking
+        if var_type_str == 'unknown':
+            print(f'{info["name"]} is unknown type!')
+
+        if var_type_str == "float" or var_type_str == "double":
+            decimal_point = count_decimal_places(value)
+            if decimal_point == 0:
+                decimal_point = 3
+        path = info['path']
+        module = path_2info(path)
         return {
             'path': path,
-            'name': node_name,
-            'ArrayDimensions': array_dimensions,
-            'DataType': int(var_type),
+            'name': info['name'],
+            'ArrayDimensions': info['ArrayDimensions'],
+            'DataType': int(info['DataType']),
             'DataTypeString': var_type_str,
             'DecimalPoint': decimal_point,
-            'NodeClass': node_class.value,
-            'NodeID': node.nodeid.to_string(),
+            'NodeClass': info['NodeClass'].value,
+            'NodeID': info['node'].nodeid.to_string(),
             'NodePath': path,
-            "blockId": current_block_id,
-            "category": current_category,
-            "code": current_code,
-            "index": current_index,
+            "blockId": module["blockId"],
+            "category": module["category"],
+            "code": module["name"],
+            "index": module["index"],
             "mqtt_publish": False,
-            "opcua_subscribe": opcua_sub,
-            "read_enable": read_enable,
-            "read_period": read_period,
+            "opcua_subscribe": False,
+            "read_enable": False,
+            "read_period": 20,
             "read_time": 0,
             "return_time": 0,
             "s7_bit": 0,
             "s7_db": 0,
-            "s7_size": var_type_size,
+            "s7_size": info['s7_size'],
             "s7_start": 0,
             "timed_clear": False,
             "timed_clear_time": 1000,
@@ -936,7 +1224,8 @@ class opcua_linker(object):
                                  retry_max=None, verification_enabled=None,
                                  verification_retry_max=None, adaptive_batch=None,
                                  min_batch=None, max_batch=None,
-                                 float_absolute_tolerance=None, float_relative_tolerance=None):
+                                 float_absolute_tolerance=None, float_relative_tolerance=None,
+                                 pipeline_window=None):
         """
         动态配置写入参数
         """
@@ -954,12 +1243,16 @@ class opcua_linker(object):
             self.adaptive_batch_size = adaptive_batch
         if min_batch is not None:
             self.min_batch_size = min_batch
+            self.write_profile.min_size = min_batch
         if max_batch is not None:
             self.max_batch_size = max_batch
+            self.write_profile.max_size = max_batch
         if float_absolute_tolerance is not None:
             self.float_absolute_tolerance = float_absolute_tolerance
         if float_relative_tolerance is not None:
             self.float_relative_tolerance = float_relative_tolerance
+        if pipeline_window is not None:
+            self.write_pipeline_window = pipeline_window
 
     def configure_read_settings(self, retry_max=None):
         """
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from asyncua import ua
+
+from utils.helpers import round_half_up
+from utils.time_util import filter_timestamp
+
+# replica of device variable map in worker process
+# nodes: [{'key','code','DataType','DataTypeString','ArrayDimensions','DecimalPoint','value'},...], index is node id
+# key_to_id: {blockId_index_category_code: node id}
+# slots: read block [(node id, module),...], index is slot
+_replica = {'nodes': [], 'key_to_id': {}, 'slots': []}
+
+REPLICA_KEYS = ['code', 'DataType', 'DataTypeString', 'ArrayDimensions', 'DecimalPoint', 'value']
+PLAIN_TYPES = (bool, int, float, str, type(None))  # values sent to worker without conversion
+
+
+def to_plain(value):
+    """
+    convert opcua value (structure object, enum...) to plain python data, which can be sent to worker process
+    """
+    if value is None or isinstance(value, (bool, float, str, bytes, datetime)):
+        return value
+    if isinstance(value, int):
+        return int(value)  # IntEnum of structure definitions is not picklable
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    if hasattr(value, '__dict__'):
+        return {k: to_plain(v) for k, v in value.__dict__.items()}
+    return value
+
+
+def replica_row(key, list_node):
+    """
+    create replica row of variable for worker process
+    """
+    row = {k: list_node.get(k) for k in REPLICA_KEYS}
+    row['key'] = key
+    row['DataType'] = int(row['DataType'])
+    row['value'] = to_plain(row['value'])
+    return row
+
+
+def init_replica(rows, slots):
+    """
+    worker process initializer, create replica of device variable map
+    """
+    _replica['nodes'] = []
+    _replica['key_to_id'] = {}
+    add_replica_rows(rows)
+    _replica['slots'] = slots
+
+
+def add_replica_rows(rows):
+    """
+    add new variable (auto discovered) to replica
+    """
+    for row in rows:
+        _replica['key_to_id'][row['key']] = len(_replica['nodes'])
+        _replica['nodes'].append(row)
+
+
+def _child_names(node, value):
+    """
+    (child name, key in value) of array or structure value, None if node is not array or structure
+    """
+    if node['ArrayDimensions'] > 0 and type(value) is list:
+        return [(str(n), n) for n in range(len(value))]
+    if node['DataType'] == ua.VariantType.ExtensionObject.value and type(value) is dict:
+        return [(key[1:] if key.startswith('_') else key, key) for key in value]
+    return None
+
+
+def _set_value(node_id, value):
+    """
+    set value of node and its children in replica, value is changed in main process
+    """
+    node = _replica['nodes'][node_id]
+    for name, k in _child_names(node, value) or []:
+        child_id = _replica['key_to_id'].get(node['key'] + '_' + name)
+        if child_id is not None:
+            _set_value(child_id, value[k])
+    node['value'] = value
+
+
+def _leaf_value(node, value):
+    """
+    convert leaf value for mqtt, same as datas_parse_o2m
+    """
+    if node['DataTypeString'] == "float" or node['DataTypeString'] == "double":
+        return round_half_up(value, node['DecimalPoint'])
+    elif node['DataTypeString'] == "datetime":
+        return filter_timestamp(value.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3])
+    return value
+
+
+def _parse_children(node, value, O2M, leaves, rtime, updates, missing, msg):
+    """
+    parse array or structure value of node in replica, return value of node
+    """
+    if node['ArrayDimensions'] > 0:
+        if type(value) is not list:
+            msg.append(f'Failure to {node["key"]}[{node["ArrayDimensions"]}] is array, but value type is {type(value)}.')
+            return value
+        if len(value) != node['ArrayDimensions']:
+            node['ArrayDimensions'] = len(value)
+            updates.append((_replica['key_to_id'][node['key']], 'ArrayDimensions', len(value)))
+        names = [(str(n), n) for n in range(len(value))]
+    elif node['DataType'] == ua.VariantType.ExtensionObject.value:
+        if type(value) is not dict:
+            msg.append(f'Failure to {node["key"]} is structure, but value type is {type(value)}.')
+            return value
+        names = [(key[1:] if key.startswith('_') else key, key) for key in value]
+    else:
+        return value
+
+    for name, k in names:
+        child_id = _replica['key_to_id'].get(node['key'] + '_' + name)
+        if child_id is None:
+            missing.append((node['key'], name))
+            continue
+        if value[k] is None:
+            msg.append(f'{node["key"]}/{name} = None, Null value.')
+            continue
+        value[k] = _parse_node(child_id, value[k], O2M, leaves, rtime, updates, missing, msg)
+    return value
+
+
+def _parse_node(node_id, value, O2M, leaves, rtime, updates, missing, msg):
+    """
+    parse value of node in replica, add changed leaf to leaves and update value of node,
+    only changed values are returned to main process
+    """
+    node = _replica['nodes'][node_id]
+    if node['ArrayDimensions'] > 0 or node['DataType'] == ua.VariantType.ExtensionObject.value:
+        count = len(updates)
+        value = _parse_children(node, value, O2M, leaves, rtime, updates, missing, msg)
+        changed = len(updates) > count or node['value'] is None  # a child is changed
+    else:
+        if O2M is True or node['value'] != value:
+            value = _leaf_value(node, value)
+            leaves.append({"code": node['code'], "value": value, "dataType": node['DataTypeString'],
+                           "arrLen": node['ArrayDimensions'], "time": rtime})
+        changed = node['value'] != value
+    if changed:
+        node['value'] = value
+        updates.append((node_id, 'value', value))
+    return value
+
+
+def parse_slots(slot_values, rtime, O2M, new_rows, new_values):
+    """
+    worker process: parse reading datas of read block and encode mqtt frames
+    :param slot_values: [(slot, value),...]
+    :param rtime: collection time
+    :param O2M: publish all variables or changed variables
+    :param new_rows: new variables added to device since last parsing
+    :param new_values: [(node id, value),...] values changed in main process since last parsing
+    :return: (frames, updates, missing, msg)
+    """
+    if new_rows:
+        add_replica_rows(new_rows)
+    for node_id, value in new_values:
+        _set_value(node_id, value)
+
+    modules = {}  # module key --> (module, leaves)
+    updates = []  # [(node id, attribute, value),...]
+    missing = []  # [(parent key, name),...]
+    msg = []
+    for slot, value in slot_values:
+        node_id, module = _replica['slots'][slot]
+        if value is None or node_id is None:
+            continue
+        m = modules.setdefault((module['blockId'], module['index'], module['category']), (module, []))
+        try:
+            _parse_node(node_id, value, O2M, m[1], rtime, updates, missing, msg)
+        except Exception as e:
+            msg.append(f'{e}Failure to parse {_replica["nodes"][node_id]["key"]}.')
+
+    frames = []
+    for module, leaves in modules.values():
+        if leaves:
+            data = {'list': leaves}
+            data.update(module)
+            frames.append(json.dumps({"id": str(uuid.uuid4()), "ask": False, "data": data}).encode())
+    return frames, updates, missing, msg
+
+
+class parse_pool(object):
+    """
+    parse reading datas of device in worker process, worker owns replica of device variable map
+    """
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.nodes = []  # node id --> variable dict of device
+        self.node_ids = {}  # id of variable dict --> node id
+        self.pending_rows = []  # new variables to send to worker
+        self.pending_values = {}  # node id --> variable dict, value changed in main process
+
+        rows = []
+        for key, list_node in dev.code_to_node.items():
+            rows.append(replica_row(key, list_node))
+            self.nodes.append(list_node)
+        self.node_ids = {id(n): i for i, n in enumerate(self.nodes)}
+        slots = [(self.node_ids.get(id(b['ListNode'])), b['module']) for b in dev.ReadBlock]
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=init_replica, initargs=(rows, slots))
+
+    def add_node(self, key, list_node):
+        """
+        add new variable (auto discovered) to replica of worker
+        """
+        self.pending_rows.append(replica_row(key, list_node))
+        self.node_ids[id(list_node)] = len(self.nodes)
+        self.nodes.append(list_node)
+
+    def set_value(self, list_node):
+        """
+        value of variable is changed in main process, send to replica with next parsing
+        """
+        node_id = self.node_ids.get(id(list_node))
+        if node_id is not None:
+            self.pending_values[node_id] = list_node
+
+    async def parse(self, datas, O2M, rtime):
+        """
+        parse reading datas in worker process, update variable value of device
+        :return: mqtt frames (bytes) of modules
+        """
+        slot_values = [(slot, v if type(v) in PLAIN_TYPES else to_plain(v))
+                       for slot, v in enumerate(datas) if v is not None]
+        new_rows, self.pending_rows = self.pending_rows, []
+        new_values = [(node_id, to_plain(n['value'])) for node_id, n in self.pending_values.items()]
+        self.pending_values = {}
+        frames, updates, missing, msg = await asyncio.get_running_loop().run_in_executor(
+            self.executor, parse_slots, slot_values, rtime, O2M, new_rows, new_values)
+
+        for node_id, attr, value in updates:
+            self.nodes[node_id][attr] = value
+        for s in msg:
+            print(s)
+        return frames, missing
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
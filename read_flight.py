@@ -0,0 +1,87 @@
+import asyncio
+
+from logger import log
+
+
+class read_single_flight(object):
+    """
+    single-flight read of device, overlapping read requests are merged into one read,
+    requests for variables being read wait for the running read, result is returned to every request
+    """
+
+    def __init__(self, dev, window=0.0):
+        self.dev = dev
+        self.window = window  # merge window (s), 0: requests of the same loop iteration are merged
+        self.pending = {}  # variable key --> read item, waiting for next read
+        self.pending_future = None  # result of next read
+        self.inflight = {}  # variable key --> result future of running read
+        self.read_task = None
+
+    def variable_key(self, item):
+        """
+        key of variable in read item, NodeId for opcua, address for s7
+        """
+        if self.dev.link_type == 's7':
+            return item['s7']['s7_db'], item['s7']['s7_start'], item['s7']['s7_size']
+        return item['NodeID']
+
+    async def read(self, read_block):
+        """
+        read variables of temporary read block, merged with overlapping requests of device
+        :param read_block: read items [{'module','NodeID','ListNode','s7'},...], not changed by reading
+        :return: all variables are read
+        """
+        futures = set()
+        for item in read_block:
+            key = self.variable_key(item)
+            future = self.inflight.get(key)
+            if future is None:  # not being read, join next read
+                if self.pending_future is None:
+                    self.pending_future = asyncio.get_running_loop().create_future()
+                self.pending[key] = item
+                future = self.pending_future
+            futures.add(future)
+        if self.pending and self.read_task is None:
+            self.read_task = asyncio.create_task(self.flush())
+        if not futures:
+            return True
+        # one cancelled request must not cancel the shared read
+        results = await asyncio.gather(*[asyncio.shield(f) for f in futures])
+        return all(results)
+
+    async def flush(self):
+        """
+        read pending variables one batch after another, requests arrived while reading are merged to next batch
+        """
+        future = None
+        try:
+            while self.pending:
+                await asyncio.sleep(self.window)
+                items, future = list(self.pending.values()), self.pending_future
+                self.pending, self.pending_future = {}, None
+                for item in items:
+                    self.inflight[self.variable_key(item)] = future
+                try:
+                    success = await self.dev.read_temp_block(items)
+                except Exception as e:
+                    log.warning(f'Failure to read merged {len(items)} variables of {self.dev.name}: {e}')
+                    success = False
+                finally:
+                    self.inflight = {k: f for k, f in self.inflight.items() if f is not future}
+                if not future.done():
+                    future.set_result(success)
+        finally:
+            if future is not None and not future.done():  # cancelled while reading
+                future.set_result(False)
+            self.read_task = None
+
+    async def close(self):
+        """
+        cancel running read, waiting requests return failure
+        """
+        if self.read_task is not None:
+            self.read_task.cancel()
+            await asyncio.gather(self.read_task, return_exceptions=True)
+        if self.pending_future is not None and not self.pending_future.done():
+            self.pending_future.set_result(False)
+        self.pending, self.pending_future, self.inflight = {}, None, {}
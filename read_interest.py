@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from logger import log
+
+
+class read_interest(object):
+    """
+    consumer interest of device, variables of leases are read at requested rate until lease expires,
+    variables already in read block are read only if requested rate is faster than scan period
+    """
+    MAX_SCAN_GAP = 10.0  # interval (s) of cyclic reads longer than this is a pause (disconnect), not measured
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.scan_period = None  # measured period (s) of cyclic read of read block, None before measured
+        self.last_scan = None  # monotonic time of last cyclic read
+        # lease id --> {'nodes': {path: variable}, 'rate': s, 'expires': monotonic time, 'due': monotonic time,
+        #               'var_map': variable map which variables are resolved from}
+        self.leases = {}
+        self.mqtt_t = None
+        self.scanned = None  # (read block, paths of read block variables)
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def register(self, lease_id, nodes, rate, ttl, mqtt_t):
+        """
+        register or renew lease, variables are replaced by the new request
+        :param nodes: variables in variable map
+        :param rate: read period (s)
+        :param ttl: lease time to live (s), lease is removed unless renewed
+        """
+        now = time.monotonic()
+        lease = self.leases.get(lease_id)
+        self.leases[lease_id] = {'nodes': {n['path']: n for n in nodes}, 'rate': rate, 'expires': now + ttl,
+                                 'due': now if lease is None else min(lease['due'], now + rate),
+                                 'var_map': self.dev.code_to_node}
+        self.mqtt_t = mqtt_t
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        else:
+            self.wakeup.set()
+
+    def cancel(self, lease_id):
+        """
+        remove lease
+        :return: lease was registered
+        """
+        if self.leases.pop(lease_id, None) is None:
+            return False
+        self.wakeup.set()
+        return True
+
+    def scan_done(self):
+        """
+        cyclic read of read block is successful, measure scan period
+        """
+        now = time.monotonic()
+        if self.last_scan is not None and now - self.last_scan < self.MAX_SCAN_GAP:
+            interval = now - self.last_scan
+            self.scan_period = interval if self.scan_period is None else 0.8 * self.scan_period + 0.2 * interval
+        self.last_scan = now
+
+    def is_fast(self, rate, now):
+        """
+        requested rate is faster than cyclic read, or cyclic read is not running (not measured or stalled)
+        """
+        if self.scan_period is None or now - self.last_scan > 2 * self.scan_period:
+            return True
+        return rate < self.scan_period
+
+    def is_scanned(self, node):
+        """
+        variable (or its parent) is in read block of device
+        """
+        if self.scanned is None or self.scanned[0] is not self.dev.ReadBlock:
+            self.scanned = (self.dev.ReadBlock, {b['ListNode']['path'] for b in self.dev.ReadBlock if b['ListNode']})
+        path = node['path']
+        while path:
+            if path in self.scanned[1]:
+                return True
+            path = path.rpartition('/')[0]
+        return False
+
+    def due_nodes(self, now):
+        """
+        variables of due leases, the due time of leases is advanced
+        """
+        nodes = {}
+        for lease in self.leases.values():
+            if lease['due'] > now:
+                continue
+            lease['due'] = max(lease['due'] + lease['rate'], now)
+            fast = self.is_fast(lease['rate'], now)
+            for path, n in lease['nodes'].items():
+                if fast or not self.is_scanned(n):
+                    nodes[path] = n
+        return list(nodes.values())
+
+    async def run(self):
+        """
+        scheduler task of leases, exit when no lease is registered
+        """
+        while True:
+            now = time.monotonic()
+            for lease_id in [k for k, v in self.leases.items() if v['expires'] <= now]:
+                del self.leases[lease_id]
+                log.info(f'Read interest {lease_id} of {self.dev.name} expired.')
+            # variable list is reloaded, consumer registers again with new variables
+            for lease_id in [k for k, v in self.leases.items() if v['var_map'] is not self.dev.code_to_node]:
+                del self.leases[lease_id]
+                log.info(f'Read interest {lease_id} of {self.dev.name} removed, variable list is reloaded.')
+            if not self.leases:
+                self.task = None
+                return
+
+            nodes = self.due_nodes(now)
+            if nodes and self.dev.connecting is True and self.dev.loading is True:
+                O2M_list = []
+                try:
+                    if await self.dev.read_temp_block(self.dev.read_items(nodes), O2M_list):
+                        self.dev.publish_stage(self.mqtt_t, O2M_list)
+                except Exception as e:
+                    log.warning(f'Failure to read interest variables of {self.dev.name}: {e}')
+
+            if not self.leases:  # cancelled while reading
+                continue
+            now = time.monotonic()
+            wait = min(min(v['due'] for v in self.leases.values()),
+                       min(v['expires'] for v in self.leases.values())) - now
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(wait, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """
+        stop scheduler task, all leases are removed
+        """
+        self.leases = {}
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import time
 
@@ -8,6 +9,9 @@ from bigtree import find_child_by_name, find_path
 
 from api.api_manager import request_get
 from logger import log
+from recipe_cache import copy_result
+from recipe_plan import recipe_write_plan
+from utils.json_stream import json_array_stream
 from utils.helpers import code2format_str
 from utils.time_util import get_current_time, get_milliseconds
 
@@ -394,6 +398,45 @@ async def request_recipe_handle(dis, url, req, dev, module, write_recipe_id):
             await return_request_state(dev, req, 1009)
 
 
+async def download_recipe(dis, url, recipe_id, flow_index, dev, module):
+    """
+    download recipe from server, modules are parsed one by one while downloading,
+    parsed module is reused from cache if its datas are not changed
+    :return: (response fields except data, parse results of modules), (None, []) if no response
+    """
+    parser = json_array_stream('data')
+    cached = dis.recipe_cache.get(recipe_id, flow_index) or {}
+    digests = []
+    results = []
+    reused = 0
+    try:
+        async for text in dis.recipe_cache.chunks(url, recipe_id, flow_index):
+            for mr, raw in parser.feed(text):
+                digest = hashlib.sha256(raw.encode()).hexdigest()
+                result = cached.get(digest)
+                if result is not None:
+                    result = copy_result(result)
+                    reused += 1
+                else:
+                    key = (mr["blockId"], mr["index"], mr["category"])
+                    if mc_match := dis.recipe_request_map.get(key):  # 针对MC做特殊处理
+                        mr["list"][0]["value"]["Basic"]["Id"] = 0
+                    # parse json datas
+                    result = await dis.json_data_parse(mr, dev, module)
+                digests.append(digest)
+                results.append(result)
+        parser.feed('', final=True)
+    except Exception as e:
+        log.warning(f'Failure to request recipeId {recipe_id} from {url}: {e}')
+        return None, []
+
+    if parser.header.get('code') == 200:
+        dis.recipe_cache.put(recipe_id, flow_index, digests, results)
+    if reused:
+        log.info(f'Use {reused}/{len(results)} parsed modules of recipeId {recipe_id} flowIndex {flow_index} from cache.')
+    return parser.header, results
+
+
 async def request_recipe_handle_gather_link(dis, url, req, dev, module, write_recipe_id, ua_device, flow_index, valid_keys, writable_keys, mqtt):
     """
     request recipe handle
@@ -410,15 +453,10 @@ async def request_recipe_handle_gather_link(dis, url, req, dev, module, write_re
     log.info(f'Request recipeId {recipe_id} from {url}')
     # datas = server_datas_testing  # testing
     await return_request_state(dev, req, 1)
-    if flow_index is None:
-        params = {'recipeId': recipe_id}
-    else:
-        params = {'recipeId': recipe_id, 'flowIndex': flow_index}
-    # params = {'recipeId': 47}
-    datas = request_get(url, "", params)
+    datas, results = await download_recipe(dis, url, recipe_id, flow_index, dev, module)
     # datas = request_get('http://192.168.55.71:13871/api/upper/recipe/info/drive/format?recipeId=47&flowIndex=', "", params)
-    print(f'{get_current_time()}: 配方请求结果：{datas}')
-    log.info(f'配方请求结果：{datas}')
+    print(f'{get_current_time()}: 配方请求结果：{datas}, 模组数量：{len(results)}')
+    log.info(f'配方请求结果：{datas}, 模组数量：{len(results)}')
     # data parse and write recipe to opcua
     # print(f'Server response data: {datas}.')
     if datas is None:  # no response or response none
@@ -445,98 +483,36 @@ async def request_recipe_handle_gather_link(dis, url, req, dev, module, write_re
         await return_request_state(dev, req, 2)
         print(f'{get_current_time()}: 配方开始向PLC下载...')
         log.info(f' 配方开始向PLC下载...')
-        # parse all datas
-        results = []
+        # 多flow配方: 当前flow下载时，后台预取下一个flow
+        next_flow = dis.next_recipe_flow(flow_index)
+        if next_flow is not None:
+            dis.recipe_cache.prefetch(url, recipe_id, next_flow)
+
         all_success = True
-        for mr in datas['data']:
-            key = (mr["blockId"], mr["index"], mr["category"])
-            if mc_match := dis.recipe_request_map.get(key):  # 针对MC做特殊处理
-                mr["list"][0]["value"]["Basic"]["Id"] = 0
-            # parse json datas
-            result = await dis.json_data_parse(mr, dev, module)
-            # print(f"合并前：Name:{result['Device'].name} Nodes: {result['Nodes']}  list len:{len(result['M2O_list'])}")
-            results.append(result)
-
-        # check writable
-        rv_m2o_list = []
+
+        # check writable, group modules per device in write plan
+        plan = recipe_write_plan()
         for re_check in results:
             re_module = re_check['Module']
             if re_module:
                 current_dev = find_dev_with_module(re_module, ua_device)
                 key = (re_module["blockId"], re_module["index"], re_module["category"])
-                if not dis.recipe_request_map.get(key):
-                    # try:
-                    #     recipe_valid_info = current_dev.code_to_node.get(
-                    #         code2format_str(re_module['blockId'], re_module['index'],
-                    #                         re_module['category'], "Others_Recipe_valid"))
-                    #     if not recipe_valid_info:
-                    #         recipe_valid_info = current_dev.code_to_node.get(
-                    #             code2format_str(re_module['blockId'], re_module['index'],
-                    #                             re_module['category'], "Other_Reicpe_Valid"))
-                    # except:
-                    #     recipe_valid_info = current_dev.code_to_node.get(
-                    #         code2format_str(re_module['blockId'], re_module['index'],
-                    #                         re_module['category'], "Other_Reicpe_Valid"))
-                    #
-                    # try:
-                    #     writable_path_info = current_dev.code_to_node.get(
-                    #         code2format_str(re_module['blockId'], re_module['index'],
-                    #                         re_module['category'], "Others_Recipe_Writable"))
-                    #     if not writable_path_info:
-                    #         writable_path_info = current_dev.code_to_node.get(
-                    #             code2format_str(re_module['blockId'], re_module['index'],
-                    #                             re_module['category'], "Other_Reicpe_Writable"))
-                    # except:
-                    #     writable_path_info = current_dev.code_to_node.get(
-                    #         code2format_str(re_module['blockId'], re_module['index'],
-                    #                         re_module['category'], "Other_Reicpe_Writable"))
-                    recipe_valid_info = None
-                    for key in valid_keys:
-                        try:
-                            recipe_valid_info = current_dev.code_to_node.get(
-                                code2format_str(re_module['blockId'], re_module['index'],
-                                                re_module['category'], key))
-                            if recipe_valid_info:
-                                break
-                        except Exception:
-                            continue
-
-                    writable_path_info = None
-                    for key in writable_keys:
-                        try:
-                            writable_path_info = current_dev.code_to_node.get(
-                                code2format_str(re_module['blockId'], re_module['index'],
-                                                re_module['category'], key))
-                            if writable_path_info:
-                                break
-                        except Exception:
-                            continue
-                    if recipe_valid_info is None or writable_path_info is None:
-                        log.warning(f'终止操作，请核对{re_module["blockId"]}-{re_module["index"]}-{re_module["category"]}模组Recipe Valid或Writable是否存在或异常')
-                        await return_request_state(dev, req, 1005)
-                        return
-                    if not writable_path_info["value"]:  # 检查当前模组是否支持下载配方
-                        msg = f'{re_module["blockId"]}-{re_module["index"]}-{re_module["category"]}模组当前不支持下载配方，终止操作'
-                        log.warning(msg)
-                        all_success = False
-                        await return_request_state(dev, req, 1005)
-                        return
-                    else:
-                        if await re_check['Device'].linker.write_multi_variables(
-                                [{'node_id': recipe_valid_info["NodeID"],
-                                  'datatype': recipe_valid_info["DataType"],
-                                  'value': True}], 1.5):  # 先把模组的Recipe_Valid’为True
-                            # rv_m2o_list.append(recipe_valid_info)  # 如果写入成功则把当前模组recipe_valid放入list中进行临时保存
-                            rv_m2o_list.append({current_dev: recipe_valid_info})  # 如果写入成功则把当前模组recipe_valid放入list中进行临时保存
-                        else:
-                            # 检测如果一个模组的recipe_valid写入失败，则直接终止所有操作
-                            msg = (
-                                f'{re_module["blockId"]}-{re_module["index"]}-{re_module["category"]}模组recipe_valid置为'
-                                f'True写入失败，终止操作')
-                            log.warning(msg)
-                            all_success = False
-                            await return_request_state(dev, req, 1005)
-                            return
+                if dis.recipe_request_map.get(key):  # MC直接写配方，不需要Recipe_Valid握手
+                    plan.add(re_check)
+                    continue
+                recipe_valid_info = find_module_node(current_dev, re_module, valid_keys)
+                writable_path_info = find_module_node(current_dev, re_module, writable_keys)
+                if recipe_valid_info is None or writable_path_info is None:
+                    log.warning(f'终止操作，请核对{re_module["blockId"]}-{re_module["index"]}-{re_module["category"]}模组Recipe Valid或Writable是否存在或异常')
+                    await return_request_state(dev, req, 1005)
+                    return
+                if not writable_path_info["value"]:  # 检查当前模组是否支持下载配方
+                    msg = f'{re_module["blockId"]}-{re_module["index"]}-{re_module["category"]}模组当前不支持下载配方，终止操作'
+                    log.warning(msg)
+                    all_success = False
+                    await return_request_state(dev, req, 1005)
+                    return
+                plan.add(re_check, recipe_valid_info)
             else:
                 msg = f"{re_check['ErrMSG']}, 终止操作"
                 log.warning(msg)
@@ -544,37 +520,24 @@ async def request_recipe_handle_gather_link(dis, url, req, dev, module, write_re
                 await return_request_state(dev, req, 1005)
                 return
 
-        # Merge  with the same device
-        for result in results:
-            # find same device in results
-            same_dev_results = list(filter(lambda x: x['Device'] == result['Device'], results))
-            for r in same_dev_results:
-                if r != result:
-                    result['M2O_list'].extend(r['M2O_list'])
-                    result['ErrMSG'].extend(r['ErrMSG'])
-                    result['Nodes'] += r['Nodes']
-                    # delete same device in results
-                    results.remove(r)
-            # print(f"合并后：Name:{result['Device'].name} Nodes: {result['Nodes']}  list len:{len(result['M2O_list'])}")
-            if len(result['M2O_list']) == 0:
-                results.remove(result)
+        # 先把模组的Recipe_Valid’为True, 每个设备一次写入，各设备并发
+        failed_modules = await plan.write_valid(True)
+        if failed_modules:
+            # 检测如果一个模组的recipe_valid写入失败，则直接终止所有操作
+            for _, re_module in failed_modules:
+                log.warning(f'{re_module["blockId"]}-{re_module["index"]}-{re_module["category"]}模组recipe_valid置为'
+                            f'True写入失败，终止操作')
+            all_success = False
+            await return_request_state(dev, req, 1005)
+            return
+
         # write recipe data to all device
-        tasks = []
-        for re in results:
-            print(
-                f'{get_current_time()}:开始向{re["Device"].name}下载配方')
-            log.info(
-                f'开始向{re["Device"].name}下载配方')
-            if re['Device'].connecting:
-                tasks.append(re['Device'].linker.write_multi_variables(re['M2O_list'], 8))
-
-        recipe_write_states = await asyncio.gather(*tasks)
-        all_success = all(recipe_write_states)
+        all_success = await plan.write_datas(dis.recipe_delta_write, recipe_id)
         # check all recipe write success or not
         if all_success:
             # 开始给所有模组的Recipe_Valid 写False 操作
-            if rv_m2o_list:
-                if not await write_all_rv_false(rv_m2o_list, dev, req):
+            if plan.has_valid():
+                if not await write_all_rv_false(plan, dev, req):
                     return
             print(f'{get_current_time()}: 所有配方下载成功，开始下发recipe_id给MC')
             log.info(f'所有配方下载成功，开始下发recipe_id给MC')
@@ -606,18 +569,33 @@ async def request_recipe_handle_gather_link(dis, url, req, dev, module, write_re
         await return_request_state(dev, req, datas['code'])
 
 
-async def write_all_rv_false(rv_m2o_list, dev, req):
-    for rv_m2o in rv_m2o_list:
-        for current_dev, value in rv_m2o.items():
-            if not await current_dev.linker.write_multi_variables(
-                    [{'node_id': value["NodeID"],
-                      'datatype': value["DataType"],
-                      'value': False}], 1.5):  # 先把模组的Recipe_Valid’为False
-                # 检测如果一个模组的recipe_valid写入失败，则直接终止所有操作
-                msg = (
-                    f'{current_dev} recipe_valid置为False写入失败，终止操作')
-                print(f'{get_current_time()}: {msg}')
-                log.warning(msg)
-                await return_request_state(dev, req, 1005)
-                return False  # 如果其中有一个模组的Recipe_Valid 写False失败就终止所有操作
+def find_module_node(current_dev, module, keys):
+    """
+    find variable of module with candidate codes, the first existing one
+    """
+    for key in keys:
+        try:
+            list_node = current_dev.code_to_node.get(
+                code2format_str(module['blockId'], module['index'], module['category'], key))
+            if list_node:
+                return list_node
+        except Exception:
+            continue
+    return None
+
+
+async def write_all_rv_false(plan, dev, req):
+    """
+    write Recipe_Valid of all modules to False after downloading
+    """
+    failed_modules = await plan.write_valid(False)
+    for current_dev, _ in failed_modules:
+        # 检测如果一个模组的recipe_valid写入失败，则直接终止所有操作
+        msg = (
+            f'{current_dev} recipe_valid置为False写入失败，终止操作')
+        print(f'{get_current_time()}: {msg}')
+        log.warning(msg)
+    if failed_modules:
+        await return_request_state(dev, req, 1005)
+        return False  # 如果其中有一个模组的Recipe_Valid 写False失败就终止所有操作
     return True
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from api.api_manager import request_get_stream
+from logger import log
+
+
+def copy_result(result):
+    """
+    copy parse result of module, M2O list and error messages can be changed by caller
+    """
+    return dict(result, M2O_list=list(result['M2O_list']), ErrMSG=list(result['ErrMSG']))
+
+
+class recipe_cache(object):
+    """
+    cache of recipe responses (prefetched) and parsed recipes (parse results of modules), keyed by recipeId/flowIndex,
+    bounded by LRU and TTL, parsed module is invalidated by hash of its server datas and reloading of variable list
+    """
+
+    def __init__(self, max_entries=16, ttl=300, prefetch_ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl  # parsed recipe time to live (s)
+        self.prefetch_ttl = prefetch_ttl  # prefetched response time to live (s)
+        self.parsed = OrderedDict()  # (recipe id, flow index) --> (time, var maps, {module digest: result})
+        self.prefetched = {}  # (recipe id, flow index) --> (time, response text)
+        self.prefetching = {}  # (recipe id, flow index) --> task
+
+    async def chunks(self, url, recipe_id, flow_index):
+        """
+        response text of recipe request, prefetched response is used if it is fresh, otherwise streamed from server
+        """
+        key = (recipe_id, flow_index)
+        task = self.prefetching.get(key)
+        if task is not None and not task.done():
+            await asyncio.gather(task, return_exceptions=True)
+        prefetched = self.prefetched.pop(key, None)
+        if prefetched is not None and time.monotonic() - prefetched[0] < self.prefetch_ttl:
+            log.info(f'Use prefetched recipeId {recipe_id} flowIndex {flow_index}.')
+            yield prefetched[1]
+            return
+        async for text in request_get_stream(url, "", self.params(recipe_id, flow_index)):
+            yield text
+
+    def prefetch(self, url, recipe_id, flow_index):
+        """
+        request recipe from server in background
+        """
+        key = (recipe_id, flow_index)
+        task = self.prefetching.get(key)
+        if task is not None and not task.done():
+            return
+        self.prefetching[key] = asyncio.create_task(self.prefetch_task(url, key))
+
+    async def prefetch_task(self, url, key):
+        """
+        request recipe and keep complete response
+        """
+        try:
+            text = ''.join([t async for t in request_get_stream(url, "", self.params(*key))])
+        except Exception as e:
+            log.warning(f'Failure to prefetch recipeId {key[0]} flowIndex {key[1]}: {e}')
+            return
+        finally:
+            self.prefetching.pop(key, None)
+        self.prefetched[key] = (time.monotonic(), text)
+        log.info(f'Prefetch recipeId {key[0]} flowIndex {key[1]}.')
+
+    @staticmethod
+    def params(recipe_id, flow_index):
+        """
+        request parameters of recipe
+        """
+        if flow_index is None:
+            return {'recipeId': recipe_id}
+        return {'recipeId': recipe_id, 'flowIndex': flow_index}
+
+    def get(self, recipe_id, flow_index):
+        """
+        parsed modules of recipe, None if not cached, expired or variable list of device is reloaded
+        :return: {module digest: parse result}, copy result before changing it
+        """
+        key = (recipe_id, flow_index)
+        entry = self.parsed.get(key)
+        if entry is None:
+            return None
+        cached_time, var_maps, modules = entry
+        if (time.monotonic() - cached_time > self.ttl
+                or any(dev.code_to_node is not var_map for dev, var_map in var_maps)):
+            del self.parsed[key]
+            return None
+        self.parsed.move_to_end(key)
+        return modules
+
+    def put(self, recipe_id, flow_index, digests, results):
+        """
+        save parsed modules of recipe, only recipe without parsing error is cached
+        :param digests: hash of server datas of modules
+        """
+        if any(r['ErrMSG'] or r['Device'] is None for r in results):
+            return
+        devices = {id(r['Device']): r['Device'] for r in results}.values()
+        var_maps = [(dev, dev.code_to_node) for dev in devices]
+        modules = {digest: copy_result(r) for digest, r in zip(digests, results)}
+        self.parsed[(recipe_id, flow_index)] = (time.monotonic(), var_maps, modules)
+        self.parsed.move_to_end((recipe_id, flow_index))
+        while len(self.parsed) > self.max_entries:
+            self.parsed.popitem(last=False)
+
+    async def close(self):
+        """
+        cancel prefetching tasks
+        """
+        tasks = list(self.prefetching.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.prefetching.clear()
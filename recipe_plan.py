@@ -0,0 +1,89 @@
+import asyncio
+
+from logger import log
+from utils.time_util import get_current_time
+
+
+class recipe_write_plan(object):
+    """
+    write plan of recipe, parse results of modules are grouped per device (in order of first module of device),
+    the plan drives Recipe_Valid handshake, data writing and verification of all devices
+    """
+
+    def __init__(self):
+        # device --> {'M2O_list': [], 'Nodes': 0, 'ErrMSG': [], 'valid': [(module, recipe_valid_info),...]}
+        self.devices = {}
+
+    def add(self, result, recipe_valid_info=None):
+        """
+        add parse result of module to plan
+        :param recipe_valid_info: Recipe_Valid variable of module, None if module needs no handshake (MC)
+        """
+        entry = self.devices.get(result['Device'])
+        if entry is None:
+            entry = self.devices[result['Device']] = {'M2O_list': [], 'Nodes': 0, 'ErrMSG': [], 'valid': []}
+        entry['M2O_list'].extend(result['M2O_list'])
+        entry['ErrMSG'].extend(result['ErrMSG'])
+        entry['Nodes'] += result['Nodes']
+        if recipe_valid_info is not None:
+            entry['valid'].append((result['Module'], recipe_valid_info))
+
+    def has_valid(self):
+        """
+        plan has modules with Recipe_Valid handshake
+        """
+        return any(entry['valid'] for entry in self.devices.values())
+
+    async def write_valid(self, value):
+        """
+        write Recipe_Valid of modules, one write per device, devices are written concurrently
+        :return: failed modules [(device, module),...]
+        """
+        async def write_dev(current_dev, items):
+            M2O_list = [{'node_id': info["NodeID"], 'datatype': info["DataType"], 'value': value} for _, info in items]
+            failed = []
+            if current_dev.link_type == 'opcua':
+                success = await current_dev.linker.write_multi_variables(M2O_list, 1.5, failed=failed)
+            else:
+                success = await current_dev.linker.write_multi_variables(M2O_list, 1.5)
+            if success:
+                return []
+            failed_nodes = {v['node_id'] for v in failed}
+            return [(current_dev, m) for m, info in items if not failed_nodes or info["NodeID"] in failed_nodes]
+
+        states = await asyncio.gather(*[write_dev(d, entry['valid'])
+                                        for d, entry in self.devices.items() if entry['valid']])
+        return [f for state in states for f in state]
+
+    async def write_datas(self, delta, recipe_id):
+        """
+        write recipe datas of all devices concurrently, verified by linker
+        :param delta: only values different from plc are written
+        :return: all devices are written successfully
+        """
+        tasks = []
+        for current_dev, entry in self.devices.items():
+            if not entry['M2O_list']:
+                continue
+            print(f'{get_current_time()}:开始向{current_dev.name}下载配方')
+            log.info(f'开始向{current_dev.name}下载配方')
+            if current_dev.connecting:
+                tasks.append(self.write_device(current_dev, entry['M2O_list'], delta, recipe_id))
+        return all(await asyncio.gather(*tasks))
+
+    @staticmethod
+    async def write_device(current_dev, M2O_list, delta, recipe_id):
+        """
+        write recipe datas to device, in delta mode only values different from plc are written
+        """
+        if delta and current_dev.link_type == 'opcua':
+            changed, skipped = await current_dev.linker.filter_changed_variables(M2O_list)
+            if skipped:
+                # 审计: 记录差量下载跳过的变量
+                log.info(f'配方{recipe_id}差量下载{current_dev.name}: 写入{len(changed)}, 跳过{len(skipped)}(值未变化)')
+                log.info(f'配方{recipe_id}差量下载{current_dev.name}跳过: '
+                         f'{[(v["node_id"], v["value"]) for v in skipped]}')
+            if not changed:
+                return True
+            M2O_list = changed
+        return await current_dev.linker.write_multi_variables(M2O_list, 8)
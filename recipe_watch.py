@@ -0,0 +1,128 @@
+import asyncio
+
+from logger import log
+from utils.helpers import code2format_str
+
+
+def get_request_nodes(dev, node, request_update, request_update_id, request_update_result):
+    """
+    get request information with variable name in node tree
+    :param node: node
+    :return: request information dictionary
+    """
+    req_dict = {'request': dev.code_to_node.get(code2format_str(node['blockId'], node['index'], node['category'],
+                                                                node['code']+"_"+request_update)),
+                'id': dev.code_to_node.get(code2format_str(node['blockId'], node['index'], node['category'],
+                                                           node['code']+"_"+request_update_id)),
+                'result': dev.code_to_node.get(code2format_str(node['blockId'], node['index'], node['category'],
+                                                               node['code']+"_"+request_update_result))
+                }
+    return req_dict
+
+
+async def clear_request_result(dev, req):
+    """
+    clear request result to server
+    :param dev: device object
+    :param req: request information dictionary
+    :return: result of writing request result to server
+    """
+    M2O_list = [{'node_id': req['result']["NodeID"], 'datatype': req['result']["DataType"], 'value': 0}]
+    await dev.linker.write_multi_variables(M2O_list, 0.1)
+
+
+class recipe_watcher(object):
+    """
+    recipe request of module (in request config file), value observer of device,
+    recipe is requested when request flag turns True with result 0, result is cleared when request flag turns False
+    """
+
+    def __init__(self, rr, dev, handle, lock):
+        """
+        :param rr: recipe request config of module
+        :param handle: coroutine function(watcher), request recipe and write to device
+        :param lock: recipe requests are handled one by one
+        """
+        self.rr = rr
+        self.module = rr['module']
+        self.write_recipe_id = rr['write_recipe_id']
+        self.flow_index = None if rr['recipe_flow_index'] == 0 else rr['recipe_flow_index']
+        self.dev = dev
+        self.handle = handle
+        self.lock = lock
+        self.var_map = None  # variable map which request nodes are resolved from
+        self.req = None  # {'request','id','result'}: variable dict
+        self.state = None  # handling condition, 'request' or 'clear'
+        self.skip_observes = 0  # parsings of stale reading datas after handling, counted by observe
+        self.task = None
+
+    def resolve(self):
+        """
+        resolve request, id and result variables, again when variable list of device is reloaded
+        """
+        self.var_map = self.dev.code_to_node
+        self.req = None
+        node = self.var_map.get(code2format_str(self.module['blockId'], self.module['index'],
+                                                self.module['category'], self.rr['request_node_path']))
+        if node is None:
+            return
+        req = get_request_nodes(self.dev, node, self.rr['recipe_request_update'],
+                                self.rr['recipe_request_id'], self.rr['recipe_request_result'])
+        if req["id"] is None or req["request"] is None or req["result"] is None:
+            log.warning(f'Failure to resolve recipe request nodes of {self.module} in {self.dev.name}.')
+            return
+        self.req = req
+
+    def observe(self):
+        """
+        value observer of device, check request flag after parsing
+        """
+        if self.dev.code_to_node is not self.var_map:
+            self.resolve()
+        if self.req is None or self.dev.connecting is not True:
+            return
+        if self.task is not None and not self.task.done():
+            return
+        if self.skip_observes > 0:
+            self.skip_observes -= 1
+            return
+
+        if self.req['request']["value"] is True and self.req['result']["value"] == 0:
+            state = 'request'
+        elif self.req['request']["value"] is False and self.req['result']["value"] != 0:
+            state = 'clear'
+        else:
+            state = None
+        if state == self.state:
+            return
+        self.state = state
+        if state is not None:
+            self.task = asyncio.create_task(self.run(state))
+
+    async def run(self, state):
+        """
+        handle recipe request or clear request result
+        """
+        try:
+            async with self.lock:
+                if state == 'request':
+                    await self.handle(self)
+                else:
+                    await clear_request_result(self.dev, self.req)
+        except Exception as e:
+            log.warning(f'向模组{self.module}写配方异常{e},请检查各模组的Recipe Valid和Writable状态')
+        finally:
+            # readings in flight or queued in pipeline may be read before writing result, skip their parsing
+            if self.dev.ReadBlock:
+                self.skip_observes = 2 + (self.dev.pipeline_depth if self.dev.pipeline_enabled else 0)
+            else:
+                self.skip_observes = 0
+            self.state = None
+
+    async def stop(self):
+        """
+        cancel running handling
+        """
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
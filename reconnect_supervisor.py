@@ -0,0 +1,95 @@
+import asyncio
+import random
+import time
+
+from logger import log
+
+
+async def tcp_probe(host, port, timeout=1.0):
+    """
+    cheap reachability check of device, open and close tcp connection
+    """
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+class reconnect_supervisor(object):
+    """
+    reconnect disconnected devices in background, with exponential backoff and jitter per device,
+    tcp probe before full handshake and limited concurrent handshakes
+    """
+
+    def __init__(self, max_handshakes=2, base_delay=1.0, max_delay=60.0, probe_timeout=1.0):
+        self.handshakes = asyncio.Semaphore(max_handshakes)  # concurrent opcua/s7 handshakes
+        self.base_delay = base_delay  # first retry delay (s)
+        self.max_delay = max_delay  # max retry delay (s)
+        self.probe_timeout = probe_timeout
+        self.tasks = {}  # device name --> reconnect task
+        self.failures = {}  # device name --> (next try time, failure count)
+
+    def request(self, dev):
+        """
+        request to reconnect device, return immediately, skipped while reconnecting or backing off
+        """
+        task = self.tasks.get(dev.name)
+        if task is not None and not task.done():
+            return
+        failure = self.failures.get(dev.name)
+        if failure is not None and failure[0] > time.time():
+            return
+        self.tasks[dev.name] = asyncio.create_task(self.reconnect(dev))
+
+    def reset(self, dev):
+        """
+        device is connected by others (command), clear backoff
+        """
+        self.failures.pop(dev.name, None)
+
+    async def cancel(self, dev):
+        """
+        cancel reconnecting of device
+        """
+        task = self.tasks.pop(dev.name, None)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def reconnect(self, dev):
+        """
+        probe and reconnect device, any failure is backed off, otherwise the manager retries every cycle
+        """
+        try:
+            host, port = dev.linker.probe_address()
+            if not await tcp_probe(host, port, self.probe_timeout):
+                self.failed(dev, f'{host}:{port} is not reachable')
+                return
+
+            async with self.handshakes:
+                await dev.reconnect()
+        except Exception as e:
+            self.failed(dev, f'{type(e).__name__}: {e}')
+            return
+
+        if dev.connecting is True:
+            self.failures.pop(dev.name, None)
+        else:
+            self.failed(dev, 'handshake failure')
+
+    def failed(self, dev, reason):
+        """
+        reconnect failure, next try after backoff delay with jitter
+        """
+        count = self.failures.get(dev.name, (0, 0))[1] + 1
+        delay = min(self.base_delay * 2 ** (count - 1), self.max_delay)
+        delay = random.uniform(delay / 2, delay)
+        self.failures[dev.name] = (time.time() + delay, count)
+        if count == 1 or delay >= self.max_delay / 2:
+            log.warning(f'Failure to reconnect {dev.name} ({count}), {reason}, retry after {delay:.1f}s.')
@@ -43,6 +43,12 @@ class s7_linker(object):
             return await asyncio.get_running_loop().run_in_executor(None, client.write_area,
                                                                     snap7.type.Areas.DB, db_number, start, data)
 
+    def probe_address(self):
+        """
+        host and port (iso-on-tcp) of plc, for tcp reachability probe
+        """
+        return self.uri, 102
+
     async def new_client(self):
         pass
         # self.client = snap7.client.Client()
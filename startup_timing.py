@@ -0,0 +1,48 @@
+import time
+
+from logger import log
+
+
+class startup_timing(object):
+    """
+    startup timing report: import, config load, variable map load, connect and first publish
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.phases = []  # [(phase, seconds),...] of sequential phases
+        self.devices = {}  # phase --> {device name: seconds}, phases run concurrently per device
+        self.reported = False
+
+    def mark(self, phase):
+        """
+        end of sequential phase
+        """
+        now = time.time()
+        self.phases.append((phase, now - self.last_time))
+        self.last_time = now
+
+    def record(self, phase, name, seconds):
+        """
+        time of phase of device
+        """
+        self.devices.setdefault(phase, {})[name] = seconds
+
+    def first_publish(self, name):
+        """
+        first data frame is published, report startup timing once
+        """
+        if self.reported:
+            return
+        self.reported = True
+        report = [f'{phase} {seconds:.3f}s' for phase, seconds in self.phases]
+        for phase, devices in self.devices.items():
+            slowest = max(devices, key=devices.get)
+            report.append(f'{phase} {devices[slowest]:.3f}s (slowest {slowest}, {len(devices)} devices)')
+        report.append(f'first publish {name} {time.time() - self.start_time:.3f}s after start')
+        print(f'Startup timing: {", ".join(report)}')
+        log.info(f'Startup timing: {", ".join(report)}')
+
+
+startup = startup_timing()
@@ -0,0 +1,117 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from logger import log
+
+
+class timed_clear_timer(object):
+    """
+    timed clear of safety control variables with deadline heap,
+    timer is armed when variable turns True and disarmed when it turns False,
+    variables due at the same time are cleared with one write
+    """
+
+    def __init__(self, dev, tolerance=0.005):
+        self.dev = dev
+        self.tolerance = tolerance  # variables due within tolerance (s) are cleared together
+        self.items = []  # timed clear block of device
+        self.heap = []  # [(deadline, seq, item index),...]
+        self.armed = {}  # item index --> seq of valid heap entry
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def load(self, items):
+        """
+        load timed clear block of device, all timers are disarmed
+        """
+        self.items = items
+        self.heap = []
+        self.armed = {}
+
+    def observe(self):
+        """
+        value observer of device, check timed clear variables after parsing of reading or subscription datas
+        """
+        if not self.items:
+            return
+        if self.dev.Read_Times < 3:  # values are not stable after connecting
+            self.armed.clear()
+            return
+        now = time.monotonic()
+        earliest = self.heap[0][0] if self.heap else None
+        for index, b in enumerate(self.items):
+            value = b['ListNode']['value']
+            if value is True and index not in self.armed:  # turn True, arm
+                seq = next(self.seq)
+                self.armed[index] = seq
+                heapq.heappush(self.heap, (now + b['timed_clear_time'] / 1000, seq, index))
+            elif value is False and index in self.armed:  # turn False, disarm (heap entry is skipped when due)
+                del self.armed[index]
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        elif self.heap and self.heap[0][0] != earliest:  # earlier deadline, wake up timer
+            self.wakeup.set()
+
+    async def run(self):
+        """
+        timer task, sleep until earliest deadline and clear due variables
+        """
+        while True:
+            while self.heap and self.armed.get(self.heap[0][2]) != self.heap[0][1]:  # skip disarmed entries
+                heapq.heappop(self.heap)
+            self.wakeup.clear()
+            timeout = max(self.heap[0][0] - time.monotonic(), 0) if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            due = []
+            deadline = time.monotonic() + self.tolerance
+            while self.heap and self.heap[0][0] <= deadline:
+                _, seq, index = heapq.heappop(self.heap)
+                if self.armed.get(index) == seq:
+                    del self.armed[index]
+                    due.append(self.items[index])
+            if due:
+                await self.clear(due)
+
+    async def clear(self, due):
+        """
+        clear due variables with one write
+        """
+        if self.dev.connecting is not True:
+            return
+        M2O_list = []
+        for b in due:
+            if self.dev.link_type == 'opcua':
+                M2O_list.append({'node_id': b['NodeID'], 'datatype': b['ListNode']['DataType'], 'value': False})
+            elif self.dev.link_type == 's7':
+                M2O_list.append({'s7_db': b["s7"]["s7_db"], 's7_start': b["s7"]["s7_start"],
+                                 's7_bit': b["s7"]["s7_bit"], 's7_size': b["s7"]["s7_size"], 'value': False})
+            b['ListNode']["value"] = False
+            self.dev.sync_replica(b['ListNode'])
+            log.info(f'Timed Clear {b["NodeID"]} of {self.dev.name}, {b["timed_clear_time"]}ms.')
+        try:
+            if self.dev.link_type == 'opcua':
+                await self.dev.linker.write_multi_variables(M2O_list, timeout=0.2)
+            elif self.dev.link_type == 's7':
+                await self.dev.linker.write_multi_variables(M2O_list)
+        except Exception as e:
+            log.warning(f'Failure to timed clear {len(M2O_list)} variables of {self.dev.name}: {e}')
+
+    async def stop(self):
+        """
+        stop timer task, all timers are disarmed
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.heap = []
+        self.armed = {}
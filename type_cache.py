@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import hashlib
+import inspect
+import json
+import os
+
+from asyncua import ua
+from asyncua.common.utils import Buffer
+from asyncua.ua.ua_binary import struct_from_binary, struct_to_binary
+
+from logger import log
+
+# private helpers of structures104 are used to save definitions to disk, they are not in every asyncua version
+# (e.g. 1.1.5), without them definitions are loaded with public load_data_type_definitions
+try:
+    from asyncua.common.structures104 import (RecursiveParser, _generate_object, _topological_sort_dtypes,
+                                              clean_name, get_children_descriptions_type_definitions,
+                                              make_basetype)
+    DISK_CACHE_SUPPORTED = True
+except ImportError:
+    DISK_CACHE_SUPPORTED = False
+
+
+async def generate_object(*args, **kwargs):
+    """
+    _generate_object of structures104, coroutine in some asyncua versions
+    """
+    env = _generate_object(*args, **kwargs)
+    if inspect.isawaitable(env):
+        env = await env
+    return env
+
+
+def ua_to_text(obj):
+    """
+    encode opcua object (StructureDefinition, EnumDefinition) to text for json file
+    """
+    return base64.b64encode(struct_to_binary(obj)).decode()
+
+
+def ua_from_text(obj_type, text):
+    """
+    decode opcua object from text of json file
+    """
+    return struct_from_binary(obj_type, Buffer(base64.b64decode(text)))
+
+
+async def server_type_version(client):
+    """
+    version of data types of server, hash of namespace array and namespace version/publication date
+    :return: version string, None if server has no namespace version information
+    """
+    ns_array = await client.get_namespace_array()
+    namespaces = client.get_node(ua.NodeId(ua.ObjectIds.Server_Namespaces))
+    props = []
+    for desc in await namespaces.get_children_descriptions(refs=ua.ObjectIds.HasComponent):
+        for p in await client.get_node(desc.NodeId).get_children_descriptions(refs=ua.ObjectIds.HasProperty):
+            if p.BrowseName.Name in ['NamespaceUri', 'NamespaceVersion', 'NamespacePublicationDate']:
+                props.append((desc.BrowseName.Name, p.BrowseName.Name, p.NodeId))
+    if not props:
+        return None
+    values = await client.uaclient.read_attributes([p[2] for p in props], ua.AttributeIds.Value)
+    versions = sorted([ns, name, str(v.Value.Value)] for (ns, name, _), v in zip(props, values)
+                      if v.Value is not None and v.Value.Value is not None and name != 'NamespaceUri')
+    if not versions:
+        return None
+    return hashlib.sha256(json.dumps([ns_array, versions], default=str).encode()).hexdigest()
+
+
+async def fetch_type_definitions(client):
+    """
+    read base data type aliases, enums, option sets and structures of server (same as load_data_type_definitions)
+    :return: definitions which can be saved to json file
+    """
+    aliases = []  # [name, parent name, NodeId],... parent is before child
+
+    async def parse_base_type(node, parent):
+        descs = await node.get_children_descriptions(refs=ua.ObjectIds.HasSubtype)
+        for desc in descs:
+            aliases.append([clean_name(desc.BrowseName.Name), parent, desc.NodeId.to_string()])
+        await asyncio.gather(*[parse_base_type(client.get_node(d.NodeId), clean_name(d.BrowseName.Name))
+                               for d in descs])
+
+    for desc in await client.nodes.base_data_type.get_children_descriptions():
+        name = clean_name(desc.BrowseName.Name)
+        if name not in ['Structure', 'Enumeration']:
+            await parse_base_type(client.get_node(desc.NodeId), name)
+
+    enums = []  # [name, NodeId, EnumDefinition, option set],...
+    for base_node, option_set in [(client.nodes.enum_data_type, False), (client.nodes.option_set_type, True)]:
+        descs, edefs = await get_children_descriptions_type_definitions(client, base_node)
+        for desc, edef in zip(descs, edefs):
+            if edef:
+                enums.append([clean_name(desc.BrowseName.Name), desc.NodeId.to_string(), ua_to_text(edef), option_set])
+
+    dtypes = _topological_sort_dtypes(await RecursiveParser(client).parse(client.nodes.base_structure_type))
+    structs = [[dts.name, dts.data_type.to_string(), ua_to_text(dts.sdef)] for dts in dtypes]  # [name, NodeId, StructureDefinition],...
+    return {'aliases': aliases, 'enums': enums, 'structs': structs}
+
+
+async def register_type_definitions(defs):
+    """
+    generate python classes of definitions and register to ua namespace
+    """
+    for name, parent, node_id in defs['aliases']:
+        if parent != 'Number' and not hasattr(ua, name):
+            env = make_basetype(name, parent)
+            ua.register_basetype(name, ua.NodeId.from_string(node_id), env[name])
+
+    for name, node_id, edef, option_set in defs['enums']:
+        node_id = ua.NodeId.from_string(node_id)
+        existing = getattr(ua, name, None)
+        if existing is not None and getattr(existing, 'data_type', None) == node_id:
+            continue
+        try:
+            env = await generate_object(name, ua_from_text(ua.EnumDefinition, edef), enum=True,
+                                        option_set=option_set, log_fail=False)
+        except Exception:
+            log.warning(f'Failure to generate enum {name} ({node_id}).')
+            continue
+        ua.register_enum(name, node_id, env[name])
+
+    structs = [(name, ua.NodeId.from_string(node_id), ua_from_text(ua.StructureDefinition, sdef))
+               for name, node_id, sdef in defs['structs']]
+    for _ in range(3):  # retry to resolve datatypes with circular dependence
+        failed = []
+        for name, data_type, sdef in structs:
+            existing = getattr(ua, name, None)
+            if existing is not None and getattr(existing, 'data_type', None) == data_type:
+                continue
+            try:
+                env = await generate_object(name, sdef, data_type=data_type, log_fail=False)
+                cls = env[name]
+                cls.data_type = data_type
+                ua.register_extension_object(name, sdef.DefaultEncodingId, cls, data_type)
+            except NotImplementedError:
+                log.warning(f'Structure type {name} is not implemented.')
+            except (AttributeError, RuntimeError, KeyError, TypeError, ValueError):
+                failed.append((name, data_type, sdef))
+        if not failed:
+            break
+        structs = failed
+    for name, data_type, sdef in failed:
+        log.warning(f'Failure to resolve structure type {name} ({data_type}).')
+
+
+class type_cache(object):
+    """
+    disk cache of data type definitions of opcua server, reused while version of server data types is not changed
+    """
+
+    def __init__(self, uri, cache_dir=None):
+        self.uri = uri
+        self.cache_file = None
+        if cache_dir is not None:
+            self.cache_file = cache_dir / f'{hashlib.sha1(uri.encode()).hexdigest()[:16]}.json'
+        self.loaded_version = None  # version of definitions registered in this process
+
+    def read(self, version):
+        """
+        read definitions of version from cache file
+        """
+        if self.cache_file is None:
+            return None
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if cache.get('uri') != self.uri or cache.get('version') != version:
+            return None
+        return cache['definitions']
+
+    def write(self, version, defs):
+        """
+        save definitions of version to cache file
+        """
+        if self.cache_file is None:
+            return
+        try:
+            self.cache_file.parent.mkdir(exist_ok=True)
+            temp_path = f'{self.cache_file}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'uri': self.uri, 'version': version, 'definitions': defs}, f)
+            os.replace(temp_path, self.cache_file)
+        except Exception as e:
+            log.warning(f'Failure to save data type definitions of {self.uri}: {e}')
+
+    async def load(self, client):
+        """
+        register data type definitions of server, from this process, cache file or server
+        """
+        try:
+            version = await server_type_version(client)
+        except Exception as e:
+            log.warning(f'Failure to read data type version of {self.uri}: {e}')
+            version = None
+
+        if version is None:  # no version information, load from server every time
+            await client.load_data_type_definitions(overwrite_existing=True)
+            return
+        if version == self.loaded_version:  # reconnect, definitions are registered already
+            log.info(f'Data type definitions of {self.uri} are not changed, reuse.')
+            return
+        if not DISK_CACHE_SUPPORTED:  # definitions can't be saved with this asyncua version, only reused in process
+            await client.load_data_type_definitions(overwrite_existing=True)
+            self.loaded_version = version
+            return
+
+        defs = self.read(version)
+        if defs is not None:
+            try:
+                await register_type_definitions(defs)
+                self.loaded_version = version
+                log.info(f'Load data type definitions of {self.uri} from cache.')
+                return
+            except Exception as e:
+                log.warning(f'Failure to load data type definitions of {self.uri} from cache: {e}')
+
+        defs = await fetch_type_definitions(client)
+        await register_type_definitions(defs)
+        self.loaded_version = version
+        self.write(version, defs)
+        log.info(f'Load data type definitions of {self.uri} from server, saved to cache.')
@@ -0,0 +1,87 @@
+import csv
+import math
+
+# same as default na_values/true_values/false_values of pandas.read_csv, so the variable map is not changed
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+             'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+TRUE_VALUES = {'True', 'TRUE', 'true'}
+FALSE_VALUES = {'False', 'FALSE', 'false'}
+
+
+def _is_int(text):
+    try:
+        int(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_float(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _column_converter(values):
+    """
+    infer type of csv column like pandas: bool, int (float if column has empty cell), float or str
+    """
+    cells = [v for v in values if v not in NA_VALUES]
+    if not cells:
+        return lambda v: math.nan
+    if all(v in TRUE_VALUES or v in FALSE_VALUES for v in cells):
+        return lambda v: math.nan if v in NA_VALUES else v in TRUE_VALUES
+    if all(_is_int(v) for v in cells):
+        if len(cells) == len(values):
+            return int
+        return lambda v: math.nan if v in NA_VALUES else float(v)
+    if all(_is_float(v) for v in cells):
+        return lambda v: math.nan if v in NA_VALUES else float(v)
+    return lambda v: math.nan if v in NA_VALUES else v
+
+
+def read_csv_rows(csv_file, encodings=('utf-8', 'utf-8-sig', 'gbk')):
+    """
+    read csv file to list of dict, column type is inferred like pandas.read_csv
+    :return: (columns, rows)
+    """
+    for encoding in encodings:
+        try:
+            with open(csv_file, 'r', encoding=encoding, newline='') as f:
+                lines = list(csv.reader(f))
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError(f'Unknown encoding of {csv_file}')
+    if not lines:
+        return [], []
+
+    columns = lines[0]
+    if columns and columns[0].startswith('\ufeff'):  # utf-8 with BOM
+        columns[0] = columns[0][1:]
+    lines = [line + [''] * (len(columns) - len(line)) for line in lines[1:] if line]
+    converters = [_column_converter([line[i] for line in lines]) for i in range(len(columns))]
+    rows = [{c: convert(v) for c, convert, v in zip(columns, converters, line)} for line in lines]
+    return columns, rows
+
+
+def write_csv_rows(csv_file, rows, columns=None, encoding='utf-8'):
+    """
+    write list of dict to csv file, None and nan are written as empty cell
+    """
+    if columns is None:
+        columns = []
+    columns = list(columns)
+    for row in rows:
+        for k in row:
+            if k not in columns:
+                columns.append(k)
+    with open(csv_file, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(['' if v is None or (isinstance(v, float) and math.isnan(v)) else v
+                             for v in (row.get(c) for c in columns)])
@@ -62,32 +62,35 @@ def get_log_color(message):
     return LOG_COLOR_MAP['DEFAULT']  # 默认颜色
 
 
+# dataType 字符串 --> Python 类型
+DATA_TYPE_MAP = {
+    "unknown": None,
+    "null": None,
+    "Null": None,
+    "bool": bool,
+    "sbyte": int,
+    "byte": int,
+    "int16": int,
+    "uint16": int,
+    "int32": int,
+    "uint32": int,
+    "int64": int,
+    "uint64": int,
+    "float": float,
+    "double": float,
+    "string": str,
+    "bytes": bytes,
+    "datetime": int,
+    "guid": str,
+    "structure": dict,
+}
+
+
 def data_type_from_string(dtype):
     """
         定义一个函数来将 dataType 字符串转换为 Python 类型
     """
-    dtype_map = {
-        "unknown": None,
-        "null": None,
-        "Null": None,
-        "bool": bool,
-        "sbyte": int,
-        "byte": int,
-        "int16": int,
-        "uint16": int,
-        "int32": int,
-        "uint32": int,
-        "int64": int,
-        "uint64": int,
-        "float": float,
-        "double": float,
-        "string": str,
-        "bytes": bytes,
-        "datetime": int,
-        "guid": str,
-        "structure": dict,
-    }
-    return dtype_map.get(dtype, None)
+    return DATA_TYPE_MAP.get(dtype, None)
 
 
 def count_decimal_places(number):
@@ -0,0 +1,101 @@
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+class json_array_stream(object):
+    """
+    incremental parser of json object response, elements of the array at key are returned one by one as they arrive,
+    other top level fields are collected in header
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.header = {}  # top level fields except array at key
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'  # start, key, colon, value, array, element, next, end
+
+    def _skip(self):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+            self.pos += 1
+        return self.pos < len(self.buffer)
+
+    def _decode(self, final):
+        """
+        decode json value at position, None if value is not complete
+        number (and true/false/null) at end of buffer may be incomplete, wait for next char
+        """
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        if end == len(self.buffer) and not final and self.buffer[self.pos] not in '{["':
+            return None
+        raw = self.buffer[self.pos:end]
+        self.pos = end
+        return value, raw
+
+    def feed(self, text, final=False):
+        """
+        feed text of response
+        :param final: response is complete
+        :return: [(element, raw text of element),...] completed elements of array
+        """
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        elements = []
+        while self.state != 'end' and self._skip():
+            c = self.buffer[self.pos]
+            if self.state == 'start':
+                if c != '{':
+                    raise ValueError(f'Response is not json object: {self.buffer[:50]}')
+                self.pos += 1
+                self.state = 'key'
+            elif self.state == 'key':
+                if c == '}':
+                    self.pos += 1
+                    self.state = 'end'
+                    continue
+                if c == ',':
+                    self.pos += 1
+                    continue
+                decoded = self._decode(final)
+                if decoded is None:
+                    break
+                self.current_key = decoded[0]
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if c != ':':
+                    raise ValueError(f'Invalid json response near: {self.buffer[self.pos:self.pos + 50]}')
+                self.pos += 1
+                self.state = 'value'
+            elif self.state == 'value':
+                if self.current_key == self.key and c == '[':
+                    self.pos += 1
+                    self.state = 'element'
+                    continue
+                decoded = self._decode(final)
+                if decoded is None:
+                    break
+                self.header[self.current_key] = decoded[0]
+                self.state = 'key'
+            elif self.state == 'element':
+                if c == ']':
+                    self.pos += 1
+                    self.state = 'key'
+                    continue
+                decoded = self._decode(final)
+                if decoded is None:
+                    break
+                elements.append(decoded)
+                self.state = 'next'
+            elif self.state == 'next':
+                self.pos += 1
+                self.state = 'key' if c == ']' else 'element'
+        if final and self.state != 'end':
+            raise ValueError('Response is not complete.')
+        return elements
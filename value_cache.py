@@ -0,0 +1,83 @@
+import time
+
+
+class last_value_cache(object):
+    """
+    last value cache of device, update time, source/server timestamp and opcua status of variables,
+    values are kept in list node of variable map, entry of read block node also covers its children
+    """
+
+    def __init__(self):
+        # path of variable --> (update time ms, source timestamp, server timestamp, status code)
+        self.entries = {}
+
+    def record(self, list_node, data_value=None, rtime=None):
+        """
+        record update of variable
+        :param data_value: opcua DataValue of reading, None for s7 reading and subscription (local time, good)
+        :param rtime: update time (ms), now if None
+        """
+        if rtime is None:
+            rtime = int(time.time() * 1000)
+        if data_value is None:
+            self.entries[list_node['path']] = (rtime, None, None, None)
+        else:
+            self.entries[list_node['path']] = (rtime, data_value.SourceTimestamp, data_value.ServerTimestamp,
+                                               data_value.StatusCode)
+
+    def record_block(self, read_block, data_values=None):
+        """
+        record update of all variables of read block after successful reading
+        """
+        rtime = int(time.time() * 1000)
+        if data_values is None:
+            for b in read_block:
+                self.record(b['ListNode'], None, rtime)
+        else:
+            for b, dv in zip(read_block, data_values):
+                self.record(b['ListNode'], dv, rtime)
+
+    def get(self, list_node):
+        """
+        cache entry of variable, entry of nearest recorded parent if variable is child of structure or array
+        :return: (update time ms, source timestamp, server timestamp, status code), None if never updated
+        """
+        path = list_node['path']
+        while path:
+            entry = self.entries.get(path)
+            if entry is not None:
+                return entry
+            path = path.rpartition('/')[0]
+        return None
+
+    def is_fresh(self, list_node, max_age):
+        """
+        value of variable is good and updated within max age (ms)
+        """
+        entry = self.get(list_node)
+        if entry is None:
+            return False
+        status = entry[3]
+        if status is not None and not status.is_good():
+            return False
+        return int(time.time() * 1000) - entry[0] <= max_age
+
+    def quality(self, list_node):
+        """
+        quality fields of variable for mqtt reply
+        :return: {'quality','updateTime','sourceTime','serverTime'}
+        """
+        entry = self.get(list_node)
+        if entry is None:
+            return {'quality': 'Unknown', 'updateTime': None, 'sourceTime': None, 'serverTime': None}
+        rtime, source, server, status = entry
+        return {'quality': 'Good' if status is None else status.name,
+                'updateTime': rtime,
+                'sourceTime': int(source.timestamp() * 1000) if source is not None else None,
+                'serverTime': int(server.timestamp() * 1000) if server is not None else None}
+
+    def clear(self):
+        """
+        values are not updated after disconnecting, all entries are stale
+        """
+        self.entries.clear()
@@ -0,0 +1,107 @@
+import json
+import os
+
+from logger import log
+from utils.csv_util import read_csv_rows, write_csv_rows
+
+
+def read_variables_csv(csv_file):
+    """
+    read variable list csv file of device, try utf-8, utf-8-sig and gbk encoding
+    :return: (columns, variable list)
+    """
+    return read_csv_rows(csv_file, ('utf-8', 'utf-8-sig', 'gbk'))
+
+
+class variable_journal(object):
+    """
+    journal of runtime corrections of device variable list (data type changes, discovered variables),
+    corrections are appended to journal file, replayed when loading variable list and compacted into csv
+    """
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.csv_file = dev.base_dir / f'{dev.name}.csv'
+        self.journal_file = dev.base_dir / f'{dev.name}.journal'
+
+    def append(self, records):
+        """
+        append records to journal file, one json object per line
+        """
+        if not records:
+            return
+        try:
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in records))
+        except Exception as e:
+            log.warning(f'Failure to append {len(records)} records to {self.journal_file}: {e}')
+
+    def record_type(self, node_id, data_type, data_type_string):
+        """
+        data type of variable is changed
+        """
+        self.append([{'op': 'type', 'NodeID': node_id, 'DataType': data_type, 'DataTypeString': data_type_string}])
+
+    def record_rows(self, rows):
+        """
+        variables are discovered
+        """
+        self.append([{'op': 'add', 'row': row} for row in rows])
+
+    def load(self):
+        """
+        read records of journal file, broken line (power off while writing) is skipped
+        """
+        records = []
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        log.warning(f'Skip broken record of {self.journal_file}: {line}')
+        except FileNotFoundError:
+            pass
+        return records
+
+    def replay(self, rows, records=None):
+        """
+        apply journal records to variable list
+        :param rows: variable list [{},...], changed in place
+        :return: variable list
+        """
+        records = self.load() if records is None else records
+        node_ids = {}  # NodeID --> rows
+        for row in rows:
+            node_ids.setdefault(row.get('NodeID'), []).append(row)
+        for r in records:
+            if r.get('op') == 'add':
+                if r['row'].get('NodeID') not in node_ids:
+                    rows.append(r['row'])
+                    node_ids[r['row'].get('NodeID')] = [r['row']]
+            elif r.get('op') == 'type':
+                for row in node_ids.get(r['NodeID'], []):
+                    row['DataType'] = r['DataType']
+                    row['DataTypeString'] = r['DataTypeString']
+        return rows
+
+    def compact(self):
+        """
+        apply journal records to csv file and clear journal
+        """
+        records = self.load()
+        if not records:
+            return
+        try:
+            columns, rows = read_variables_csv(self.csv_file)
+            rows = self.replay(rows, records)
+            # 原子化写入
+            temp_path = f'{self.csv_file}.tmp'
+            write_csv_rows(temp_path, rows, columns)
+            os.replace(temp_path, self.csv_file)
+            os.remove(self.journal_file)
+            log.info(f'Compact {len(records)} journal records to {self.csv_file}.')
+        except FileNotFoundError:
+            log.warning(f'Failure to compact journal, {self.csv_file} is not found.')
+        except Exception as e:
+            log.warning(f'Failure to compact journal to {self.csv_file}: {e}')
@@ -0,0 +1,94 @@
+import asyncio
+
+from logger import log
+
+
+class write_aggregator(object):
+    """
+    write aggregator of device, merge pending write commands within a short window (last writer wins per variable),
+    write them with one request, every command gets result of its own variables
+    """
+
+    def __init__(self, dev, window=0.02):
+        self.dev = dev
+        self.window = window  # merge window (s)
+        self.pending = {}  # variable key --> M2O item, the last writer wins
+        self.waiters = []  # (future, variable keys) of merged write commands
+        self.flush_task = None
+
+    def variable_key(self, item):
+        """
+        key of variable in M2O item, NodeId for opcua, address for s7
+        """
+        if self.dev.link_type == 's7':
+            return item['s7_db'], item['s7_start'], item['s7_bit']
+        return item['node_id']
+
+    def submit(self, M2O_list):
+        """
+        add M2O list of write command to pending writes
+        :return: future of write result (True/False)
+        """
+        keys = set()
+        for item in M2O_list:
+            key = self.variable_key(item)
+            self.pending.pop(key, None)  # keep order of the last writer
+            self.pending[key] = item
+            keys.add(key)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((future, keys))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+        return future
+
+    async def flush(self):
+        """
+        write pending variables one batch after another, writes arrived while writing are merged to next batch
+        """
+        waiters = []
+        try:
+            while self.pending:
+                await asyncio.sleep(self.window)
+                variables = list(self.pending.values())
+                waiters, self.pending, self.waiters = self.waiters, {}, []
+                try:
+                    failed = await self.write(variables)
+                except Exception as e:
+                    log.warning(f'Failure to write merged {len(variables)} variables to {self.dev.name}: {e}')
+                    failed = set(self.variable_keys(variables))
+                if len(waiters) > 1:
+                    log.info(f'Merge {len(waiters)} write commands to {self.dev.name}, {len(variables)} variables, '
+                             f'{len(failed)} failed.')
+                for f, keys in waiters:
+                    if not f.done():
+                        f.set_result(not (keys & failed))
+        finally:
+            # cancelled while writing, waiting commands return failure
+            for f, _ in waiters + self.waiters:
+                if not f.done():
+                    f.set_result(False)
+            self.pending, self.waiters = {}, []
+            self.flush_task = None
+
+    def variable_keys(self, variables):
+        """
+        variable keys of M2O items
+        """
+        return [self.variable_key(v) for v in variables]
+
+    async def write(self, variables):
+        """
+        write variables to device, failed variables are checked once
+        :return: keys of failed variables
+        """
+        if self.dev.link_type == 'opcua':  # write via opcua
+            failed = []
+            if await self.dev.linker.write_multi_variables(variables, 0.5, failed=failed):
+                return set()
+            failed = failed or variables  # failed variables unknown, check all
+            if await self.dev.linker.check_write_result(failed):  # write opcua failure, read and check
+                return set()
+            return set(self.variable_keys(failed))
+        if await self.dev.linker.write_multi_variables(variables, 0.5):  # write via s7
+            return set()
+        return set(self.variable_keys(variables))